@@ -0,0 +1 @@
+# Administration module initialization
@@ -0,0 +1,71 @@
+"""
+Administration routes (restricted to ADMIN_EMAILS)
+"""
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from backend.auth.dependencies import get_admin_user
+from backend.config.settings import settings
+from backend.conversation.analytics import conversation_analytics
+from backend.schemas.auth import UserResponse
+from backend.utils.backup import BackupInProgress, database_backup
+from backend.utils.query_log import query_log
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+# ✅ Backup status, metrics of recent backups and the backups on disk
+@router.get("/backups")
+async def get_backups(admin: UserResponse = Depends(get_admin_user)):
+    return {
+        "running": database_backup.running,
+        "current_file": database_backup.current,
+        "recent": [result.as_dict() for result in reversed(database_backup.history)],
+        "backups": database_backup.list_backups(),
+    }
+
+# ✅ Start an online backup in the background
+@router.post("/backups", status_code=status.HTTP_202_ACCEPTED)
+async def start_backup(admin: UserResponse = Depends(get_admin_user)):
+    try:
+        database_backup.trigger()
+    except BackupInProgress as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"status": "started"}
+
+# ✅ Query timings per query shape, with the plans of slow queries
+@router.get("/queries")
+async def get_query_stats(
+    sort: Literal["total", "max", "count", "slow"] = "total",
+    limit: int = Query(50, ge=1, le=1000),
+    admin: UserResponse = Depends(get_admin_user)
+):
+    if not settings.query_stats:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Query statistics are disabled")
+    return query_log.stats(sort, limit)
+
+# ✅ Reset the query statistics
+@router.delete("/queries", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_query_stats(admin: UserResponse = Depends(get_admin_user)):
+    if not settings.query_stats:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Query statistics are disabled")
+    query_log.reset()
+
+# ✅ Messages per day, active users and peak hours over the last `days` days
+@router.get("/analytics")
+async def get_analytics(
+    days: int = Query(30, ge=1, le=366),
+    conversation_id: Optional[str] = None,
+    top: int = Query(10, ge=0, le=100),
+    utc_offset: int = Query(0, ge=-12 * 60, le=14 * 60, description="Minutes east of UTC that days and hours are counted in"),
+    admin: UserResponse = Depends(get_admin_user)
+):
+    if not conversation_analytics.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Analytics are disabled")
+    return await conversation_analytics.report(days, None, utc_offset, conversation_id, top)
+
+# ✅ Rebuild the analytics snapshot from stored messages (drops purged messages)
+@router.post("/analytics/rebuild", status_code=status.HTTP_202_ACCEPTED)
+async def rebuild_analytics(admin: UserResponse = Depends(get_admin_user)):
+    if not conversation_analytics.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Analytics are disabled")
+    await conversation_analytics.rebuild()
+    return {"status": "started"}
@@ -4,6 +4,7 @@ Authentication dependencies for FastAPI
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from backend.config.settings import settings
 from backend.utils.security import verify_token
 from backend.services.auth_service import auth_service
 from backend.schemas.auth import UserResponse
@@ -56,6 +57,29 @@ async def get_current_user(
     return user
 
 
+async def get_admin_user(
+    current_user: UserResponse = Depends(get_current_user)
+) -> UserResponse:
+    """
+    Dependency restricting an endpoint to the users listed in ADMIN_EMAILS
+    
+    Args:
+        current_user: Authenticated user
+        
+    Returns:
+        UserResponse: Current user information
+        
+    Raises:
+        HTTPException: If the user is not an administrator
+    """
+    if current_user.email.lower() not in settings.admin_emails:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator access required"
+        )
+    return current_user
+
+
 async def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
 ) -> Optional[UserResponse]:
@@ -0,0 +1,147 @@
+"""
+Benchmark the columnar analytics snapshot
+
+Fills a ColumnarSnapshot with N synthetic messages (10M by default): a year
+of timestamps with a daily peak, Zipf-distributed senders and conversations.
+Then measures appends (batched, as the startup catch-up does, and one by
+one, as the message listener does), activity reports over several windows,
+and saving and loading the snapshot. The report is compared with the same
+aggregation done per row in Python on a sample, extrapolated to N rows.
+
+Needs no database: rows are generated straight into the columns.
+
+Usage:
+    python -m backend.benchmarks.analytics [--rows N] [--users N] [--conversations N]
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+WORK_DIR = Path(tempfile.mkdtemp(prefix="chatbox-analytics-"))
+# Must be set before backend settings are imported
+os.environ["STORAGE_ENGINE"] = "memory"
+os.environ["ANALYTICS_DIR"] = str(WORK_DIR)
+
+import numpy as np  # noqa: E402
+from backend.conversation.analytics import (  # noqa: E402
+    SECONDS_PER_DAY, ColumnarSnapshot, activity_report
+)
+
+APPEND_BATCH = 5000
+NAIVE_SAMPLE = 1_000_000
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(phase: str, rows: int, seconds: float):
+    print(f"{phase:<28} {rows:>12,} rows  {seconds:>8.3f} s  {rows / seconds:>14,.0f} rows/s  "
+          f"peak RSS {peak_rss_mb():,.0f} MB")
+
+
+def generate(rng: np.random.Generator, rows: int, users: int, conversations: int, until: int):
+    """Timestamps over the year before `until` with more traffic in the afternoon, Zipf senders and conversations"""
+    days = rng.integers(0, 365, rows)
+    hours = np.clip(rng.normal(15, 4, rows), 0, 23.99)
+    timestamps = (until - (days + 1) * SECONDS_PER_DAY + (hours * 3600).astype(np.int64)).astype(np.uint32)
+    senders = (rng.zipf(1.3, rows) % users).astype(np.int32)
+    codes = (rng.zipf(1.2, rows) % conversations).astype(np.int32)
+    return codes, senders, timestamps
+
+
+def naive_report(codes, senders, timestamps, window_start: int) -> dict:
+    """The same aggregates, one row at a time"""
+    per_day = Counter()
+    per_conversation_day = Counter()
+    active = set()
+    by_hour = Counter()
+    for code, sender, timestamp in zip(codes.tolist(), senders.tolist(), timestamps.tolist()):
+        if timestamp < window_start:
+            continue
+        day = timestamp // SECONDS_PER_DAY
+        per_day[day] += 1
+        per_conversation_day[code, day] += 1
+        active.add((day, sender))
+        by_hour[timestamp % SECONDS_PER_DAY // 3600] += 1
+    return {"days": len(per_day), "active": len(active), "hours": len(by_hour)}
+
+
+def run(args):
+    rng = np.random.default_rng(42)
+    until = datetime.now(timezone.utc)
+    end = (int(until.timestamp()) // SECONDS_PER_DAY + 1) * SECONDS_PER_DAY
+
+    started = time.perf_counter()
+    codes, senders, timestamps = generate(rng, args.rows, args.users, args.conversations, end)
+    report("generate", args.rows, time.perf_counter() - started)
+
+    snapshot = ColumnarSnapshot()
+    conversation_ids = [f"conversation{code}" for code in range(args.conversations)]
+    for conversation_id in conversation_ids:
+        snapshot.code(conversation_id)
+
+    started = time.perf_counter()
+    for start in range(0, args.rows, APPEND_BATCH):
+        stop = start + APPEND_BATCH
+        snapshot.extend(codes[start:stop], senders[start:stop], timestamps[start:stop])
+    report(f"extend (x{APPEND_BATCH})", args.rows, time.perf_counter() - started)
+    column_bytes = sum(column.nbytes for column in snapshot.columns())
+    print(f"{'columns':<28} {column_bytes / 2 ** 20:>12,.0f} MB  ({column_bytes / args.rows:.0f} bytes/row)")
+
+    appends = min(args.rows, 1_000_000)
+    single = ColumnarSnapshot()
+    sample_codes, sample_senders, sample_timestamps = (
+        codes[:appends].tolist(), senders[:appends].tolist(), timestamps[:appends].tolist()
+    )
+    started = time.perf_counter()
+    for code, sender, timestamp in zip(sample_codes, sample_senders, sample_timestamps):
+        single.append(code, sender, timestamp)
+    report("append (listener)", appends, time.perf_counter() - started)
+    del single
+
+    columns = snapshot.columns()
+    for days in (1, 30, 365):
+        started = time.perf_counter()
+        result = activity_report(columns, conversation_ids, days, until, top=args.top)
+        report(f"report {days} days", args.rows, time.perf_counter() - started)
+    print(f"{'':<28} {result['messages']:,} messages, {result['active_users']['total']:,} active users, "
+          f"peak hour {result['peak_hours']['peak_hour']}")
+
+    started = time.perf_counter()
+    activity_report(columns, conversation_ids, 365, until, conversation_code=0, top=args.top)
+    report("report 365 days, 1 conv.", args.rows, time.perf_counter() - started)
+
+    sample = min(args.rows, NAIVE_SAMPLE)
+    started = time.perf_counter()
+    naive_report(codes[:sample], senders[:sample], timestamps[:sample], end - 365 * SECONDS_PER_DAY)
+    seconds = (time.perf_counter() - started) * args.rows / sample
+    report("per-row Python (estimated)", args.rows, seconds)
+
+    path = WORK_DIR / "messages.npz"
+    started = time.perf_counter()
+    snapshot.save(path)
+    report("save", args.rows, time.perf_counter() - started)
+    started = time.perf_counter()
+    loaded = ColumnarSnapshot.load(path)
+    report("load", loaded.size, time.perf_counter() - started)
+    path.unlink()
+    WORK_DIR.rmdir()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--conversations", type=int, default=200_000)
+    parser.add_argument("--top", type=int, default=10)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
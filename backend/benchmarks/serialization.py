@@ -0,0 +1,162 @@
+"""
+Benchmark response serialization for the chat read endpoints
+
+Compares the previous path (dicts or Prisma models handed to FastAPI, which
+runs jsonable_encoder and JSONResponse over them) with the direct-to-bytes
+serializers in backend.conversation.serializers.
+
+Records are pydantic models shaped like the generated Prisma models, so the
+benchmark runs without a database or a generated client.
+
+Usage:
+    python -m backend.benchmarks.serialization [--messages N] [--members N] [--conversations N]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from backend.conversation.serializers import encode_conversation, encode_history, encode_inbox
+from backend.benchmarks.wire_protocol import sample_text
+
+
+class User(BaseModel):
+    id: int
+    email: str
+    name: Optional[str] = None
+    password: Optional[str] = None
+    createdAt: datetime
+    updatedAt: datetime
+    conversations: Optional[list] = None
+    messages: Optional[list] = None
+    readStates: Optional[list] = None
+
+
+class Message(BaseModel):
+    id: str
+    content: str
+    sender: Optional[User] = None
+    senderId: int
+    conversation: Optional[dict] = None
+    conversationId: str
+    seq: int
+    createdAt: datetime
+    updatedAt: datetime
+
+
+class Conversation(BaseModel):
+    id: str
+    name: Optional[str] = None
+    lastSeq: int
+    users: Optional[List[User]] = None
+    messages: Optional[List[Message]] = None
+    readStates: Optional[list] = None
+
+
+def sample_conversation(index: int, messages: int, members: int, with_sender: bool) -> Conversation:
+    rng = random.Random(index)
+    start = datetime(2026, 10, 19, tzinfo=timezone.utc)
+    users = [
+        User(
+            id=user_id,
+            email=f"user{user_id}@example.com",
+            name=f"User {user_id}",
+            password="$2b$12$" + "x" * 53,
+            createdAt=start,
+            updatedAt=start,
+        )
+        for user_id in range(1, members + 1)
+    ]
+    conversation_id = f"cmddfr{index:019d}"
+    return Conversation(
+        id=conversation_id,
+        lastSeq=messages,
+        users=users,
+        messages=[
+            Message(
+                id=f"cmde{index:06d}{seq:015d}",
+                content=sample_text(rng, rng.choice((24, 80, 280))),
+                sender=users[seq % members] if with_sender else None,
+                senderId=users[seq % members].id,
+                conversationId=conversation_id,
+                seq=seq,
+                createdAt=start + timedelta(seconds=seq),
+                updatedAt=start + timedelta(seconds=seq),
+            )
+            for seq in range(1, messages + 1)
+        ],
+    )
+
+
+def render(content) -> bytes:
+    # What FastAPI does with a return value when there is no response model
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def previous_history(conversation: Conversation) -> bytes:
+    return render([
+        {
+            "id": message.id,
+            "seq": message.seq,
+            "text": message.content,
+            "sender": "me" if message.sender.id == 1 else "they",
+            "created_at": message.createdAt.isoformat(),
+            "updated_at": message.updatedAt.isoformat()
+        }
+        for message in conversation.messages
+    ])
+
+
+def previous_conversation(conversation: Conversation) -> bytes:
+    return render(conversation)
+
+
+def previous_inbox(conversations: List[Conversation]) -> bytes:
+    return render([{**conversation.model_dump(), "unread_count": 3} for conversation in conversations])
+
+
+def bench(function, argument, repeat: int) -> tuple:
+    body = function(argument)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(argument)
+    elapsed = time.perf_counter() - start
+    return len(body), elapsed / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=500, help="messages per conversation")
+    parser.add_argument("--members", type=int, default=5, help="members per conversation")
+    parser.add_argument("--conversations", type=int, default=50, help="conversations in the inbox")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    detail = sample_conversation(0, args.messages, args.members, with_sender=True)
+    inbox = [
+        sample_conversation(index, max(1, args.messages // 10), args.members, with_sender=False)
+        for index in range(args.conversations)
+    ]
+    unread = {conversation.id: 3 for conversation in inbox}
+
+    cases = [
+        ("history", "previous", previous_history, detail),
+        ("history", "serializer", lambda c: encode_history(c.messages, 1), detail),
+        ("conversation", "previous", previous_conversation, detail),
+        ("conversation", "serializer", encode_conversation, detail),
+        ("inbox", "previous", previous_inbox, inbox),
+        ("inbox", "serializer", lambda c: encode_inbox(c, unread), inbox),
+    ]
+
+    print(f"{args.messages} messages, {args.members} members, {args.conversations} inbox conversations\n")
+    print(f"{'endpoint':<13} {'path':<11} {'bytes':>10} {'ms/response':>12}")
+    for endpoint, path, function, argument in cases:
+        size, millis = bench(function, argument, args.repeat)
+        print(f"{endpoint:<13} {path:<11} {size:>10} {millis:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
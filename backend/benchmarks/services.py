@@ -0,0 +1,112 @@
+"""
+Benchmark the chat and auth service layers on in-memory storage
+
+Runs ChatService and AuthService on MemoryStorage, so the numbers measure the
+application code (member caching, batch loaders, seq allocation, record
+handling) without a database: users are created, conversations opened
+between random members, messages sent, then history pages, conversations
+and inboxes read back. Throughput is reported per phase.
+
+Usage:
+    python -m backend.benchmarks.services [--users N] [--conversations N] [--messages N]
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+
+# Must be set before backend settings are imported
+os.environ["STORAGE_ENGINE"] = "memory"
+os.environ["MESSAGE_PARTITIONS"] = "0"
+os.environ["ARCHIVE_DIR"] = tempfile.mkdtemp(prefix="chatbox-services-")
+
+import asyncio  # noqa: E402
+import alog  # noqa: E402
+from backend.benchmarks.wire_protocol import sample_text  # noqa: E402
+from backend.conversation.chat import ChatService  # noqa: E402
+from backend.services.auth_service import AuthService  # noqa: E402
+from backend.storage.memory_store import MemoryStorage  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(phase: str, operations: int, seconds: float):
+    print(f"{phase:<20} {operations:>10,} ops  {seconds:>8.2f} s  {operations / seconds:>10,.0f} ops/s  "
+          f"peak RSS {peak_rss_mb():,.0f} MB")
+
+
+async def run(args):
+    storage = MemoryStorage()
+    auth = AuthService(storage)
+    chat = ChatService(storage)
+    rng = random.Random(42)
+    texts = [sample_text(rng, rng.choice((24, 80, 280))) for _ in range(1000)]
+
+    started = time.perf_counter()
+    user_ids = [
+        (await storage.create_user(f"user{index}@example.com", f"User {index}", None)).id
+        for index in range(args.users)
+    ]
+    report("create users", args.users, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    conversations = []
+    for _ in range(args.conversations):
+        members = rng.sample(user_ids, rng.choice((2, 2, 2, 3, 5)))
+        conversation = await chat.create_conversation(members)
+        conversations.append((conversation.id, members))
+    report("create conversations", args.conversations, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for index in range(args.messages):
+        conversation_id, members = conversations[index % len(conversations)]
+        await chat.add_message(conversation_id, members[index % len(members)], texts[index % len(texts)])
+    report("add_message", args.messages, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batches = args.messages // 50
+    for index in range(batches):
+        conversation_id, members = conversations[index % len(conversations)]
+        await chat.add_messages(members[0], [(conversation_id, texts[i % len(texts)]) for i in range(50)])
+    report("add_messages (x50)", batches * 50, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    reads = args.messages // 10
+    for index in range(reads):
+        conversation_id, members = conversations[index % len(conversations)]
+        await chat.get_messages(conversation_id, members[0], since_seq=index % 40, limit=50)
+    report("get_messages (50)", reads, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    loads = min(reads, args.conversations)
+    await asyncio.gather(*(chat.get_conversation(conversation_id) for conversation_id, _ in conversations[:loads]))
+    report("get_conversation", loads, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        await chat.list_conversations(user_id)
+    report("list_conversations", len(user_ids), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(auth.get_current_user(user_id) for user_id in user_ids))
+    report("get_current_user", len(user_ids), time.perf_counter() - started)
+
+    await chat.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--conversations", type=int, default=20_000)
+    parser.add_argument("--messages", type=int, default=200_000)
+    # Per-message info logs would dominate the timings
+    alog.set_level("WARNING")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark NDJSON bulk import and streaming export
+
+Generates an NDJSON file with N messages (10M by default) spread over a
+number of conversations, imports it with the batched importer, then streams
+every conversation back out through the export path. Throughput and peak
+RSS are reported per phase; flat RSS across dataset sizes shows that both
+directions run in constant memory.
+
+Runs against partitioned message storage in a scratch directory, so no
+Prisma client or main database is needed and nothing touches real data.
+
+Usage:
+    BENCH_PARTITIONS=4 python -m backend.benchmarks.transfer [--messages N] [--conversations N] [--keep]
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+WORK_DIR = Path(tempfile.mkdtemp(prefix="chatbox-transfer-"))
+# Must be set before backend settings are imported
+os.environ["MESSAGE_PARTITIONS"] = os.environ.get("BENCH_PARTITIONS", "4")
+os.environ["MESSAGE_PARTITION_DIR"] = str(WORK_DIR / "partitions")
+os.environ["ARCHIVE_DIR"] = str(WORK_DIR / "archive")
+
+import asyncio  # noqa: E402
+from json.encoder import encode_basestring  # noqa: E402
+from backend.benchmarks.wire_protocol import sample_text  # noqa: E402
+from backend.conversation.chat import chat_service  # noqa: E402
+from backend.conversation.serializers import encode_export_messages  # noqa: E402
+from backend.conversation.transfer import NDJSONImporter  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate(path: Path, messages: int, conversations: int) -> float:
+    """Write a synthetic export; returns seconds taken"""
+    rng = random.Random(42)
+    texts = [encode_basestring(sample_text(rng, rng.choice((24, 80, 280)))) for _ in range(1000)]
+    seqs = [0] * conversations
+    started = time.perf_counter()
+    with open(path, "w", encoding="utf-8") as out:
+        lines = []
+        for index in range(messages):
+            conversation = index % conversations
+            seqs[conversation] += 1
+            lines.append(
+                f'{{"type":"message","conversation_id":"cbench{conversation:019d}","seq":{seqs[conversation]},'
+                f'"sender_id":{1 + index % 7},"content":{texts[index % len(texts)]},'
+                f'"created_at":"2026-10-19T10:41:44.843717+00:00"}}\n'
+            )
+            if len(lines) == 10_000:
+                out.writelines(lines)
+                lines = []
+        out.writelines(lines)
+    return time.perf_counter() - started
+
+
+async def export_all(path: Path, conversations: int) -> int:
+    written = 0
+    with open(path, "wb") as out:
+        for conversation in range(conversations):
+            async for messages in chat_service.iter_messages(f"cbench{conversation:019d}"):
+                chunk = encode_export_messages(messages)
+                out.write(chunk)
+                written += len(messages)
+    return written
+
+
+async def run(args):
+    source = WORK_DIR / "source.ndjson"
+    exported = WORK_DIR / "export.ndjson"
+
+    seconds = generate(source, args.messages, args.conversations)
+    size_mb = source.stat().st_size / 1e6
+    print(f"generate  {args.messages:>12,} msgs  {size_mb:>9,.0f} MB  {seconds:>8.1f} s  "
+          f"{args.messages / seconds:>10,.0f} msg/s  peak RSS {peak_rss_mb():,.0f} MB")
+
+    importer = NDJSONImporter(source, args.batch_size, resume=False)
+    started = time.perf_counter()
+    inserted = await importer.run()
+    seconds = time.perf_counter() - started
+    print(f"import    {inserted:>12,} msgs  {size_mb:>9,.0f} MB  {seconds:>8.1f} s  "
+          f"{inserted / seconds:>10,.0f} msg/s  peak RSS {peak_rss_mb():,.0f} MB")
+
+    started = time.perf_counter()
+    written = await export_all(exported, args.conversations)
+    seconds = time.perf_counter() - started
+    print(f"export    {written:>12,} msgs  {exported.stat().st_size / 1e6:>9,.0f} MB  {seconds:>8.1f} s  "
+          f"{written / seconds:>10,.0f} msg/s  peak RSS {peak_rss_mb():,.0f} MB")
+
+    await chat_service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--keep", action="store_true", help=f"keep the scratch files in {WORK_DIR}")
+    args = parser.parse_args()
+
+    print(f"scratch directory {WORK_DIR}, {os.environ['MESSAGE_PARTITIONS']} partitions "
+          f"(set BENCH_PARTITIONS to change)\n")
+    try:
+        asyncio.run(run(args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
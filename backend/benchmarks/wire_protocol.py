@@ -0,0 +1,125 @@
+"""
+Benchmark bytes on the wire and CPU per message for WebSocket frame encodings
+
+Compares the JSON text envelope (with and without per-connection
+permessage-deflate, which compresses every frame once per recipient) against
+the binary MessagePack frame from backend.utils.wire, which is encoded and
+compressed once per broadcast.
+
+Usage:
+    python -m backend.benchmarks.wire_protocol [--messages N] [--recipients N]
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+from backend.utils.wire import Frame
+
+CONTENT_SIZES = {"short": 24, "medium": 280, "long": 2400}
+
+
+WORDS = (
+    "hey are you coming to the meeting later I think we should push the release "
+    "to friday because the tests are still flaky on the build server ok sounds good "
+    "let me check with the team and get back to you lunch tomorrow maybe"
+).split()
+
+
+def sample_text(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def sample_payloads(count: int, content_length: int) -> list:
+    rng = random.Random(content_length)
+    return [
+        {
+            "type": "message",
+            "conversation_id": "cmddfr2dc0000myimcjasyi64",
+            "message": {
+                "id": f"cmde{i:021d}",
+                "conversation_id": "cmddfr2dc0000myimcjasyi64",
+                "seq": 100_000 + i,
+                "sender_id": 1 + i % 7,
+                "content": sample_text(rng, content_length),
+                "created_at": "2026-10-19T10:41:44.843717",
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def bench_json(payloads: list, recipients: int) -> tuple:
+    start = time.perf_counter()
+    frames = [json.dumps(payload) for payload in payloads]
+    elapsed = time.perf_counter() - start
+    return sum(len(f.encode()) for f in frames) / len(frames), elapsed / len(frames) * 1e6
+
+
+def bench_json_deflate(payloads: list, recipients: int) -> tuple:
+    # permessage-deflate keeps one compression context per connection, so a
+    # broadcast compresses the same frame once for every recipient
+    contexts = [zlib.compressobj(6, zlib.DEFLATED, -15) for _ in range(recipients)]
+    total_bytes = 0
+    start = time.perf_counter()
+    for payload in payloads:
+        data = json.dumps(payload).encode()
+        for context in contexts:
+            compressed = context.compress(data) + context.flush(zlib.Z_SYNC_FLUSH)
+        total_bytes += len(compressed) - 4  # the trailing 00 00 ff ff is stripped on the wire
+    elapsed = time.perf_counter() - start
+    return total_bytes / len(payloads), elapsed / len(payloads) * 1e6
+
+
+def bench_frame_text(payloads: list, recipients: int) -> tuple:
+    start = time.perf_counter()
+    frames = [Frame(payload) for payload in payloads]
+    for frame in frames:
+        for _ in range(recipients):
+            frame.text()
+    elapsed = time.perf_counter() - start
+    return sum(len(f.text().encode()) for f in frames) / len(frames), elapsed / len(frames) * 1e6
+
+
+def bench_frame_binary(payloads: list, recipients: int) -> tuple:
+    start = time.perf_counter()
+    frames = [Frame(payload) for payload in payloads]
+    for frame in frames:
+        for _ in range(recipients):
+            frame.binary()
+    elapsed = time.perf_counter() - start
+    return sum(len(f.binary()) for f in frames) / len(frames), elapsed / len(frames) * 1e6
+
+
+BENCHMARKS = [
+    ("json text (previous)", bench_json),
+    ("json + permessage-deflate", bench_json_deflate),
+    ("compact json frame", bench_frame_text),
+    ("msgpack binary frame", bench_frame_binary),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--recipients", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.messages} messages, {args.recipients} recipients per broadcast\n")
+    print(f"{'content':<8} {'encoding':<28} {'bytes/msg':>10} {'us/broadcast':>13}")
+    for size_name, length in CONTENT_SIZES.items():
+        payloads = sample_payloads(args.messages, length)
+        for name, bench in BENCHMARKS:
+            size, micros = bench(payloads, args.recipients)
+            print(f"{size_name:<8} {name:<28} {size:>10.1f} {micros:>13.2f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,25 @@
-import asyncio, websockets
+import asyncio, json, websockets
+
+async def receive(websocket):
+    # Answer server heartbeats so the connection is not reaped while idle
+    async for frame in websocket:
+        if frame.startswith("{") and json.loads(frame).get("type") == "ping":
+            await websocket.send(json.dumps({"type": "pong"}))
+        else:
+            print(f"Received: {frame}")
 
 async def connect():
     # Use a CUID format for conversation_id (you'll need to get this from your app)
     conversation_id = input("Enter conversation ID: ") or "cl9ebqhxk00008eqf00000000"
-    uri = f"ws://localhost:8000/ws/{conversation_id}?user_id=1"
+    # The access_token returned by /api/auth/signin
+    token = input("Enter access token: ")
+    uri = f"ws://localhost:8000/ws/{conversation_id}?token={token}"
     async with websockets.connect(uri) as websocket:
         print("Connected to websocket server")
+        asyncio.create_task(receive(websocket))
 
         while True:
-            message = input("Enter message: ")
+            message = await asyncio.to_thread(input, "Enter message: ")
             await websocket.send(message)
             print(f"Sent: {message}")
 
@@ -29,6 +29,11 @@ class Settings:
             # Use the URL as-is (for absolute paths)
             self.database_url = db_url
 
+        # Storage behind the chat and auth services: "prisma" (the database) or "memory" (nothing persisted)
+        self.storage_engine = os.getenv("STORAGE_ENGINE", "prisma").lower()
+        # Switch the main database to WAL mode on connect, so readers (and online backups) never block writers
+        self.database_wal = os.getenv("DATABASE_WAL", "true").lower() == "true"
+
         # JWT Settings
         self.jwt_secret_key = os.getenv("JWT_SECRET_KEY")
         if not self.jwt_secret_key:
@@ -49,11 +54,106 @@ class Settings:
         self.smtp_use_tls = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
         self.email_from = os.getenv("EMAIL_FROM")
         self.email_from_name = os.getenv("EMAIL_FROM_NAME", "Chat App")
+        # Logged-in SMTP connections kept open for reuse, and how long an idle one is trusted
+        self.mail_pool_size = int(os.getenv("MAIL_POOL_SIZE", "2"))
+        self.mail_pool_idle_timeout = float(os.getenv("MAIL_POOL_IDLE_TIMEOUT", "60"))
 
         # Application
         self.app_name = os.getenv("APP_NAME", "Chat Application")
         self.debug = os.getenv("DEBUG", "false").lower() == "true"
 
+        # WebSocket heartbeats
+        self.ws_heartbeat_interval = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+        self.ws_heartbeat_timeout = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "10"))
+        # Binary frames at or above this many bytes are deflated once per broadcast
+        self.ws_compress_threshold = int(os.getenv("WS_COMPRESS_THRESHOLD", "512"))
+        self.ws_compress_level = int(os.getenv("WS_COMPRESS_LEVEL", "6"))
+
+        # Read receipts are coalesced in memory and written in batches
+        self.read_receipt_flush_interval = float(os.getenv("READ_RECEIPT_FLUSH_INTERVAL", "2"))
+        self.read_receipt_flush_batch = int(os.getenv("READ_RECEIPT_FLUSH_BATCH", "500"))
+
+        # Messages are spread over this many SQLite files by conversation (0 keeps them in DATABASE_URL)
+        self.message_partitions = int(os.getenv("MESSAGE_PARTITIONS", "0"))
+        self.message_partition_dir = os.getenv("MESSAGE_PARTITION_DIR", str(PROJECT_ROOT / "prisma" / "partitions"))
+
+        # Messages older than this many days are moved to compressed archive files (0 disables)
+        self.archive_after_days = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+        self.archive_dir = os.getenv("ARCHIVE_DIR", str(PROJECT_ROOT / "prisma" / "archive"))
+        self.archive_interval = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+        self.archive_batch = int(os.getenv("ARCHIVE_BATCH", "5000"))
+
+        # Messages older than this many days are deleted (0 keeps them; conversations can override)
+        self.retention_days = float(os.getenv("RETENTION_DAYS", "0"))
+        self.retention_interval = float(os.getenv("RETENTION_INTERVAL", "3600"))
+        # The purge job deletes at most this many rows per transaction, shrinking the batch
+        # while a delete takes longer than PURGE_SLICE_MS, and sleeps PURGE_PAUSE seconds between batches
+        self.purge_batch = int(os.getenv("PURGE_BATCH", "1000"))
+        self.purge_slice_ms = float(os.getenv("PURGE_SLICE_MS", "50"))
+        self.purge_pause = float(os.getenv("PURGE_PAUSE", "0.05"))
+        # Free pages returned to the filesystem per incremental vacuum step
+        self.vacuum_pages = int(os.getenv("VACUUM_PAGES", "256"))
+
+        # HTTP responses at or above this many bytes are gzipped
+        self.gzip_minimum_size = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+        self.gzip_compress_level = int(os.getenv("GZIP_COMPRESS_LEVEL", "6"))
+
+        # Idempotency keys of sent messages are remembered per user, bounded by count and age
+        self.idempotency_cache_size = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "50000"))
+        self.idempotency_ttl = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+        # Users allowed to call the /admin endpoints
+        self.admin_emails = {
+            email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()
+        }
+
+        # Online backups of the main database and the message partitions (BACKUP_INTERVAL=0: on demand only)
+        self.backup_dir = os.getenv("BACKUP_DIR", str(PROJECT_ROOT / "prisma" / "backups"))
+        self.backup_interval = float(os.getenv("BACKUP_INTERVAL", "0"))
+        self.backup_keep = int(os.getenv("BACKUP_KEEP", "7"))
+        # Pages copied per step of the SQLite backup API, and the pause that lets writers in between steps
+        self.backup_step_pages = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+        self.backup_step_pause = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+        self.backup_compress_level = int(os.getenv("BACKUP_COMPRESS_LEVEL", "6"))
+
+        # Per-query-shape timings; queries slower than SLOW_QUERY_MS are logged, with their query
+        # plan if QUERY_PLAN_CAPTURE is on. Both cost something on every query, so both are opt-in.
+        self.query_stats = os.getenv("QUERY_STATS", "false").lower() == "true"
+        self.slow_query_ms = float(os.getenv("SLOW_QUERY_MS", "100"))
+        self.query_plan_capture = os.getenv("QUERY_PLAN_CAPTURE", "false").lower() == "true"
+
+        # Warm caches in the background after startup; /ready answers 503 until done
+        self.warmup = os.getenv("WARMUP", "true").lower() == "true"
+        self.warmup_conversations = int(os.getenv("WARMUP_CONVERSATIONS", "1000"))
+
+        # Presence frames are sent at most once per PRESENCE_INTERVAL seconds per conversation;
+        # typing indicators that are not refreshed expire after TYPING_TTL seconds
+        self.presence_interval = float(os.getenv("PRESENCE_INTERVAL", "1"))
+        self.typing_ttl = float(os.getenv("TYPING_TTL", "6"))
+
+        # Members without a socket get one email per DIGEST_WINDOW seconds summing up what they missed
+        # (0 disables), sent to DIGEST_BATCH recipients at a time
+        self.digest_window = float(os.getenv("DIGEST_WINDOW", "900"))
+        self.digest_batch = int(os.getenv("DIGEST_BATCH", "100"))
+
+        # Attachments: content-addressed files under ATTACHMENT_DIR, uploaded in resumable chunks;
+        # unfinished uploads are deleted after ATTACHMENT_UPLOAD_TTL seconds
+        self.attachment_dir = os.getenv("ATTACHMENT_DIR", str(PROJECT_ROOT / "prisma" / "attachments"))
+        self.attachment_max_size = int(os.getenv("ATTACHMENT_MAX_SIZE", str(25 * 1024 * 1024)))
+        self.attachment_chunk_size = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(4 * 1024 * 1024)))
+        self.attachment_upload_ttl = float(os.getenv("ATTACHMENT_UPLOAD_TTL", "86400"))
+
+        # Activity analytics: a columnar snapshot of message metadata, saved under ANALYTICS_DIR
+        # every ANALYTICS_SAVE_INTERVAL seconds so a restart only reads newer messages
+        self.analytics = os.getenv("ANALYTICS", "true").lower() == "true"
+        self.analytics_dir = os.getenv("ANALYTICS_DIR", str(PROJECT_ROOT / "prisma" / "analytics"))
+        self.analytics_save_interval = float(os.getenv("ANALYTICS_SAVE_INTERVAL", "300"))
+
+        # Graceful drain on SIGTERM: sockets are closed within DRAIN_TIMEOUT seconds and told
+        # to wait a random 0..RECONNECT_JITTER seconds before reconnecting
+        self.drain_timeout = float(os.getenv("DRAIN_TIMEOUT", "10"))
+        self.reconnect_jitter = float(os.getenv("RECONNECT_JITTER", "15"))
+
         # CORS
         cors_origins_str = os.getenv("CORS_ORIGINS", "http://localhost:3000")
         self.cors_origins = [origin.strip() for origin in cors_origins_str.split(",")]
@@ -1,30 +1,343 @@
-from fastapi import WebSocket, WebSocketDisconnect
-from collections import defaultdict
-from typing import Dict, List
+from fastapi import WebSocket, status
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+import asyncio
+import json
+import random
 import alog
+from backend.config.settings import settings
+from backend.utils.timer_wheel import TimerWheel
+from backend.utils.wire import BINARY_SUBPROTOCOL, Frame
+
+PING_FRAME = Frame({"type": "ping"})
+# Called with (user_id, online) when a user's first socket opens or last socket closes
+PresenceListener = Callable[[int, bool], None]
+# Sockets closed at once per wave while draining
+DRAIN_WAVE_SIZE = 500
+
+
+def parse_control_frame(data: str) -> Optional[dict]:
+    """
+    Parse a JSON control frame (pong or resume) sent by a client
+
+    Returns:
+        Optional[dict]: The frame if `data` is a control frame, otherwise None
+    """
+    if not data.startswith("{"):
+        return None
+    try:
+        frame = json.loads(data)
+    except ValueError:
+        return None
+    if isinstance(frame, dict) and frame.get("type") in ("pong", "resume"):
+        return frame
+    return None
+
+
+class Connection:
+    """An open socket, the user and conversations it is subscribed to, and its liveness state"""
+    __slots__ = ("websocket", "user_id", "conversations", "multiplexed", "binary", "last_seen", "ping_sent_at")
+
+    def __init__(self, websocket: WebSocket, user_id: Optional[int], multiplexed: bool, binary: bool, now: float):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.conversations: Set[str] = set()
+        # Multiplexed sockets speak the subscribe/send frame protocol
+        self.multiplexed = multiplexed
+        # Binary sockets negotiated the MessagePack subprotocol
+        self.binary = binary
+        self.last_seen = now
+        self.ping_sent_at = 0.0
+
 
 class ConnectionManager:
     def __init__(self):
-        # Map of conversation_id -> list of WebSockets
-        self.active_connections: Dict[str, List[WebSocket]] = defaultdict(list)
+        # Registry indexes; every connect/disconnect is O(1) set/dict work
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.active_connections: Dict[str, Set[Connection]] = {}
+        self.user_connections: Dict[int, Set[Connection]] = {}
+        # Heartbeat deadlines for every socket share one wheel and one task
+        self.heartbeat_interval = settings.ws_heartbeat_interval
+        self.heartbeat_timeout = settings.ws_heartbeat_timeout
+        self._wheel = TimerWheel(tick=1.0, slots=64)
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Fan-outs still writing to their sockets, awaited by drain()
+        self._sending: Set[asyncio.Future] = set()
+        # Set by drain(); new sockets are refused from then on
+        self.draining = False
+        self.reconnect_jitter = settings.reconnect_jitter
+        self._presence_listeners: List[PresenceListener] = []
 
-    async def connect(self, conversation_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[conversation_id].append(websocket)
+    def add_presence_listener(self, listener: PresenceListener):
+        """Register a callback for users coming online or going offline"""
+        self._presence_listeners.append(listener)
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: Optional[int] = None,
+        conversation_id: Optional[str] = None,
+        multiplexed: bool = False,
+        subprotocol: Optional[str] = None
+    ) -> Connection:
+        await websocket.accept(subprotocol=subprotocol)
+
+        connection = Connection(
+            websocket,
+            user_id,
+            multiplexed,
+            subprotocol == BINARY_SUBPROTOCOL,
+            asyncio.get_running_loop().time()
+        )
+        self.connections[websocket] = connection
+        if conversation_id is not None:
+            self.subscribe(connection, conversation_id)
+        if user_id is not None:
+            came_online = user_id not in self.user_connections
+            self.user_connections.setdefault(user_id, set()).add(connection)
+            if came_online:
+                self._notify_presence(user_id, True)
+
+        self._wheel.schedule(connection, self.heartbeat_interval)
+        self._ensure_heartbeat_task()
+        return connection
 
-    def disconnect(self, conversation_id: str, websocket: WebSocket):
-        self.active_connections[conversation_id].remove(websocket)
-        if not self.active_connections[conversation_id]:
-            del self.active_connections[conversation_id]
+    def disconnect(self, websocket: WebSocket):
+        # May be called twice for the same socket (reaper + receive loop)
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        self._wheel.cancel(connection)
+        for conversation_id in connection.conversations:
+            self._discard(self.active_connections, conversation_id, connection)
+        if connection.user_id is not None:
+            self._discard(self.user_connections, connection.user_id, connection)
+            if connection.user_id not in self.user_connections:
+                self._notify_presence(connection.user_id, False)
+
+    def subscribe(self, connection: Connection, conversation_id: str):
+        connection.conversations.add(conversation_id)
+        self.active_connections.setdefault(conversation_id, set()).add(connection)
+
+    def unsubscribe(self, connection: Connection, conversation_id: str):
+        connection.conversations.discard(conversation_id)
+        self._discard(self.active_connections, conversation_id, connection)
+
+    def touch(self, websocket: WebSocket):
+        """Record inbound traffic from a socket; any frame counts as a pong"""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = asyncio.get_running_loop().time()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Connection counts for metrics
+
+        Returns:
+            Dict[str, int]: Open sockets, conversations and users with at least one socket
+        """
+        return {
+            "connections": len(self.connections),
+            "conversations": len(self.active_connections),
+            "users": len(self.user_connections),
+        }
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.user_connections
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
-    async def broadcast(self, conversation_id: str, message: str, sender: WebSocket):
-        connections = self.active_connections.get(conversation_id, [])
+    async def send(self, connections: Iterable[Connection], message: Union[str, Frame]):
+        """
+        Send a message to the given connections, evicting any that fail
+
+        Frames are encoded once per wire format and the bytes are shared by
+        every recipient; plain strings are sent as-is as text.
+        """
+        # Snapshot first: evictions mutate the index sets while we await
+        sending = asyncio.gather(*[self._send_or_evict(connection, message) for connection in list(connections)])
+        self._sending.add(sending)
+        sending.add_done_callback(self._sending.discard)
+        await sending
+
+    async def send_to_user(self, user_id: int, message: Union[str, Frame]):
+        """Send a message to every socket (device) a user has open"""
+        await self.send(self.user_connections.get(user_id, ()), message)
+
+    async def broadcast(self, conversation_id: str, message: Union[str, Frame], sender: Optional[WebSocket] = None):
+        connections = [
+            connection
+            for connection in self.active_connections.get(conversation_id, ())
+            if connection.websocket is not sender
+        ]
+        alog.debug(f"Broadcasting to {len(connections)} connections in conversation {conversation_id}")
+        await self.send(connections, message)
+
+    def reconnect_hint(self) -> int:
+        """Milliseconds a client should wait before reconnecting, jittered so a restart does not cause a reconnect storm"""
+        return random.randint(0, int(self.reconnect_jitter * 1000))
+
+    async def refuse(self, websocket: WebSocket):
+        """Turn away a socket that arrived while draining, telling it when to come back"""
+        await websocket.accept()
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART, reason=self._restart_reason(self.reconnect_hint()))
+
+    async def drain(self, timeout: float):
+        """
+        Close every socket for a restart, within `timeout` seconds
+
+        New sockets are refused from here on. Fan-outs already in flight
+        are allowed to finish, then each socket gets a `reconnect` frame and
+        a 1012 (service restart) close frame, both carrying a jittered
+        `reconnect_after_ms` hint. Large registries are closed in waves
+        spread over half the remaining time, so clients that ignore the
+        hint do not all come back at once either.
+
+        Args:
+            timeout: Seconds until every socket must be closed
+        """
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        if self._sending:
+            await asyncio.wait(list(self._sending), timeout=timeout / 2)
+
+        connections = list(self.connections.values())
+        random.shuffle(connections)
+        waves = [connections[start:start + DRAIN_WAVE_SIZE] for start in range(0, len(connections), DRAIN_WAVE_SIZE)]
+        spacing = max(0.0, deadline - loop.time()) / 2 / max(len(waves), 1)
+        alog.info(f"Draining {len(connections)} sockets in {len(waves)} waves")
+
+        for index, wave in enumerate(waves):
+            started = loop.time()
+            remaining = deadline - started
+            if remaining <= 0:
+                break
+            await asyncio.gather(*(
+                self._close_for_restart(connection, min(self.heartbeat_timeout, remaining)) for connection in wave
+            ))
+            if index < len(waves) - 1:
+                await asyncio.sleep(max(0.0, started + spacing - loop.time()))
+
+        # Past the deadline: forget whatever did not close in time
+        for websocket in list(self.connections):
+            self.disconnect(websocket)
+
+    async def stop(self):
+        """Stop the heartbeat task. Should be called during application shutdown."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+
+    def _notify_presence(self, user_id: int, online: bool):
+        for listener in self._presence_listeners:
+            try:
+                listener(user_id, online)
+            except Exception as e:
+                alog.error(f"Presence listener failed for user {user_id}: {e}")
+
+    @staticmethod
+    def _discard(index: Dict, key, connection: Connection):
+        connections = index.get(key)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del index[key]
+
+    @staticmethod
+    def _write(connection: Connection, message: Union[str, Frame]):
+        websocket = connection.websocket
+        if isinstance(message, str):
+            return websocket.send_text(message)
+        if connection.binary:
+            return websocket.send_bytes(message.binary())
+        return websocket.send_text(message.text())
+
+    @staticmethod
+    def _restart_reason(after_ms: int) -> str:
+        # Close reasons are limited to 123 bytes; this stays far below
+        return json.dumps({"reconnect_after_ms": after_ms})
+
+    async def _send_or_evict(self, connection: Connection, message: Union[str, Frame]):
+        try:
+            await asyncio.wait_for(self._write(connection, message), timeout=self.heartbeat_timeout)
+        except Exception as e:
+            alog.info(f"Evicting socket after failed send: {e!r}")
+            await self._evict(connection)
+
+    async def _evict(self, connection: Connection):
+        if self.connections.get(connection.websocket) is not connection:
+            return
+        self.disconnect(connection.websocket)
+        try:
+            await asyncio.wait_for(
+                connection.websocket.close(code=status.WS_1001_GOING_AWAY),
+                timeout=self.heartbeat_timeout
+            )
+        except Exception:
+            # The peer is already gone; nothing left to clean up
+            pass
+
+    async def _close_for_restart(self, connection: Connection, timeout: float):
+        self.disconnect(connection.websocket)
+        after_ms = self.reconnect_hint()
+        try:
+            await asyncio.wait_for(self._say_goodbye(connection, after_ms), timeout=timeout)
+        except Exception:
+            # Gone already, or too slow to read its close frame
+            pass
+
+    async def _say_goodbye(self, connection: Connection, after_ms: int):
+        await self._write(connection, Frame({"type": "reconnect", "after_ms": after_ms}))
+        await connection.websocket.close(code=status.WS_1012_SERVICE_RESTART, reason=self._restart_reason(after_ms))
+
+    def _ensure_heartbeat_task(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._run_heartbeat())
+
+    async def _run_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self._wheel.tick
+
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+            # Catch up on every tick that elapsed while we were sleeping
+            now = loop.time()
+            expired = []
+            while next_tick <= now:
+                expired.extend(self._wheel.advance())
+                next_tick += self._wheel.tick
+
+            if expired:
+                await self._check_heartbeats(expired, now)
+
+    async def _check_heartbeats(self, connections: List[Connection], now: float):
+        to_ping, to_reap = [], []
         for connection in connections:
-            alog.info(f"Sending message to {connection}")
-            if connection != sender:
-                await connection.send_text(message)
+            if connection.ping_sent_at and connection.last_seen < connection.ping_sent_at:
+                alog.info(f"Reaping unresponsive socket of user {connection.user_id}")
+                to_reap.append(connection)
+                continue
+
+            idle = now - connection.last_seen
+            if idle < self.heartbeat_interval:
+                connection.ping_sent_at = 0.0
+                self._wheel.schedule(connection, self.heartbeat_interval - idle)
+            else:
+                connection.ping_sent_at = now
+                self._wheel.schedule(connection, self.heartbeat_timeout)
+                to_ping.append(connection)
+
+        await asyncio.gather(
+            *(self._evict(connection) for connection in to_reap),
+            *(self._send_or_evict(connection, PING_FRAME) for connection in to_ping)
+        )
 
 manager = ConnectionManager()
@@ -0,0 +1,390 @@
+"""
+Conversation activity analytics
+
+Message metadata is kept in a columnar snapshot: three NumPy arrays with one
+entry per message (timestamp in seconds, sender ID, conversation code),
+12 bytes a message, plus the conversation ID of every code. Aggregates are
+vectorized group-bys over those arrays (bincount over combined keys, a
+(day, sender) bitmap for distinct users), so a report over millions of
+messages never touches a message record:
+
+- messages per day, overall and for the busiest conversations
+- active users: distinct senders per day and over the window
+- peak hours: messages per hour of the day and per weekday and hour
+
+The snapshot is maintained incrementally. New messages are appended by a
+message listener, it is saved under ANALYTICS_DIR every
+ANALYTICS_SAVE_INTERVAL seconds and at shutdown, and at startup only the
+messages after each conversation's saved seq are read back in. Purged
+messages stay counted until the snapshot is rebuilt (POST
+/api/admin/analytics/rebuild).
+
+    python -m backend.benchmarks.analytics --rows 10000000
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import alog
+import numpy as np
+from backend.config.settings import settings
+from backend.conversation.chat import chat_service
+
+SECONDS_PER_DAY = 86_400
+INITIAL_CAPACITY = 1 << 16
+CATCH_UP_BATCH = 5000
+CONVERSATION_PAGE = 1000
+# Largest (day, sender) bitmap built for counting active users, in bytes
+MAX_BITMAP = 64 * 1024 * 1024
+
+# (timestamps, senders, conversation codes), all of equal length
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class ColumnarSnapshot:
+    """Append-only message metadata columns with amortized O(1) appends"""
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.size = 0
+        self._timestamps = np.empty(capacity, dtype=np.uint32)
+        self._senders = np.empty(capacity, dtype=np.int32)
+        self._conversations = np.empty(capacity, dtype=np.int32)
+        # code -> conversation ID, and back
+        self.conversation_ids: List[str] = []
+        self._codes: Dict[str, int] = {}
+        # code -> highest seq in the snapshot
+        self.last_seqs: List[int] = []
+
+    def code(self, conversation_id: str) -> int:
+        code = self._codes.get(conversation_id)
+        if code is None:
+            code = self._codes[conversation_id] = len(self.conversation_ids)
+            self.conversation_ids.append(conversation_id)
+            self.last_seqs.append(0)
+        return code
+
+    def find_code(self, conversation_id: str) -> Optional[int]:
+        return self._codes.get(conversation_id)
+
+    def append(self, code: int, sender_id: int, timestamp: int):
+        if self.size == len(self._timestamps):
+            self._grow(self.size + 1)
+        index = self.size
+        self._timestamps[index] = timestamp
+        self._senders[index] = sender_id
+        self._conversations[index] = code
+        self.size += 1
+
+    def extend(self, codes: np.ndarray, senders: np.ndarray, timestamps: np.ndarray):
+        count = len(timestamps)
+        if self.size + count > len(self._timestamps):
+            self._grow(self.size + count)
+        end = self.size + count
+        self._timestamps[self.size:end] = timestamps
+        self._senders[self.size:end] = senders
+        self._conversations[self.size:end] = codes
+        self.size = end
+
+    def columns(self) -> Columns:
+        """
+        Views of the filled part of every column
+
+        Appends only write past the current size (or into new, larger
+        arrays), so the views stay valid and unchanged while a query runs
+        in another thread.
+        """
+        return self._timestamps[:self.size], self._senders[:self.size], self._conversations[:self.size]
+
+    def save(self, path: Path):
+        """Write the snapshot atomically; call with a consistent copy of the lists"""
+        timestamps, senders, conversations = self.columns()
+        temporary = path.with_suffix(".tmp.npz")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            temporary,
+            timestamps=timestamps,
+            senders=senders,
+            conversations=conversations,
+            conversation_ids=np.array(self.conversation_ids, dtype=np.str_),
+            last_seqs=np.array(self.last_seqs, dtype=np.int64),
+        )
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ColumnarSnapshot":
+        with np.load(path) as data:
+            size = len(data["timestamps"])
+            snapshot = cls(max(INITIAL_CAPACITY, size))
+            snapshot.extend(data["conversations"], data["senders"], data["timestamps"])
+            snapshot.conversation_ids = [str(conversation_id) for conversation_id in data["conversation_ids"]]
+            snapshot.last_seqs = [int(seq) for seq in data["last_seqs"]]
+        snapshot._codes = {conversation_id: code for code, conversation_id in enumerate(snapshot.conversation_ids)}
+        return snapshot
+
+    def _grow(self, needed: int):
+        capacity = max(needed, len(self._timestamps) * 2)
+        for name in ("_timestamps", "_senders", "_conversations"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+def activity_report(
+    columns: Columns,
+    conversation_ids: List[str],
+    days: int,
+    until: datetime,
+    utc_offset_minutes: int = 0,
+    conversation_code: Optional[int] = None,
+    top: int = 10
+) -> dict:
+    """
+    Aggregate the `days` days up to and including `until` (local dates at `utc_offset_minutes`)
+
+    Args:
+        columns: Snapshot columns (see ColumnarSnapshot.columns)
+        conversation_ids: Conversation ID of every code
+        days: Length of the window in days
+        until: Last day of the window
+        utc_offset_minutes: Offset of the timezone days and hours are counted in
+        conversation_code: Only count this conversation
+        top: Number of busiest conversations to break down per day
+
+    Returns:
+        dict: Per-day series (aligned with `days`), active users, peak hours and the busiest conversations
+    """
+    timestamps, senders, conversations = columns
+    offset = utc_offset_minutes * 60
+    last_day = (int(until.timestamp()) + offset) // SECONDS_PER_DAY
+    first_day = last_day - days + 1
+    window_start = first_day * SECONDS_PER_DAY - offset
+    window_end = (last_day + 1) * SECONDS_PER_DAY - offset
+
+    mask = (timestamps >= max(window_start, 0)) & (timestamps < window_end)
+    if conversation_code is not None:
+        mask &= conversations == conversation_code
+    local = timestamps[mask].astype(np.int64) + offset
+    senders = senders[mask]
+    conversations = conversations[mask]
+
+    day = local // SECONDS_PER_DAY - first_day
+    hour = local % SECONDS_PER_DAY // 3600
+    # 1970-01-01 was a Thursday; weekday 0 is Monday
+    weekday = (day + first_day + 3) % 7
+
+    per_day = np.bincount(day, minlength=days)
+    by_hour = np.bincount(hour, minlength=24)
+    by_weekday_hour = np.bincount(weekday * 24 + hour, minlength=7 * 24).reshape(7, 24)
+
+    # Distinct (day, sender) pairs, then counted per day. User IDs are dense, so a
+    # bitmap indexed by (day, sender) is usually small; sorting is the fallback.
+    sender_span = int(senders.max()) + 1 if len(senders) else 0
+    if len(senders) == 0:
+        active_total = 0
+        active_per_day = np.zeros(days, dtype=np.int64)
+    elif days * sender_span <= MAX_BITMAP:
+        seen = np.zeros((days, sender_span), dtype=np.bool_)
+        seen[day, senders] = True
+        active_total = int(seen.any(axis=0).sum())
+        active_per_day = seen.sum(axis=1)
+    else:
+        sender_ids, sender_index = np.unique(senders, return_inverse=True)
+        pairs = np.unique(day * len(sender_ids) + sender_index)
+        active_total = len(sender_ids)
+        active_per_day = np.bincount(pairs // len(sender_ids), minlength=days)
+
+    # Busiest conversations, each broken down per day
+    totals = np.bincount(conversations, minlength=len(conversation_ids))
+    busiest = np.argsort(totals, kind="stable")[::-1][:top]
+    busiest = busiest[totals[busiest] > 0]
+    rank = np.full(len(totals), -1, dtype=np.int64)
+    rank[busiest] = np.arange(len(busiest))
+    ranked = rank[conversations]
+    selected = ranked >= 0
+    busiest_per_day = np.bincount(
+        ranked[selected] * days + day[selected], minlength=len(busiest) * days
+    ).reshape(len(busiest), days)
+
+    first_date = datetime.fromtimestamp(first_day * SECONDS_PER_DAY, timezone.utc).date()
+    return {
+        "days": [(first_date + timedelta(days=index)).isoformat() for index in range(days)],
+        "messages": int(mask.sum()),
+        "messages_per_day": per_day.tolist(),
+        "active_users": {
+            "total": active_total,
+            "per_day": active_per_day.tolist(),
+        },
+        "peak_hours": {
+            "peak_hour": int(by_hour.argmax()) if len(local) else None,
+            "by_hour": by_hour.tolist(),
+            "by_weekday_hour": by_weekday_hour.tolist(),
+        },
+        "top_conversations": [
+            {
+                "conversation_id": conversation_ids[code],
+                "messages": int(totals[code]),
+                "messages_per_day": busiest_per_day[index].tolist(),
+            }
+            for index, code in enumerate(busiest.tolist())
+        ],
+    }
+
+
+class ConversationAnalytics:
+    """Keeps the snapshot current and answers activity reports"""
+
+    def __init__(self):
+        self.enabled = settings.analytics
+        self.path = Path(settings.analytics_dir) / "messages.npz"
+        self.save_interval = settings.analytics_save_interval
+        self.snapshot = ColumnarSnapshot()
+        # Messages that arrive while catching up: (code, sender_id, timestamp, seq)
+        self._pending: Optional[List[Tuple[int, int, int, int]]] = None
+        self._catch_up_task: Optional[asyncio.Task] = None
+        self._save_task: Optional[asyncio.Task] = None
+        self._saved_size = 0
+
+    @property
+    def building(self) -> bool:
+        return self._pending is not None
+
+    def start(self):
+        """Load the saved snapshot and catch up in the background. Call during startup."""
+        if not self.enabled:
+            return
+        if self.path.exists():
+            try:
+                self.snapshot = ColumnarSnapshot.load(self.path)
+                self._saved_size = self.snapshot.size
+            except Exception as e:
+                alog.error(f"Could not load the analytics snapshot, rebuilding it: {e}")
+        self._start_catch_up()
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._run_saves())
+
+    async def stop(self):
+        """Stop background work and save the snapshot. Call during shutdown."""
+        for task in (self._catch_up_task, self._save_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._catch_up_task = self._save_task = None
+        if self.enabled and not self.building:
+            await self.save()
+
+    async def rebuild(self):
+        """Drop the snapshot and read every message again (e.g. after retention purges)"""
+        if self._catch_up_task is not None and not self._catch_up_task.done():
+            self._catch_up_task.cancel()
+            try:
+                await self._catch_up_task
+            except asyncio.CancelledError:
+                pass
+        self.snapshot = ColumnarSnapshot()
+        self._start_catch_up()
+
+    async def record(self, message, member_ids):
+        """Message listener: append the new message"""
+        if not self.enabled:
+            return
+        code = self.snapshot.code(message.conversationId)
+        timestamp = int(message.createdAt.timestamp())
+        if self._pending is not None:
+            self._pending.append((code, message.senderId, timestamp, message.seq))
+            return
+        if message.seq > self.snapshot.last_seqs[code]:
+            self.snapshot.append(code, message.senderId, timestamp)
+            self.snapshot.last_seqs[code] = message.seq
+
+    async def report(
+        self,
+        days: int,
+        until: Optional[datetime] = None,
+        utc_offset_minutes: int = 0,
+        conversation_id: Optional[str] = None,
+        top: int = 10
+    ) -> dict:
+        """Activity report (see activity_report), computed in a worker thread"""
+        code = None
+        if conversation_id is not None:
+            code = self.snapshot.find_code(conversation_id)
+            if code is None:
+                code = -1  # Matches nothing
+        columns = self.snapshot.columns()
+        conversation_ids = list(self.snapshot.conversation_ids)
+        result = await asyncio.to_thread(
+            activity_report, columns, conversation_ids, days, until or datetime.now(timezone.utc),
+            utc_offset_minutes, code, top
+        )
+        result["snapshot"] = {"rows": len(columns[0]), "building": self.building}
+        return result
+
+    async def save(self):
+        # Lists are copied here, on the loop, so the thread sees one consistent state
+        snapshot = ColumnarSnapshot.__new__(ColumnarSnapshot)
+        snapshot.size = self.snapshot.size
+        snapshot._timestamps, snapshot._senders, snapshot._conversations = self.snapshot.columns()
+        snapshot.conversation_ids = list(self.snapshot.conversation_ids)
+        snapshot.last_seqs = list(self.snapshot.last_seqs)
+        await asyncio.to_thread(snapshot.save, self.path)
+        self._saved_size = snapshot.size
+
+    def _start_catch_up(self):
+        self._pending = []
+        self._catch_up_task = asyncio.create_task(self._catch_up())
+
+    async def _catch_up(self):
+        snapshot = self.snapshot
+        before = snapshot.size
+        after = None
+        try:
+            while True:
+                conversation_ids = await chat_service.list_conversation_ids(after, CONVERSATION_PAGE)
+                if not conversation_ids:
+                    break
+                for conversation_id in conversation_ids:
+                    code = snapshot.code(conversation_id)
+                    async for messages in chat_service.iter_messages(
+                        conversation_id, snapshot.last_seqs[code], CATCH_UP_BATCH
+                    ):
+                        snapshot.extend(
+                            np.full(len(messages), code, dtype=np.int32),
+                            np.fromiter((message.senderId for message in messages), np.int32, len(messages)),
+                            np.fromiter(
+                                (message.createdAt.timestamp() for message in messages), np.float64, len(messages)
+                            ).astype(np.uint32),
+                        )
+                        snapshot.last_seqs[code] = messages[-1].seq
+                after = conversation_ids[-1]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            alog.error(f"Analytics catch-up failed: {e}")
+        finally:
+            pending, self._pending = self._pending, None
+            # Messages the catch-up already read are skipped by their seq
+            for code, sender_id, timestamp, seq in pending or ():
+                if seq > snapshot.last_seqs[code]:
+                    snapshot.append(code, sender_id, timestamp)
+                    snapshot.last_seqs[code] = seq
+        alog.info(f"Analytics snapshot caught up: {snapshot.size - before} new rows, {snapshot.size} in total")
+
+    async def _run_saves(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if self.building or self.snapshot.size == self._saved_size:
+                continue
+            try:
+                await self.save()
+            except Exception as e:
+                alog.error(f"Saving the analytics snapshot failed: {e}")
+
+
+# Global analytics instance
+conversation_analytics = ConversationAnalytics()
+chat_service.add_listener(conversation_analytics.record)
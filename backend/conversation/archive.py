@@ -0,0 +1,319 @@
+"""
+Cold storage for old conversation history
+
+Messages moved out of the database by the compaction job
+(backend.conversation.compaction) are kept per conversation in two
+append-only files under ARCHIVE_DIR:
+
+- `<conversation_id>.seg`: a sequence of blocks, each holding up to
+  BLOCK_MESSAGES consecutive messages as zlib-compressed MessagePack rows
+- `<conversation_id>.idx`: a sparse index with one fixed-size entry per
+  block (first seq, last seq, offset, length)
+
+Reads binary-search the index for the first block past the cursor and
+decompress only the blocks they need straight out of a memory map of the
+segment file. A block is written and synced before its index entry, so a
+crash mid-append leaves at worst trailing segment bytes that the next append
+truncates. Retention purges (backend.conversation.retention) are the only
+rewrite: they copy the surviving blocks to new files that replace the old pair.
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+from backend.conversation.partitions import PartitionMessage
+from backend.utils.wire import packb, unpackb
+
+BLOCK_MESSAGES = 128
+COMPRESS_LEVEL = 6
+# first seq, last seq, offset, length
+INDEX_ENTRY = struct.Struct("<QQQI")
+MAX_CACHED_INDEXES = 10_000
+MAX_OPEN_MAPS = 256
+
+IndexEntry = Tuple[int, int, int, int]
+
+
+def to_millis(value) -> int:
+    return int(value.timestamp() * 1000)
+
+
+class MessageArchive:
+    """Append-only compressed segments with a sparse block index, one pair of files per conversation"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        # conversation_id -> index entries ([] when there is no archive)
+        self._indexes: "OrderedDict[str, List[IndexEntry]]" = OrderedDict()
+        # conversation_id -> (mapped size, mmap) of the segment file
+        self._maps: "OrderedDict[str, Tuple[int, mmap.mmap]]" = OrderedDict()
+        # Reads run on worker threads while the compaction job appends
+        self._lock = threading.RLock()
+
+    def cached_last_seq(self, conversation_id: str) -> Optional[int]:
+        """Archived last seq if the conversation's index is already loaded (never blocks)"""
+        index = self._indexes.get(conversation_id)
+        if index is None:
+            return None
+        return index[-1][1] if index else 0
+
+    def last_seq(self, conversation_id: str) -> int:
+        """Highest archived seq of a conversation (0 if nothing is archived)"""
+        with self._lock:
+            index = self._index(conversation_id)
+        return index[-1][1] if index else 0
+
+    def read_since(self, conversation_id: str, since_seq: int, limit: Optional[int] = None) -> List[PartitionMessage]:
+        """
+        Archived messages with a seq greater than `since_seq`, oldest first
+
+        Args:
+            conversation_id: Conversation to read
+            since_seq: Client cursor
+            limit: Maximum number of messages to return
+
+        Returns:
+            List[PartitionMessage]: Archived messages (same record type as partition rows)
+        """
+        messages: List[PartitionMessage] = []
+        with self._lock:
+            index = self._index(conversation_id)
+            if not index or since_seq >= index[-1][1]:
+                return messages
+
+            # First block whose last seq is past the cursor
+            position = bisect.bisect_right([entry[1] for entry in index], since_seq)
+            segment = self._map(conversation_id, index[-1][2] + index[-1][3])
+
+            for first_seq, last_seq, offset, length in index[position:]:
+                for row in unpackb(zlib.decompress(segment[offset:offset + length])):
+                    message_id, seq, sender_id, content, created_at, updated_at = row
+                    if seq <= since_seq:
+                        continue
+                    messages.append(PartitionMessage(message_id, content, sender_id, conversation_id, seq, created_at, updated_at))
+                    if limit is not None and len(messages) >= limit:
+                        return messages
+        return messages
+
+    def append(self, conversation_id: str, messages: Sequence) -> int:
+        """
+        Append messages to a conversation's archive
+
+        Messages at or below the archived last seq (left over from an
+        interrupted compaction) are skipped.
+
+        Args:
+            conversation_id: Conversation the messages belong to
+            messages: Message records in ascending seq order
+
+        Returns:
+            int: The archived last seq afterwards
+        """
+        with self._lock:
+            index = list(self._index(conversation_id))
+            archived = index[-1][1] if index else 0
+            messages = [message for message in messages if message.seq > archived]
+            if not messages:
+                return archived
+
+            self.directory.mkdir(parents=True, exist_ok=True)
+            end = index[-1][2] + index[-1][3] if index else 0
+            entries = []
+            with open(self._path(conversation_id, ".seg"), "ab") as segment:
+                # Drop bytes of a block whose index entry never made it to disk
+                segment.truncate(end)
+                for start in range(0, len(messages), BLOCK_MESSAGES):
+                    block = messages[start:start + BLOCK_MESSAGES]
+                    data = zlib.compress(packb([
+                        [m.id, m.seq, m.senderId, m.content, to_millis(m.createdAt), to_millis(m.updatedAt)]
+                        for m in block
+                    ]), COMPRESS_LEVEL)
+                    segment.write(data)
+                    entries.append((block[0].seq, block[-1].seq, end, len(data)))
+                    end += len(data)
+                segment.flush()
+                os.fsync(segment.fileno())
+
+            with open(self._path(conversation_id, ".idx"), "ab") as index_file:
+                index_file.truncate(len(index) * INDEX_ENTRY.size)
+                index_file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+
+            self._remember_index(conversation_id, index + entries)
+            return entries[-1][1]
+
+    def conversation_ids(self) -> List[str]:
+        """Conversations that have an archive"""
+        if not self.directory.is_dir():
+            return []
+        return sorted(path.stem for path in self.directory.glob("*.idx"))
+
+    def newest_seq_before(self, conversation_id: str, cutoff_millis: int) -> int:
+        """
+        Highest archived seq of a message created before `cutoff_millis` (0 if none)
+
+        Seqs grow with creation time, so a binary search over the blocks only
+        decompresses a handful of them.
+        """
+        with self._lock:
+            index = self._index(conversation_id)
+            if not index:
+                return 0
+            segment = self._map(conversation_id, index[-1][2] + index[-1][3])
+
+            def rows(entry: IndexEntry) -> list:
+                _, _, offset, length = entry
+                return unpackb(zlib.decompress(segment[offset:offset + length]))
+
+            # Last block whose first message is older than the cutoff
+            low, high = 0, len(index)
+            while low < high:
+                middle = (low + high) // 2
+                if rows(index[middle])[0][4] < cutoff_millis:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == 0:
+                return 0
+            return max(row[1] for row in rows(index[low - 1]) if row[4] < cutoff_millis)
+
+    def purge_through(self, conversation_id: str, seq: int) -> int:
+        """
+        Permanently delete archived messages up to and including `seq`
+
+        The remaining blocks are copied to new files that replace the old ones
+        (segment first, then index); `_index` finishes or discards a replacement
+        interrupted by a crash.
+
+        Returns:
+            int: Number of messages deleted
+        """
+        with self._lock:
+            index = self._index(conversation_id)
+            if not index or index[0][0] > seq:
+                return 0
+            segment = self._map(conversation_id, index[-1][2] + index[-1][3])
+
+            removed = 0
+            blocks: List[Tuple[IndexEntry, bytes]] = []
+            for entry in index:
+                first_seq, last_seq, offset, length = entry
+                data = segment[offset:offset + length]
+                if first_seq > seq:
+                    blocks.append((entry, data))
+                    continue
+                rows = unpackb(zlib.decompress(data))
+                kept = [row for row in rows if row[1] > seq]
+                removed += len(rows) - len(kept)
+                if kept:
+                    # Straddling block: re-encode the rows that stay
+                    data = zlib.compress(packb(kept), COMPRESS_LEVEL)
+                    blocks.append(((kept[0][1], kept[-1][1], 0, len(data)), data))
+
+            self._forget(conversation_id)
+            segment_path, index_path = self._path(conversation_id, ".seg"), self._path(conversation_id, ".idx")
+            if not blocks:
+                # Index first: a segment without an index is ignored and truncated by the next append
+                index_path.unlink()
+                segment_path.unlink()
+                self._remember_index(conversation_id, [])
+                return removed
+
+            entries, end = [], 0
+            new_segment, new_index = self._path(conversation_id, ".seg.new"), self._path(conversation_id, ".idx.new")
+            with open(new_segment, "wb") as out:
+                for (first_seq, last_seq, _, length), data in blocks:
+                    out.write(data)
+                    entries.append((first_seq, last_seq, end, length))
+                    end += length
+                out.flush()
+                os.fsync(out.fileno())
+            with open(new_index, "wb") as out:
+                out.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(new_segment, segment_path)
+            os.replace(new_index, index_path)
+            self._remember_index(conversation_id, entries)
+            return removed
+
+    def close(self):
+        with self._lock:
+            for _, segment in self._maps.values():
+                segment.close()
+            self._maps.clear()
+
+    def _path(self, conversation_id: str, suffix: str) -> Path:
+        return self.directory / f"{conversation_id}{suffix}"
+
+    def _index(self, conversation_id: str) -> List[IndexEntry]:
+        index = self._indexes.get(conversation_id)
+        if index is not None:
+            self._indexes.move_to_end(conversation_id)
+            return index
+
+        self._recover_purge(conversation_id)
+        index = []
+        try:
+            data = self._path(conversation_id, ".idx").read_bytes()
+            segment_size = self._path(conversation_id, ".seg").stat().st_size
+        except FileNotFoundError:
+            data, segment_size = b"", 0
+        for offset in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            entry = INDEX_ENTRY.unpack_from(data, offset)
+            if entry[2] + entry[3] > segment_size:
+                break
+            index.append(entry)
+        self._remember_index(conversation_id, index)
+        return index
+
+    def _recover_purge(self, conversation_id: str):
+        """Finish or roll back a purge_through that was interrupted between its renames"""
+        new_index = self._path(conversation_id, ".idx.new")
+        new_segment = self._path(conversation_id, ".seg.new")
+        if not new_index.exists():
+            # Interrupted before the new index was written: the old files are intact
+            new_segment.unlink(missing_ok=True)
+            return
+        if new_segment.exists():
+            # The old files were not touched yet
+            new_segment.unlink()
+            new_index.unlink()
+        else:
+            # The new segment is already in place; its index is complete (synced before the rename)
+            os.replace(new_index, self._path(conversation_id, ".idx"))
+
+    def _forget(self, conversation_id: str):
+        self._indexes.pop(conversation_id, None)
+        cached = self._maps.pop(conversation_id, None)
+        if cached is not None:
+            cached[1].close()
+
+    def _remember_index(self, conversation_id: str, index: List[IndexEntry]):
+        self._indexes[conversation_id] = index
+        self._indexes.move_to_end(conversation_id)
+        if len(self._indexes) > MAX_CACHED_INDEXES:
+            self._indexes.popitem(last=False)
+
+    def _map(self, conversation_id: str, size: int) -> mmap.mmap:
+        cached = self._maps.get(conversation_id)
+        if cached is not None and cached[0] >= size:
+            self._maps.move_to_end(conversation_id)
+            return cached[1]
+        if cached is not None:
+            # The segment grew since it was mapped
+            cached[1].close()
+
+        with open(self._path(conversation_id, ".seg"), "rb") as segment:
+            mapped = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[conversation_id] = (len(mapped), mapped)
+        if len(self._maps) > MAX_OPEN_MAPS:
+            _, (_, evicted) = self._maps.popitem(last=False)
+            evicted.close()
+        return mapped
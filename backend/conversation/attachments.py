@@ -0,0 +1,368 @@
+"""
+Message attachments
+
+Files are uploaded to a conversation in chunks and stored once per content:
+under ATTACHMENT_DIR,
+
+- `uploads/<upload_id>.part` holds the bytes received so far, and
+  `uploads/<upload_id>.json` what the upload was declared as, so an
+  interrupted upload resumes from the size of the part file, even after a
+  restart
+- `blobs/<ab>/<cd>/<sha256>` holds each distinct content once; a finished
+  upload whose content is already there only adds an `Attachment` row
+
+Chunks are streamed from the request body to the part file in bounded
+buffers, and the hash is computed when the last byte arrives, so no upload is
+ever held in memory. Messages reference an attachment by its URL
+(`/api/chat/attachments/<id>`) instead of carrying the file inline.
+
+Attachments follow their conversation's retention: the retention job
+deletes those created before the conversation's cutoff, and a blob once no
+attachment references it.
+
+Downloads are FileResponses: the server sends the file from disk (with
+`http.response.pathsend` where the server supports it) and honours Range
+requests, so media can be streamed and interrupted downloads resumed.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set
+import alog
+from backend.config.settings import settings
+from backend.storage import storage
+
+# Bytes buffered from the request body before each write to the part file
+WRITE_BUFFER = 1024 * 1024
+HASH_BLOCK = 1024 * 1024
+# Unfinished uploads are looked for at most this often
+SWEEP_INTERVAL = 3600
+PURGE_BATCH = 500
+# Content types browsers may show inline; anything else is served as a download
+INLINE_TYPES = {
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif",
+    "video/mp4", "video/webm", "audio/mpeg", "audio/ogg", "audio/webm", "application/pdf",
+}
+
+
+class UploadNotFound(Exception):
+    """No unfinished upload with this ID belongs to the user"""
+
+
+class UploadOffsetMismatch(Exception):
+    """A chunk did not start where the upload left off"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    """A chunk ran past the declared size or ATTACHMENT_CHUNK_SIZE, or the declared size is over the limit"""
+
+
+class UploadCorrupt(Exception):
+    """The finished content does not match the SHA-256 declared for it"""
+
+
+class Upload:
+    """An unfinished upload, as declared when it was created"""
+    __slots__ = ("id", "conversation_id", "uploader_id", "filename", "content_type", "size", "sha256", "offset")
+
+    def __init__(
+        self,
+        upload_id: str,
+        conversation_id: str,
+        uploader_id: int,
+        filename: str,
+        content_type: str,
+        size: int,
+        sha256: Optional[str],
+        offset: int = 0
+    ):
+        self.id = upload_id
+        self.conversation_id = conversation_id
+        self.uploader_id = uploader_id
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+        self.offset = offset
+
+    def to_dict(self) -> dict:
+        return {
+            "conversation_id": self.conversation_id,
+            "uploader_id": self.uploader_id,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size": self.size,
+            "sha256": self.sha256,
+        }
+
+
+def attachment_payload(attachment) -> dict:
+    """Serialize a stored attachment (see AttachmentResponse)"""
+    return {
+        "id": attachment.id,
+        "conversation_id": attachment.conversationId,
+        "filename": attachment.filename,
+        "content_type": attachment.contentType,
+        "size": attachment.size,
+        "sha256": attachment.sha256,
+        "url": f"/api/chat/attachments/{attachment.id}",
+        "created_at": attachment.createdAt.isoformat(),
+    }
+
+
+class AttachmentStore:
+    """Resumable uploads into content-addressed files"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.uploads_dir = self.root / "uploads"
+        self.blobs_dir = self.root / "blobs"
+        self.max_size = settings.attachment_max_size
+        self.chunk_size = settings.attachment_chunk_size
+        self.upload_ttl = settings.attachment_upload_ttl
+        # upload_id -> lock serializing chunks of one upload
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Held while blobs are added or removed, so a purge never deletes content
+        # that a finishing upload just found already stored
+        self._blob_lock = asyncio.Lock()
+        self._sweeps: Set[asyncio.Task] = set()
+        self._swept_at = 0.0
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / sha256[2:4] / sha256
+
+    async def create_upload(
+        self,
+        conversation_id: str,
+        uploader_id: int,
+        filename: str,
+        content_type: str,
+        size: int,
+        sha256: Optional[str] = None
+    ) -> Upload:
+        """
+        Start an upload; the caller has checked the uploader is a member
+
+        Raises:
+            UploadTooLarge: If `size` is over ATTACHMENT_MAX_SIZE
+        """
+        if size > self.max_size:
+            raise UploadTooLarge(f"Attachments are limited to {self.max_size} bytes")
+        upload = Upload(
+            secrets.token_urlsafe(16), conversation_id, uploader_id, filename, content_type, size,
+            sha256.lower() if sha256 else None
+        )
+        await asyncio.to_thread(self._create_files, upload)
+        if time.time() - self._swept_at > SWEEP_INTERVAL:
+            self._swept_at = time.time()
+            sweep = asyncio.create_task(self._sweep())
+            self._sweeps.add(sweep)
+            sweep.add_done_callback(self._sweeps.discard)
+        return upload
+
+    async def get_upload(self, upload_id: str, uploader_id: int) -> Upload:
+        """
+        An unfinished upload of this user, with the offset to resume from
+
+        Raises:
+            UploadNotFound: If the upload does not exist, is finished or belongs to someone else
+        """
+        upload = await asyncio.to_thread(self._load, upload_id)
+        if upload is None or upload.uploader_id != uploader_id:
+            raise UploadNotFound(upload_id)
+        return upload
+
+    async def append(self, upload_id: str, uploader_id: int, offset: int, chunks: AsyncIterator[bytes]):
+        """
+        Append the next chunk of an upload, streamed from `chunks`
+
+        Bytes received before the client disconnects are kept, so it can
+        resume from the upload's offset. When the last byte arrives the file
+        is hashed, moved into place (or dropped, if the content is already
+        stored) and recorded.
+
+        Args:
+            upload_id: Upload to append to
+            uploader_id: Current user; must be the one who created the upload
+            offset: Where the client thinks the chunk starts
+            chunks: Body of the request
+
+        Returns:
+            Upload or the Attachment record: the upload with its new offset, or the attachment once complete
+
+        Raises:
+            UploadNotFound, UploadOffsetMismatch, UploadTooLarge, UploadCorrupt
+        """
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            try:
+                upload = await self.get_upload(upload_id, uploader_id)
+            except UploadNotFound:
+                self._locks.pop(upload_id, None)
+                raise
+            if offset != upload.offset:
+                raise UploadOffsetMismatch(upload.offset)
+
+            part = await asyncio.to_thread(open, self._part_path(upload_id), "ab")
+            buffer = bytearray()
+            limit = min(upload.size, offset + self.chunk_size)
+            try:
+                async for chunk in chunks:
+                    if upload.offset + len(buffer) + len(chunk) > limit:
+                        raise UploadTooLarge(
+                            f"Upload declared {upload.size} bytes" if limit == upload.size
+                            else f"Chunks are limited to {self.chunk_size} bytes"
+                        )
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER:
+                        await asyncio.to_thread(part.write, buffer)
+                        upload.offset += len(buffer)
+                        buffer = bytearray()
+            finally:
+                # Also on a disconnect: whatever arrived counts, the client resumes after it
+                if buffer:
+                    await asyncio.to_thread(part.write, buffer)
+                    upload.offset += len(buffer)
+                await asyncio.to_thread(part.close)
+
+            if upload.offset < upload.size:
+                return upload
+            self._locks.pop(upload_id, None)
+            return await self._finish(upload)
+
+    async def cancel(self, upload_id: str, uploader_id: int):
+        """Discard an unfinished upload"""
+        await self.get_upload(upload_id, uploader_id)
+        await asyncio.to_thread(self._remove_upload, upload_id)
+        self._locks.pop(upload_id, None)
+
+    async def purge_older_than(
+        self, cutoff: datetime, conversation_id: Optional[str] = None, exclude: List[str] = ()
+    ) -> int:
+        """
+        Delete attachments created before `cutoff`, and their content once nothing references it
+
+        Args:
+            cutoff: Attachments created before this are deleted
+            conversation_id: Only purge this conversation
+            exclude: Otherwise, purge every conversation but these
+
+        Returns:
+            int: Number of attachments deleted
+        """
+        deleted = 0
+        while True:
+            old = await storage.attachments_older_than(cutoff, PURGE_BATCH, conversation_id, exclude)
+            if not old:
+                return deleted
+            deleted += await storage.delete_attachments([attachment.id for attachment in old])
+            async with self._blob_lock:
+                for sha256 in {attachment.sha256 for attachment in old}:
+                    if not await storage.attachment_content_in_use(sha256):
+                        await asyncio.to_thread(self.blob_path(sha256).unlink, missing_ok=True)
+            if len(old) < PURGE_BATCH:
+                return deleted
+
+    def sweep(self) -> int:
+        """Delete uploads untouched for ATTACHMENT_UPLOAD_TTL seconds; returns how many"""
+        cutoff = time.time() - self.upload_ttl
+        removed = 0
+        for meta in self.uploads_dir.glob("*.json"):
+            upload_id = meta.stem
+            part = self._part_path(upload_id)
+            try:
+                touched = max(meta.stat().st_mtime, part.stat().st_mtime if part.exists() else 0)
+            except FileNotFoundError:
+                continue
+            if touched < cutoff:
+                self._remove_upload(upload_id)
+                removed += 1
+        if removed:
+            alog.info(f"Deleted {removed} abandoned attachment uploads")
+        return removed
+
+    async def _sweep(self):
+        try:
+            await asyncio.to_thread(self.sweep)
+        except Exception as e:
+            alog.error(f"Sweeping abandoned attachment uploads failed: {e}")
+        # Locks of uploads that were swept (or otherwise went away) are not needed anymore
+        for upload_id, lock in list(self._locks.items()):
+            if not lock.locked() and not self._meta_path(upload_id).exists():
+                self._locks.pop(upload_id, None)
+
+    async def _finish(self, upload: Upload):
+        sha256 = await asyncio.to_thread(self._hash, upload)
+        async with self._blob_lock:
+            await asyncio.to_thread(self._store_blob, upload, sha256)
+            attachment = await storage.create_attachment(
+                sha256, upload.size, upload.content_type, upload.filename, upload.uploader_id, upload.conversation_id
+            )
+        alog.info(f"Stored attachment {attachment.id} ({upload.size} bytes, {sha256[:12]})")
+        return attachment
+
+    def _hash(self, upload: Upload) -> str:
+        digest = hashlib.sha256()
+        with open(self._part_path(upload.id), "rb") as f:
+            while block := f.read(HASH_BLOCK):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+        if upload.sha256 and upload.sha256 != sha256:
+            self._remove_upload(upload.id)
+            raise UploadCorrupt(f"Content hashes to {sha256}, not {upload.sha256}")
+        return sha256
+
+    def _store_blob(self, upload: Upload, sha256: str):
+        part = self._part_path(upload.id)
+        blob = self.blob_path(sha256)
+        if blob.exists():
+            # Same content uploaded before: keep the one copy
+            part.unlink()
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            with open(part, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(part, blob)
+        self._meta_path(upload.id).unlink(missing_ok=True)
+
+    def _create_files(self, upload: Upload):
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        self._part_path(upload.id).touch()
+        self._meta_path(upload.id).write_text(json.dumps(upload.to_dict()))
+
+    def _load(self, upload_id: str) -> Optional[Upload]:
+        # IDs come from URLs; only token_urlsafe characters may reach the filesystem
+        if not upload_id or not all(c.isalnum() or c in "-_" for c in upload_id):
+            return None
+        try:
+            meta = json.loads(self._meta_path(upload_id).read_text())
+            offset = self._part_path(upload_id).stat().st_size
+        except FileNotFoundError:
+            return None
+        return Upload(
+            upload_id, meta["conversation_id"], meta["uploader_id"], meta["filename"], meta["content_type"],
+            meta["size"], meta["sha256"], offset
+        )
+
+    def _remove_upload(self, upload_id: str):
+        self._part_path(upload_id).unlink(missing_ok=True)
+        self._meta_path(upload_id).unlink(missing_ok=True)
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.uploads_dir / f"{upload_id}.part"
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.uploads_dir / f"{upload_id}.json"
+
+
+# Global attachment store
+attachment_store = AttachmentStore(settings.attachment_dir)
@@ -0,0 +1,121 @@
+"""
+Backfill Conversation.memberHash for existing conversations
+
+`ChatService.create_conversation` finds an existing conversation for a member
+set with one lookup on the unique `memberHash` index. Conversations created
+before that column existed have no hash; this tool computes it:
+
+    python -m backend.conversation.backfill [--batch-size N] [--dry-run]
+
+Conversations are walked in ID order (cuids are roughly time-ordered). When
+several conversations have the same members, the first one keeps the hash
+and becomes the one `create_conversation` returns; the others are listed and
+left without a hash, so their history stays reachable by ID. The tool is
+safe to re-run and to run against a live server: rows that already have a
+hash are skipped and updates never overwrite one.
+"""
+import argparse
+import sqlite3
+import time
+from typing import Dict, List, Set, Tuple
+from backend.conversation.chat import member_set_hash
+from backend.conversation.reshard import open_main_database
+
+
+def read_members(conn: sqlite3.Connection, conversation_ids: List[str]) -> Dict[str, Set[int]]:
+    members: Dict[str, Set[int]] = {conversation_id: set() for conversation_id in conversation_ids}
+    rows = conn.execute(
+        f'SELECT "A", "B" FROM "_ConversationUsers" WHERE "A" IN ({", ".join("?" * len(conversation_ids))})',
+        conversation_ids
+    )
+    for conversation_id, user_id in rows:
+        members[conversation_id].add(user_id)
+    return members
+
+
+def backfill(conn: sqlite3.Connection, batch_size: int = 500, dry_run: bool = False) -> Tuple[int, int, List[Tuple[str, str]]]:
+    """
+    Hash every conversation that has no memberHash yet
+
+    Args:
+        conn: Main database connection (autocommit mode)
+        batch_size: Conversations per round trip (keep under SQLite's variable limit)
+        dry_run: Report what would change without writing
+
+    Returns:
+        Tuple: (conversations scanned, conversations hashed, [(duplicate, original)])
+    """
+    scanned, hashed = 0, 0
+    duplicates: List[Tuple[str, str]] = []
+    # Hashes assigned in this run; only needed for dry runs, where nothing is written
+    assigned: Dict[str, str] = {}
+    after = ""
+    started = time.monotonic()
+    while True:
+        ids = [row[0] for row in conn.execute(
+            'SELECT "id" FROM "Conversation" WHERE "id" > ? AND "memberHash" IS NULL ORDER BY "id" LIMIT ?',
+            (after, batch_size)
+        )]
+        if not ids:
+            break
+        after = ids[-1]
+        scanned += len(ids)
+
+        hashes = {conversation_id: member_set_hash(members)
+                  for conversation_id, members in read_members(conn, ids).items()}
+        unique_hashes = list(set(hashes.values()))
+        owners = dict(conn.execute(
+            f'SELECT "memberHash", "id" FROM "Conversation" '
+            f'WHERE "memberHash" IN ({", ".join("?" * len(unique_hashes))})',
+            unique_hashes
+        ))
+
+        updates = []
+        for conversation_id in ids:
+            member_hash = hashes[conversation_id]
+            owner = owners.get(member_hash) or assigned.get(member_hash)
+            if owner is not None:
+                duplicates.append((conversation_id, owner))
+                continue
+            owners[member_hash] = conversation_id
+            updates.append((member_hash, conversation_id))
+
+        if dry_run:
+            assigned.update(updates)
+            hashed += len(updates)
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            # OR IGNORE: a live server may have created the same member set meanwhile
+            conn.executemany(
+                'UPDATE OR IGNORE "Conversation" SET "memberHash" = ? WHERE "id" = ? AND "memberHash" IS NULL',
+                updates
+            )
+            hashed += conn.total_changes - before
+            conn.execute("COMMIT")
+
+        rate = scanned / max(time.monotonic() - started, 1e-9)
+        print(f"\rscanned {scanned} conversations ({rate:,.0f}/s)", end="", flush=True)
+    print()
+    return scanned, hashed, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report without writing")
+    args = parser.parse_args()
+
+    conn = open_main_database()
+    try:
+        scanned, hashed, duplicates = backfill(conn, args.batch_size, args.dry_run)
+    finally:
+        conn.close()
+    for duplicate, original in duplicates:
+        print(f"conversation {duplicate} has the same members as {original}")
+    verb = "would hash" if args.dry_run else "hashed"
+    print(f"scanned {scanned}, {verb} {hashed}, {len(duplicates)} duplicates left without a hash")
+
+
+if __name__ == "__main__":
+    main()
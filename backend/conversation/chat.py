@@ -1,55 +1,507 @@
-from backend.utils.database import get_db_session
+import asyncio
+import hashlib
+import sqlite3
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from backend.config.settings import settings
+from backend.conversation.archive import MessageArchive
+from backend.conversation.partitions import MessagePartitions
+from backend.storage import DuplicateKeyError, Storage, storage as default_storage
+from backend.utils.loader import BatchLoader
 import alog
 
+# Called after every stored message with the message and the conversation's member IDs
+MessageListener = Callable[[object, FrozenSet[int]], Awaitable[None]]
+
+MEMBER_CACHE_SIZE = 10_000
+
+
+def member_set_hash(user_ids: Iterable[int]) -> str:
+    """Canonical hash of a member set: the same users in any order (or repeated) hash alike"""
+    canonical = ",".join(str(user_id) for user_id in sorted(set(user_ids)))
+    return hashlib.sha256(canonical.encode("ascii")).hexdigest()
+
+
 class ChatService:
     """Chat and message service"""
 
+    def __init__(self, storage: Optional[Storage] = None):
+        # Users, conversations, read pointers and (unless partitioned) messages
+        self._storage = storage or default_storage
+        self._listeners: List[MessageListener] = []
+        self._inline_listeners: List[MessageListener] = []
+        # conversation_id -> (message, member IDs) waiting for the background listeners
+        self._undelivered: Dict[str, Deque[Tuple[object, FrozenSet[int]]]] = {}
+        # One dispatch task per conversation with undelivered messages
+        self._dispatching: Set[asyncio.Task] = set()
+        # conversation_id -> member user IDs; membership never changes after creation
+        self._members: "OrderedDict[str, FrozenSet[int]]" = OrderedDict()
+        # Concurrent lookups of the same (or different) conversations share queries
+        self._conversation_loader = BatchLoader(self._load_conversations, name="conversations")
+        self._member_loader = BatchLoader(self._load_members, name="conversation members")
+        # Messages live in hash-partitioned files instead of the main database when enabled
+        self._partitions: Optional[MessagePartitions] = (
+            MessagePartitions(settings.message_partitions, settings.message_partition_dir)
+            if settings.message_partitions > 0 else None
+        )
+        # Where hot messages are read and deleted; both offer the same message methods
+        self._messages = self._partitions if self._partitions is not None else self._storage
+        # Old history moved out of the database by the compaction job
+        self._archive = MessageArchive(settings.archive_dir)
+
+    def add_listener(self, listener: MessageListener, inline: bool = False):
+        """
+        Register a coroutine to be awaited after every new message
+
+        Listeners run in a background task, so a slow socket or mail server
+        never holds up the writer's request. A conversation's messages reach
+        them in seq order, and a message's listeners run concurrently.
+
+        Args:
+            listener: Called with the message and the conversation's member IDs
+            inline: Await it before add_message returns instead; only for
+                in-memory bookkeeping the writer's next request must see
+                (ETags, unread counters, long-poll buffers)
+        """
+        (self._inline_listeners if inline else self._listeners).append(listener)
+
     async def create_conversation(self, user_ids: list[int]):
-        async with get_db_session() as db:
-            return await db.conversation.create(
-                data={"users": {"connect": [{"id": uid} for uid in user_ids]}}
-            )
+        """
+        Return the conversation with exactly these members, creating it if there is none
+
+        Args:
+            user_ids: Members (duplicates and order do not matter)
+
+        Returns:
+            Conversation record
+        """
+        members = frozenset(user_ids)
+        member_hash = member_set_hash(members)
+        conversation = await self._storage.find_conversation_by_hash(member_hash)
+        if conversation is None:
+            try:
+                conversation = await self._storage.create_conversation(members, member_hash)
+            except DuplicateKeyError:
+                # A concurrent request created it between the lookup and the insert
+                conversation = await self._storage.find_conversation_by_hash(member_hash)
+        self._cache_members(conversation.id, members)
+        return conversation
 
     async def get_conversation(self, conversation_id: str):
-        async with get_db_session() as db:
-            return await db.conversation.find_unique(
-                where={"id": conversation_id},
-                include={"users": True, "messages": {"include": {"sender": True}}}
-            )
+        return await self._conversation_loader.load(conversation_id)
+
+    async def get_conversations(self, conversation_ids: List[str]) -> List:
+        """Several conversations in one query; missing ones come back as None"""
+        return await self._conversation_loader.load_many(conversation_ids)
+
+    async def get_conversation_info(self, conversation_id: str):
+        """Conversation record without members or messages"""
+        return await self._storage.find_conversation(conversation_id)
+
+    async def get_attachment(self, attachment_id: str):
+        """Attachment record (see backend.conversation.attachments), or None"""
+        return await self._storage.find_attachment(attachment_id)
+
+    async def ensure_conversation(self, conversation_id: str, user_ids: list[int], name: Optional[str] = None):
+        """Create a conversation with a given ID unless it already exists (used by imports)"""
+        conversation = await self.get_conversation_info(conversation_id)
+        if conversation is None:
+            member_hash = member_set_hash(user_ids)
+            # Only the first conversation of a member set is found by create_conversation
+            if await self._storage.find_conversation_by_hash(member_hash) is not None:
+                member_hash = None
+            conversation = await self._storage.create_conversation(user_ids, member_hash, conversation_id, name)
+            self._cache_members(conversation_id, frozenset(user_ids))
+        return conversation
+
+    async def list_conversation_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        """Page through every conversation ID in ascending order"""
+        return await self._storage.conversation_ids(after, limit)
+
+    async def get_member_ids(self, conversation_id: str) -> FrozenSet[int]:
+        members = self._members.get(conversation_id)
+        if members is not None:
+            self._members.move_to_end(conversation_id)
+            return members
+
+        members = await self._member_loader.load(conversation_id)
+        if not members:
+            return frozenset()
+        self._cache_members(conversation_id, members)
+        return members
+
+    async def is_member(self, conversation_id: str, user_id: int) -> bool:
+        return user_id in await self.get_member_ids(conversation_id)
 
     async def list_conversations(self, user_id: int):
-        async with get_db_session() as db:
-            return await db.conversation.find_many(
-                where={"users": {"some": {"id": user_id}}},
-                include={"users": True, "messages": {"orderBy": {"createdAt": "desc"}}}
-            )
+        if self._partitions is not None:
+            conversations = await self._storage.user_conversations(user_id, with_messages=False)
+            return await self._attach_messages(conversations, newest_first=True)
+        return await self._storage.user_conversations(user_id)
 
     async def add_message(self, conversation_id: str, sender_id: int, content: str):
-        async with get_db_session() as db:
-            alog.info(f"Adding message to conversation {conversation_id} sender {sender_id} content {content}")
-            return await db.message.create(
-                data={
-                    "content": content,
-                    "sender": {"connect": {"id": sender_id}},
-                    "conversation": {"connect": {"id": conversation_id}}
-                }
-            )
+        alog.info(f"Adding message to conversation {conversation_id} sender {sender_id} content {content}")
+        if self._partitions is not None:
+            if not await self.get_member_ids(conversation_id):
+                raise ValueError(f"Conversation {conversation_id} not found")
+            # The partition allocates the seq and stores the row in one local transaction
+            message = await self._partitions.create_message(conversation_id, sender_id, content)
+            await self._notify(message)
+            return message
+
+        # The storage allocates the next per-conversation seq in the same transaction
+        message = await self._storage.create_message(conversation_id, sender_id, content)
+        await self._notify(message)
+        return message
 
-    async def get_messages(self, conversation_id: str, current_user_id: int = None):
-        async with get_db_session() as db:
-            fetch_messages = await db.message.find_many(
-                where={"conversationId": conversation_id},
-                include={"sender": True},
-                order={"createdAt": "asc"}
+    async def add_messages(self, sender_id: int, messages: List[Tuple[str, str]]) -> List:
+        """
+        Store several messages from one sender atomically
+
+        Args:
+            sender_id: Author of every message
+            messages: (conversation_id, content) pairs; messages of the same conversation
+                get consecutive seqs in list order
+
+        Returns:
+            List: Stored messages, in input order
+
+        Raises:
+            ValueError: If a conversation does not exist (nothing is stored)
+        """
+        if not messages:
+            return []
+        alog.info(f"Adding {len(messages)} messages from sender {sender_id}")
+        if self._partitions is not None:
+            for conversation_id in dict.fromkeys(conversation_id for conversation_id, _ in messages):
+                if not await self.get_member_ids(conversation_id):
+                    raise ValueError(f"Conversation {conversation_id} not found")
+            # One transaction per partition touched by the batch, committed together
+            created = await self._partitions.create_messages(
+                [(conversation_id, sender_id, content) for conversation_id, content in messages]
             )
-            messages = [
-                {
-                    "id": message.id,
-                    "text": message.content,
-                    "sender": "me" if current_user_id and message.sender.id == current_user_id else "they",
-                    "created_at": message.createdAt.isoformat(),
-                    "updated_at": message.updatedAt.isoformat()
-                }
-                for message in fetch_messages
-            ]
-            return messages
+        else:
+            created = await self._storage.create_messages(sender_id, messages)
+
+        for message in created:
+            await self._notify(message)
+        return created
+
+    async def get_messages_since(self, conversation_id: str, since_seq: int = 0, limit: Optional[int] = None):
+        """
+        Fetch messages with a sequence number greater than `since_seq`, oldest first
+
+        Args:
+            conversation_id: Conversation to read from
+            since_seq: Last sequence number the client has seen (0 for everything)
+            limit: Maximum number of messages to return
+        """
+        archived = []
+        if since_seq < await self._archived_last_seq(conversation_id):
+            # Paging into cold history: serve it from the archive, then continue with hot rows
+            archived = await asyncio.to_thread(self._archive.read_since, conversation_id, since_seq, limit)
+            if archived:
+                since_seq = archived[-1].seq
+                if limit is not None:
+                    limit -= len(archived)
+                    if limit <= 0:
+                        return archived
+
+        messages = await self.get_hot_messages(conversation_id, since_seq, limit)
+        return archived + messages if archived else messages
+
+    async def iter_messages(self, conversation_id: str, since_seq: int = 0, batch_size: int = 1000) -> AsyncIterator[List]:
+        """
+        Walk a conversation's history in seq order, one batch at a time
+
+        Only one batch is held in memory, so exports of any size run in
+        constant memory.
+
+        Args:
+            conversation_id: Conversation to read
+            since_seq: Start after this sequence number
+            batch_size: Messages fetched per query
+
+        Yields:
+            List: Message records, oldest first
+        """
+        while True:
+            messages = await self.get_messages_since(conversation_id, since_seq, batch_size)
+            if not messages:
+                return
+            yield messages
+            since_seq = messages[-1].seq
+            if len(messages) < batch_size:
+                return
+
+    async def import_messages(self, rows: List[tuple], skip_existing: bool = False) -> int:
+        """
+        Bulk-insert messages in one transaction per storage target, without notifying listeners
+
+        Args:
+            rows: (id, content, senderId, conversationId, seq, createdAt, updatedAt)
+                tuples, timestamps in epoch milliseconds
+            skip_existing: Drop rows that already exist instead of failing, e.g. for
+                the first batch after resuming an interrupted import
+
+        Returns:
+            int: Number of messages inserted
+
+        Raises:
+            DuplicateKeyError: If a message already exists and `skip_existing` is False
+        """
+        if not rows:
+            return 0
+        if self._partitions is not None:
+            try:
+                return await self._partitions.insert_messages(rows, skip_existing)
+            except sqlite3.IntegrityError as e:
+                raise DuplicateKeyError(f"Message already exists: {e}") from e
+        return await self._storage.insert_messages(rows, skip_existing)
+
+    async def get_messages_older_than(self, cutoff: datetime, limit: int, exclude: Iterable[str] = ()) -> List:
+        """Hot messages created before `cutoff`, ordered by conversation and seq, skipping `exclude`d conversations"""
+        exclude = list(exclude)
+        if self._partitions is not None:
+            return await self._partitions.messages_older_than(cutoff, limit, exclude)
+        return await self._storage.messages_older_than(cutoff, limit, exclude)
+
+    async def get_retention_overrides(self) -> Dict[str, int]:
+        """conversation_id -> retention days, for conversations that override RETENTION_DAYS"""
+        return await self._storage.retention_overrides()
+
+    async def set_retention(self, conversation_id: str, days: Optional[int]):
+        """Override RETENTION_DAYS for a conversation (None restores the default, 0 keeps everything)"""
+        return await self._storage.set_retention(conversation_id, days)
+
+    async def newest_seq_before(self, conversation_id: str, cutoff: datetime) -> int:
+        """Highest seq of a message created before `cutoff`, hot or archived (0 if none)"""
+        hot = await self._messages.newest_seq_before(conversation_id, cutoff)
+        if hot:
+            # Everything archived is older than the hot rows
+            return hot
+        return await self.archived_newest_seq_before(conversation_id, cutoff)
+
+    async def archived_newest_seq_before(self, conversation_id: str, cutoff: datetime) -> int:
+        return await asyncio.to_thread(
+            self._archive.newest_seq_before, conversation_id, int(cutoff.timestamp() * 1000)
+        )
+
+    async def archived_conversation_ids(self) -> List[str]:
+        return await asyncio.to_thread(self._archive.conversation_ids)
+
+    async def purge_messages(self, conversation_id: str, through_seq: int, limit: int) -> int:
+        """
+        Permanently delete at most `limit` of a conversation's oldest hot messages up to `through_seq`
+
+        Returns:
+            int: Number of messages deleted (less than `limit` once nothing is left)
+        """
+        return await self._messages.purge_through(conversation_id, through_seq, limit)
+
+    async def purge_archived(self, conversation_id: str, through_seq: int) -> int:
+        """Permanently delete archived messages up to `through_seq`; returns the count"""
+        return await asyncio.to_thread(self._archive.purge_through, conversation_id, through_seq)
+
+    async def reclaim_space(self, pages: int) -> int:
+        """
+        Run one incremental vacuum step on the main database and every partition
+
+        Only databases in auto_vacuum=INCREMENTAL mode are vacuumed.
+
+        Returns:
+            int: Pages returned to the filesystem
+        """
+        freed = 0
+        if self._partitions is not None:
+            freed += await self._partitions.reclaim_space(pages)
+        return freed + await self._storage.reclaim_space(pages)
+
+    async def archive_messages(self, conversation_id: str, through_seq: int) -> int:
+        """
+        Move a conversation's messages up to `through_seq` into cold storage
+
+        The rows are appended to the archive (and synced) before they are
+        deleted, so an interruption can only leave rows in both places, which
+        the next run cleans up.
+
+        Returns:
+            int: Number of hot rows removed
+        """
+        archived_last = await self._archived_last_seq(conversation_id)
+        while archived_last < through_seq:
+            batch = await self.get_hot_messages(conversation_id, archived_last, min(through_seq - archived_last, 1000))
+            batch = [message for message in batch if message.seq <= through_seq]
+            if not batch:
+                break
+            archived_last = await asyncio.to_thread(self._archive.append, conversation_id, batch)
+
+        through_seq = min(through_seq, archived_last)
+        return await self._messages.delete_through(conversation_id, through_seq)
+
+    async def get_hot_messages(self, conversation_id: str, since_seq: int = 0, limit: Optional[int] = None) -> List:
+        """Like get_messages_since, but never reads the archive"""
+        return await self._messages.messages_since(conversation_id, since_seq, limit)
+
+    async def get_last_seq(self, conversation_id: str) -> int:
+        """Highest sequence number allocated in a conversation (0 if none)"""
+        return await self._messages.last_seq(conversation_id)
+
+    async def get_messages(
+        self,
+        conversation_id: str,
+        current_user_id: int = None,
+        since_seq: int = 0,
+        limit: Optional[int] = None
+    ):
+        fetch_messages = await self.get_messages_since(conversation_id, since_seq, limit)
+        messages = [
+            {
+                "id": message.id,
+                "seq": message.seq,
+                "text": message.content,
+                "sender": "me" if current_user_id and message.senderId == current_user_id else "they",
+                "created_at": message.createdAt.isoformat(),
+                "updated_at": message.updatedAt.isoformat()
+            }
+            for message in fetch_messages
+        ]
+        return messages
+
+    async def warm(self, conversations: int) -> Dict[str, int]:
+        """
+        Prime the page cache of the hot indexes and the member cache. Call once after startup.
+
+        Args:
+            conversations: Member sets to load into the cache
+
+        Returns:
+            Dict[str, int]: Entries read per index, plus the member sets cached
+        """
+        entries = await self._storage.warm()
+        if self._partitions is not None:
+            entries["partitions"] = await self._partitions.warm()
+        cached = 0
+        after = None
+        while cached < conversations:
+            ids = await self._storage.conversation_ids(after, min(conversations - cached, 500))
+            if not ids:
+                break
+            for conversation_id, members in (await self._storage.load_members(ids)).items():
+                self._cache_members(conversation_id, members)
+            cached += len(ids)
+            after = ids[-1]
+        entries["member sets"] = cached
+        return entries
+
+    async def wait_for_listeners(self, timeout: float):
+        """Give listeners up to `timeout` seconds to finish with every stored message, e.g. while draining"""
+        if self._dispatching:
+            await asyncio.wait(list(self._dispatching), timeout=timeout)
+
+    async def stop(self):
+        """Cancel undelivered notifications and close partition connections and archive maps. Call during shutdown."""
+        for task in list(self._dispatching):
+            task.cancel()
+        if self._dispatching:
+            await asyncio.wait(list(self._dispatching))
+        if self._partitions is not None:
+            self._partitions.close()
+        self._archive.close()
+
+    async def _load_conversations(self, conversation_ids: List[str]) -> Dict[str, object]:
+        if self._partitions is not None:
+            conversations = await self._storage.load_conversations(conversation_ids, with_messages=False)
+            conversations = await self._attach_messages(conversations)
+        else:
+            conversations = await self._storage.load_conversations(conversation_ids)
+        conversations = await self._attach_archived(conversations)
+        return {conversation.id: conversation for conversation in conversations}
+
+    async def _load_members(self, conversation_ids: List[str]) -> Dict[str, FrozenSet[int]]:
+        return await self._storage.load_members(conversation_ids)
+
+    async def _attach_messages(self, conversations: List, newest_first: bool = False) -> List:
+        """Fill in messages (with their sender) and lastSeq from the partitions"""
+        ids = [conversation.id for conversation in conversations]
+        messages = await self._partitions.messages_for(ids, newest_first)
+        last_seqs = await self._partitions.last_seqs(ids)
+
+        result = []
+        for conversation in conversations:
+            users = {user.id: user for user in conversation.users or ()}
+            for message in messages[conversation.id]:
+                message.sender = users.get(message.senderId)
+            result.append(conversation.model_copy(update={
+                "messages": messages[conversation.id],
+                "lastSeq": last_seqs.get(conversation.id, 0),
+            }))
+        return result
+
+    async def _attach_archived(self, conversations: List) -> List:
+        """Prepend archived history (with senders) to full conversation records"""
+        result = []
+        for conversation in conversations:
+            if not await self._archived_last_seq(conversation.id):
+                result.append(conversation)
+                continue
+            archived = await asyncio.to_thread(self._archive.read_since, conversation.id, 0)
+            users = {user.id: user for user in conversation.users or ()}
+            for message in archived:
+                message.sender = users.get(message.senderId)
+            hot = [message for message in conversation.messages or () if message.seq > archived[-1].seq]
+            result.append(conversation.model_copy(update={"messages": archived + hot}))
+        return result
+
+    async def _archived_last_seq(self, conversation_id: str) -> int:
+        last_seq = self._archive.cached_last_seq(conversation_id)
+        if last_seq is None:
+            last_seq = await asyncio.to_thread(self._archive.last_seq, conversation_id)
+        return last_seq
+
+    def _cache_members(self, conversation_id: str, members: FrozenSet[int]):
+        self._members[conversation_id] = members
+        self._members.move_to_end(conversation_id)
+        if len(self._members) > MEMBER_CACHE_SIZE:
+            self._members.popitem(last=False)
+
+    async def _notify(self, message):
+        if not self._listeners and not self._inline_listeners:
+            return
+        conversation_id = message.conversationId
+        member_ids = await self.get_member_ids(conversation_id)
+        for listener in self._inline_listeners:
+            await self._call_listener(listener, message, member_ids)
+        if not self._listeners:
+            return
+
+        undelivered = self._undelivered.get(conversation_id)
+        if undelivered is None:
+            undelivered = self._undelivered[conversation_id] = deque()
+            task = asyncio.create_task(self._dispatch(conversation_id, undelivered))
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+        undelivered.append((message, member_ids))
+
+    async def _dispatch(self, conversation_id: str, undelivered: Deque[Tuple[object, FrozenSet[int]]]):
+        """Hand a conversation's messages to the background listeners, oldest first"""
+        try:
+            while undelivered:
+                message, member_ids = undelivered.popleft()
+                await asyncio.gather(*(
+                    self._call_listener(listener, message, member_ids) for listener in self._listeners
+                ))
+        finally:
+            del self._undelivered[conversation_id]
+
+    @staticmethod
+    async def _call_listener(listener: MessageListener, message, member_ids: FrozenSet[int]):
+        try:
+            await listener(message, member_ids)
+        except Exception as e:
+            alog.error(f"Message listener failed for conversation {message.conversationId}: {e}")
+
+
+# Global service instance
+chat_service = ChatService()
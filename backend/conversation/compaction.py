@@ -0,0 +1,86 @@
+"""
+Background compaction of old history into cold storage
+
+Every ARCHIVE_INTERVAL seconds, messages older than ARCHIVE_AFTER_DAYS are
+moved from the database (or the message partitions) into the per-conversation
+archive files of backend.conversation.archive. Reads stay transparent:
+`ChatService.get_messages_since` serves cursors that fall in the archived
+range from the archive and continues with the hot rows.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+import alog
+from backend.config.settings import settings
+from backend.conversation.chat import chat_service
+
+
+class ArchiveCompactor:
+    """Periodic job moving old messages into cold storage"""
+
+    def __init__(self):
+        self.after_days = settings.archive_after_days
+        self.interval = settings.archive_interval
+        self.batch_size = settings.archive_batch
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.after_days > 0
+
+    def start(self):
+        """Start the periodic job (no-op when ARCHIVE_AFTER_DAYS is 0). Call during startup."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic job. Call during shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def compact(self) -> int:
+        """
+        Archive every message older than the configured age
+
+        Returns:
+            int: Number of messages moved out of hot storage
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.after_days)
+        moved = 0
+        while True:
+            old = await chat_service.get_messages_older_than(cutoff, self.batch_size)
+            if not old:
+                break
+
+            # Archive each conversation up to its newest old message. Everything
+            # below that seq goes too, so the archived range stays contiguous.
+            through: Dict[str, int] = {}
+            for message in old:
+                through[message.conversationId] = max(message.seq, through.get(message.conversationId, 0))
+
+            removed = 0
+            for conversation_id, seq in through.items():
+                removed += await chat_service.archive_messages(conversation_id, seq)
+            moved += removed
+            if removed == 0:
+                break
+        return moved
+
+    async def _run(self):
+        while True:
+            try:
+                moved = await self.compact()
+                if moved:
+                    alog.info(f"Archived {moved} messages older than {self.after_days} days")
+            except Exception as e:
+                alog.error(f"Archive compaction failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Global compactor instance
+archive_compactor = ArchiveCompactor()
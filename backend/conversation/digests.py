@@ -0,0 +1,222 @@
+"""
+Email digests for members who are away
+
+A member who has no socket that would show them a new message (neither the
+multiplexed socket nor a per-conversation socket on that conversation) gets
+it added to their pending digest: a count, the last seq and the latest few
+previews per conversation, so memory per user stays bounded however many
+messages arrive. Coming online drops the pending digest, since the inbox
+and unread counts cover it from there.
+
+DIGEST_WINDOW seconds after the first message a user missed, their digest is
+due. Due digests are sent DIGEST_BATCH recipients at a time: one storage
+query loads the conversations (names and members) of the whole batch and
+one the read pointers of its recipients, conversations read in the
+meantime are left out, and the emails go out over one pooled SMTP
+connection in a worker thread. Each user gets at most one email per
+window, whatever the message volume. A batch that fails (database or SMTP
+error) goes back to the pending digests and is retried on the next tick.
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, FrozenSet, Optional, Tuple
+import alog
+from backend.config.settings import settings
+from backend.connection import manager
+from backend.conversation.chat import chat_service
+from backend.conversation.receipts import read_receipts
+from backend.storage import storage
+from backend.utils.email import build_digest_email, mail_configured, mail_pool
+
+PREVIEWS_PER_CONVERSATION = 3
+PREVIEW_LENGTH = 140
+# Upper bound on how often due digests are looked for
+MAX_TICK_SECONDS = 60
+
+
+class _Missed:
+    """Messages a user missed in one conversation"""
+    __slots__ = ("count", "last_seq", "previews")
+
+    def __init__(self):
+        self.count = 0
+        self.last_seq = 0
+        # (sender_id, preview), newest last
+        self.previews: Deque[Tuple[int, str]] = deque(maxlen=PREVIEWS_PER_CONVERSATION)
+
+
+class _Digest:
+    """A user's pending digest"""
+    __slots__ = ("since", "conversations")
+
+    def __init__(self, since: float):
+        # Loop time of the first missed message; the digest is due a window later
+        self.since = since
+        self.conversations: Dict[str, _Missed] = {}
+
+
+class DigestMailer:
+    """Collects messages missed by offline members and mails one digest per user per window"""
+
+    def __init__(self):
+        self.window = settings.digest_window
+        self.batch_size = settings.digest_batch
+        self.enabled = self.window > 0 and mail_configured()
+        self.sent = 0
+        self.failed = 0
+        self._pending: Dict[int, _Digest] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the periodic job (no-op when DIGEST_WINDOW is 0 or SMTP is not configured). Call during startup."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic job and log out of pooled SMTP connections. Call during shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(mail_pool.close)
+
+    async def record(self, message, member_ids: FrozenSet[int]):
+        """Message listener: add the message to the digest of every member who cannot see it"""
+        if not self.enabled:
+            return
+        conversation_id = message.conversationId
+        now = asyncio.get_running_loop().time()
+        for user_id in member_ids:
+            if user_id == message.senderId or self._reachable(user_id, conversation_id):
+                continue
+            digest = self._pending.get(user_id)
+            if digest is None:
+                digest = self._pending[user_id] = _Digest(now)
+            missed = digest.conversations.get(conversation_id)
+            if missed is None:
+                missed = digest.conversations[conversation_id] = _Missed()
+            missed.count += 1
+            missed.last_seq = max(missed.last_seq, message.seq)
+            missed.previews.append((message.senderId, message.content[:PREVIEW_LENGTH]))
+
+    def user_changed(self, user_id: int, online: bool):
+        """Connection listener: a user who comes back sees their unread counts instead"""
+        if online:
+            self._pending.pop(user_id, None)
+
+    def pending_users(self) -> int:
+        return len(self._pending)
+
+    async def send_due(self) -> int:
+        """
+        Send every digest whose window has elapsed
+
+        Returns:
+            int: Number of digests sent
+        """
+        now = asyncio.get_running_loop().time()
+        due = [user_id for user_id, digest in self._pending.items() if now - digest.since >= self.window]
+        sent = 0
+        for start in range(0, len(due), self.batch_size):
+            batch = {
+                user_id: self._pending.pop(user_id)
+                for user_id in due[start:start + self.batch_size] if user_id in self._pending
+            }
+            if batch:
+                try:
+                    sent += await self._send_batch(batch)
+                except BaseException:
+                    self._requeue(batch)
+                    raise
+        return sent
+
+    def _requeue(self, batch: Dict[int, _Digest]):
+        """Put digests back after a failed send, merged with anything missed since"""
+        for user_id, digest in batch.items():
+            if manager.is_online(user_id):
+                continue
+            newer = self._pending.get(user_id)
+            if newer is not None:
+                for conversation_id, missed in newer.conversations.items():
+                    earlier = digest.conversations.get(conversation_id)
+                    if earlier is None:
+                        digest.conversations[conversation_id] = missed
+                        continue
+                    earlier.count += missed.count
+                    earlier.last_seq = max(earlier.last_seq, missed.last_seq)
+                    earlier.previews.extend(missed.previews)
+            self._pending[user_id] = digest
+
+    async def _send_batch(self, batch: Dict[int, _Digest]) -> int:
+        conversation_ids = list({conversation_id for digest in batch.values() for conversation_id in digest.conversations})
+        conversations = {
+            conversation.id: conversation
+            for conversation in await storage.load_conversations(conversation_ids, with_messages=False)
+        }
+
+        unread = await read_receipts.unread_counts_for(
+            [
+                (user_id, conversation_id)
+                for user_id, digest in batch.items()
+                for conversation_id in digest.conversations if conversation_id in conversations
+            ],
+            conversations.values()
+        )
+
+        messages = []
+        for user_id, digest in batch.items():
+            recipient = None
+            sections = []
+            for conversation_id, missed in digest.conversations.items():
+                conversation = conversations.get(conversation_id)
+                if conversation is None:
+                    continue
+                users = {user.id: user for user in conversation.users or ()}
+                recipient = recipient or users.get(user_id)
+                # Read on another device since: nothing to tell
+                count = unread.get((user_id, conversation_id), 0)
+                if not count:
+                    continue
+                others = [user.name or user.email for uid, user in users.items() if uid != user_id]
+                title = conversation.name or ", ".join(others) or "Conversation"
+                previews = [
+                    (users[sender_id].name or users[sender_id].email if sender_id in users else "Someone", preview)
+                    for sender_id, preview in missed.previews
+                ]
+                sections.append((title, min(missed.count, count), previews))
+            if recipient is not None and sections:
+                messages.append(build_digest_email(recipient.email, recipient.name, sections))
+
+        if not messages:
+            return 0
+        results = await asyncio.to_thread(mail_pool.send, messages)
+        sent = sum(results)
+        self.sent += sent
+        self.failed += len(results) - sent
+        alog.info(f"Sent {sent} of {len(results)} message digests")
+        return sent
+
+    async def _run(self):
+        tick = min(self.window, MAX_TICK_SECONDS)
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                await self.send_due()
+            except Exception as e:
+                alog.error(f"Sending message digests failed: {e}")
+
+    @staticmethod
+    def _reachable(user_id: int, conversation_id: str) -> bool:
+        return any(
+            connection.multiplexed or conversation_id in connection.conversations
+            for connection in manager.user_connections.get(user_id, ())
+        )
+
+
+# Global digest mailer instance
+digest_mailer = DigestMailer()
+chat_service.add_listener(digest_mailer.record)
+manager.add_presence_listener(digest_mailer.user_changed)
@@ -0,0 +1,152 @@
+"""
+Idempotency keys for message sends
+
+Clients that retry a send (e.g. a mobile app replaying its outbox after a
+dropped connection) attach a key to each message. The first request with a
+key performs the write; later requests with the same key, from the same
+user, get the stored result instead of a second message. A retry that
+arrives while the first attempt is still running waits for it.
+
+Keys live in memory, bounded by IDEMPOTENCY_CACHE_SIZE entries and
+IDEMPOTENCY_TTL seconds, oldest dropped first; a restart forgets them. Keys
+of requests still in flight are never dropped, so the cache can briefly
+exceed its size by the number of concurrent sends.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from backend.config.settings import settings
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request"""
+
+    def __init__(self, key: str):
+        super().__init__(f"Idempotency key {key!r} was already used for a different request")
+        self.key = key
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires")
+
+    def __init__(self, fingerprint: Hashable, future: asyncio.Future, expires: float):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires = expires
+
+
+class IdempotencyStore:
+    """Bounded, expiring map of (user, key) -> result of the first request"""
+
+    def __init__(self, max_entries: int = 50_000, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Insertion order is expiry order, since every entry lives for the same ttl
+        self._entries: "OrderedDict[Tuple[int, str], _Entry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def run(
+        self,
+        scope: int,
+        requests: Sequence[Tuple[Optional[str], Hashable]],
+        execute: Callable[[List[int]], Awaitable[List]]
+    ) -> List[Tuple[object, bool]]:
+        """
+        Execute a batch of requests, skipping the ones whose key was seen before
+
+        Args:
+            scope: Owner of the keys (the user ID); keys of different users never collide
+            requests: (key, fingerprint) per request; requests without a key always execute.
+                The fingerprint identifies the request's content, so reusing a key for
+                something else is detected.
+            execute: Called once with the indexes of the requests to perform; returns
+                their results in the same order
+
+        Returns:
+            List[Tuple[object, bool]]: (result, replayed) per request, in request order
+
+        Raises:
+            IdempotencyConflict: If a key was used before with a different fingerprint
+        """
+        to_execute: List[int] = []
+        owned: Dict[int, asyncio.Future] = {}
+        waiting: Dict[int, asyncio.Future] = {}
+        try:
+            for index, (key, fingerprint) in enumerate(requests):
+                if key is None:
+                    to_execute.append(index)
+                    continue
+                future, owner = self._claim(scope, key, fingerprint)
+                if owner:
+                    to_execute.append(index)
+                    owned[index] = future
+                else:
+                    waiting[index] = future
+        except IdempotencyConflict as e:
+            self._release(scope, requests, owned, e)
+            raise
+
+        try:
+            results = await execute(to_execute) if to_execute else []
+        except BaseException as e:
+            self._release(scope, requests, owned, e)
+            raise
+
+        outcome: List[Tuple[object, bool]] = [(None, False)] * len(requests)
+        for index, result in zip(to_execute, results):
+            outcome[index] = (result, False)
+            if index in owned:
+                owned[index].set_result(result)
+        # Only wait after resolving our own keys: a duplicate within the batch, or a
+        # concurrent batch waiting on one of them, can then never deadlock
+        for index, future in waiting.items():
+            outcome[index] = (await asyncio.shield(future), True)
+        return outcome
+
+    def _claim(self, scope: int, key: str, fingerprint: Hashable) -> Tuple[asyncio.Future, bool]:
+        """Return the key's future and whether the caller now owns (must resolve) it"""
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._entries.get((scope, key))
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            return entry.future, False
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[(scope, key)] = _Entry(fingerprint, future, now + self.ttl)
+        return future, True
+
+    def _release(self, scope: int, requests, owned: Dict[int, asyncio.Future], error: BaseException):
+        """Forget keys whose request failed so a retry executes again, and fail their waiters"""
+        if not isinstance(error, Exception):
+            error = RuntimeError("Concurrent request with the same idempotency key was cancelled")
+        for index, future in owned.items():
+            key = (scope, requests[index][0])
+            entry = self._entries.get(key)
+            if entry is not None and entry.future is future:
+                del self._entries[key]
+            if not future.done():
+                future.set_exception(error)
+                # Nobody may be waiting; don't log "exception was never retrieved"
+                future.exception()
+
+    def _evict(self, now: float):
+        """Drop expired entries and make room for one more, oldest first, never dropping one still in flight"""
+        stale = []
+        excess = len(self._entries) - self.max_entries + 1
+        for key, entry in self._entries.items():
+            if entry.expires > now and len(stale) >= excess:
+                break
+            # Forgetting an in-flight key would let a concurrent retry send again
+            if entry.future.done():
+                stale.append(key)
+        for key in stale:
+            del self._entries[key]
+
+
+# Global store instance
+idempotency_store = IdempotencyStore(settings.idempotency_cache_size, settings.idempotency_ttl)
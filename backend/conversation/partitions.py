@@ -0,0 +1,507 @@
+"""
+Hash-partitioned message storage
+
+With MESSAGE_PARTITIONS=N (N > 0) message rows no longer live in the main
+database but in N SQLite files, chosen by a stable hash of the conversation
+ID. Users, conversations and read state stay in the main database. Each
+partition has its own connection on its own worker thread, so writes to
+conversations on different partitions run in parallel instead of queueing
+on the main database's single write lock.
+
+Each partition also keeps the per-conversation sequence counters for the
+conversations it owns, so allocating a seq and storing the message is one
+local transaction.
+
+Files are named `messages-<i>-of-<N>.db`, so a different partition count
+never reuses existing files; use `python -m backend.conversation.reshard` to
+copy messages between layouts.
+"""
+import asyncio
+import contextlib
+import json
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+import alog
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS "Message" (
+    "id" TEXT NOT NULL PRIMARY KEY,
+    "content" TEXT NOT NULL,
+    "senderId" INTEGER NOT NULL,
+    "conversationId" TEXT NOT NULL,
+    "seq" INTEGER NOT NULL,
+    "createdAt" INTEGER NOT NULL,
+    "updatedAt" INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "Message_conversationId_seq_key" ON "Message"("conversationId", "seq");
+CREATE INDEX IF NOT EXISTS "Message_createdAt_idx" ON "Message"("createdAt");
+CREATE TABLE IF NOT EXISTS "Sequence" (
+    "conversationId" TEXT NOT NULL PRIMARY KEY,
+    "lastSeq" INTEGER NOT NULL
+);
+"""
+
+MESSAGE_COLUMNS = '"id", "content", "senderId", "conversationId", "seq", "createdAt", "updatedAt"'
+# Conversation IDs per IN (...) list, well under SQLite's variable limit
+IDS_PER_QUERY = 500
+# Seconds a partition waits for the others of a cross-partition batch before rolling back
+BATCH_COMMIT_TIMEOUT = 30.0
+
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+_id_counter = 0
+_id_lock = threading.Lock()
+
+
+def _base36(value: int, width: int) -> str:
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, 36)
+        digits.append(_BASE36[digit])
+    return "".join(reversed(digits))
+
+
+def new_message_id() -> str:
+    """Generate a cuid-shaped ID (25 characters, roughly time-ordered) like Prisma's default"""
+    global _id_counter
+    with _id_lock:
+        _id_counter = (_id_counter + 1) % 36 ** 4
+        counter = _id_counter
+    return (
+        "c"
+        + _base36(time.time_ns() // 1_000_000, 8)
+        + _base36(counter, 4)
+        + _base36(int.from_bytes(secrets.token_bytes(8), "big"), 12)
+    )
+
+
+def now_millis() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def from_millis(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+def partition_index(conversation_id: str, count: int) -> int:
+    """Stable partition number for a conversation (independent of PYTHONHASHSEED)"""
+    return zlib.crc32(conversation_id.encode("utf-8")) % count
+
+
+def partition_path(directory, index: int, count: int) -> Path:
+    return Path(directory) / f"messages-{index:03d}-of-{count:03d}.db"
+
+
+def open_partition(path: Path) -> sqlite3.Connection:
+    """Open (creating if needed) a partition file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+    # Only takes effect for new files; see `python -m backend.conversation.retention enable-incremental-vacuum`
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class PartitionMessage:
+    """Message row from a partition, with the same attribute names as the Prisma model"""
+    __slots__ = ("id", "content", "senderId", "conversationId", "seq", "createdAt", "updatedAt", "sender")
+
+    def __init__(self, id, content, senderId, conversationId, seq, createdAt, updatedAt):
+        self.id = id
+        self.content = content
+        self.senderId = senderId
+        self.conversationId = conversationId
+        self.seq = seq
+        self.createdAt = from_millis(createdAt)
+        self.updatedAt = from_millis(updatedAt)
+        # Filled in from the conversation's members when a response needs it
+        self.sender = None
+
+
+class Partition:
+    """One partition file, used only from its own worker thread"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"partition-{path.stem}")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn)
+
+    def close(self):
+        self._executor.submit(self._close).result()
+        self._executor.shutdown(wait=True)
+
+    def _call(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        if self._conn is None:
+            self._conn = open_partition(self.path)
+        return fn(self._conn)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class MessagePartitions:
+    """Routes message reads and writes to partition files by conversation ID"""
+
+    def __init__(self, count: int, directory):
+        self.count = count
+        self.directory = Path(directory)
+        self.partitions = [Partition(partition_path(directory, index, count)) for index in range(count)]
+        # One batch spanning several partitions commits at a time (see create_messages)
+        self._batch_lock = asyncio.Lock()
+        alog.info(f"Message storage split across {count} partitions in {self.directory}")
+
+    def partition(self, conversation_id: str) -> Partition:
+        return self.partitions[partition_index(conversation_id, self.count)]
+
+    async def create_message(self, conversation_id: str, sender_id: int, content: str) -> PartitionMessage:
+        """Allocate the next seq and store the message in one partition transaction"""
+        def create(conn: sqlite3.Connection):
+            row_id, now = new_message_id(), now_millis()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = conn.execute(
+                    'INSERT INTO "Sequence" ("conversationId", "lastSeq") VALUES (?, 1) '
+                    'ON CONFLICT ("conversationId") DO UPDATE SET "lastSeq" = "lastSeq" + 1 '
+                    'RETURNING "lastSeq"',
+                    (conversation_id,)
+                ).fetchone()[0]
+                row = (row_id, content, sender_id, conversation_id, seq, now, now)
+                conn.execute(f'INSERT INTO "Message" ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return PartitionMessage(*row)
+
+        return await self.partition(conversation_id).run(create)
+
+    async def create_messages(self, messages: List[Tuple[str, int, str]]) -> List[PartitionMessage]:
+        """
+        Store a batch of messages atomically, with one transaction per partition
+
+        The partitions of a batch commit together: each one allocates seqs and
+        inserts its rows, then holds its worker thread until every other
+        partition has done the same. If any of them fails, all roll back, and
+        if a COMMIT itself fails, the partitions that did commit delete their
+        rows again and restore their counters before anything else runs on
+        them. Either way nothing is stored and no seq is skipped.
+
+        Args:
+            messages: (conversation_id, sender_id, content) tuples; messages of the same
+                conversation get consecutive seqs in list order
+
+        Returns:
+            List[PartitionMessage]: Stored messages, in input order
+        """
+        by_partition: Dict[int, List[int]] = {}
+        for index, (conversation_id, _, _) in enumerate(messages):
+            by_partition.setdefault(partition_index(conversation_id, self.count), []).append(index)
+        groups = list(by_partition.items())
+        # Every partition waits at these until the others have inserted, then committed
+        prepared = threading.Barrier(len(groups), timeout=BATCH_COMMIT_TIMEOUT)
+        committed = threading.Barrier(len(groups), timeout=BATCH_COMMIT_TIMEOUT)
+
+        def create(indexes: List[int]):
+            def run(conn: sqlite3.Connection):
+                counts: Dict[str, int] = {}
+                for index in indexes:
+                    counts[messages[index][0]] = counts.get(messages[index][0], 0) + 1
+                now = now_millis()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    next_seqs = {}
+                    for conversation_id, count in counts.items():
+                        last_seq = conn.execute(
+                            'INSERT INTO "Sequence" ("conversationId", "lastSeq") VALUES (?, ?) '
+                            'ON CONFLICT ("conversationId") DO UPDATE SET "lastSeq" = "lastSeq" + excluded."lastSeq" '
+                            'RETURNING "lastSeq"',
+                            (conversation_id, count)
+                        ).fetchone()[0]
+                        next_seqs[conversation_id] = last_seq - count + 1
+                    rows = []
+                    for index in indexes:
+                        conversation_id, sender_id, content = messages[index]
+                        rows.append((new_message_id(), content, sender_id, conversation_id, next_seqs[conversation_id], now, now))
+                        next_seqs[conversation_id] += 1
+                    conn.executemany(f'INSERT INTO "Message" ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                    prepared.wait()
+                    conn.execute("COMMIT")
+                except BaseException:
+                    prepared.abort()
+                    committed.abort()
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+
+                try:
+                    committed.wait()
+                except threading.BrokenBarrierError:
+                    # Another partition failed to commit; this worker has run nothing
+                    # else since, so the counters can be put back exactly
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        conn.executemany('DELETE FROM "Message" WHERE "id" = ?', [(row[0],) for row in rows])
+                        conn.executemany(
+                            'UPDATE "Sequence" SET "lastSeq" = "lastSeq" - ? WHERE "conversationId" = ?',
+                            [(count, conversation_id) for conversation_id, count in counts.items()]
+                        )
+                        conn.execute("COMMIT")
+                    except BaseException:
+                        conn.execute("ROLLBACK")
+                        raise
+                    raise
+                return [PartitionMessage(*row) for row in rows]
+            return run
+
+        # Workers of one multi-partition batch wait for each other; two such batches
+        # interleaved on the same workers would wait for each other forever
+        lock = self._batch_lock if len(groups) > 1 else contextlib.nullcontext()
+        async with lock:
+            results = await asyncio.gather(
+                *(self.partitions[index].run(create(indexes)) for index, indexes in groups),
+                return_exceptions=True
+            )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Partitions that only saw the barrier break report that instead of the cause
+            raise next((e for e in errors if not isinstance(e, threading.BrokenBarrierError)), errors[0])
+
+        created: List[Optional[PartitionMessage]] = [None] * len(messages)
+        for (_, indexes), partition_messages in zip(groups, results):
+            for index, message in zip(indexes, partition_messages):
+                created[index] = message
+        return created
+
+    async def messages_since(self, conversation_id: str, since_seq: int = 0, limit: Optional[int] = None) -> List[PartitionMessage]:
+        def select(conn: sqlite3.Connection):
+            rows = conn.execute(
+                f'SELECT {MESSAGE_COLUMNS} FROM "Message" WHERE "conversationId" = ? AND "seq" > ? '
+                'ORDER BY "seq" LIMIT ?',
+                (conversation_id, since_seq, -1 if limit is None else limit)
+            ).fetchall()
+            return [PartitionMessage(*row) for row in rows]
+
+        return await self.partition(conversation_id).run(select)
+
+    async def last_seq(self, conversation_id: str) -> int:
+        return (await self.last_seqs([conversation_id])).get(conversation_id, 0)
+
+    async def last_seqs(self, conversation_ids: Iterable[str]) -> Dict[str, int]:
+        """Highest allocated seq per conversation; conversations without messages are omitted"""
+        def select(ids: List[str]):
+            def run(conn: sqlite3.Connection):
+                found = {}
+                for start in range(0, len(ids), IDS_PER_QUERY):
+                    chunk = ids[start:start + IDS_PER_QUERY]
+                    found.update(conn.execute(
+                        f'SELECT "conversationId", "lastSeq" FROM "Sequence" '
+                        f'WHERE "conversationId" IN ({", ".join("?" * len(chunk))})',
+                        chunk
+                    ).fetchall())
+                return found
+            return run
+
+        result: Dict[str, int] = {}
+        for found in await self._fan_out(conversation_ids, select):
+            result.update(found)
+        return result
+
+    async def messages_for(self, conversation_ids: Iterable[str], newest_first: bool = False) -> Dict[str, List[PartitionMessage]]:
+        """Every message of several conversations, grouped by conversation"""
+        order = "DESC" if newest_first else "ASC"
+
+        def select(ids: List[str]):
+            def run(conn: sqlite3.Connection):
+                rows = []
+                for start in range(0, len(ids), IDS_PER_QUERY):
+                    chunk = ids[start:start + IDS_PER_QUERY]
+                    rows.extend(conn.execute(
+                        f'SELECT {MESSAGE_COLUMNS} FROM "Message" '
+                        f'WHERE "conversationId" IN ({", ".join("?" * len(chunk))}) '
+                        f'ORDER BY "conversationId", "seq" {order}',
+                        chunk
+                    ).fetchall())
+                return [PartitionMessage(*row) for row in rows]
+            return run
+
+        grouped: Dict[str, List[PartitionMessage]] = {conversation_id: [] for conversation_id in conversation_ids}
+        for messages in await self._fan_out(grouped.keys(), select):
+            for message in messages:
+                grouped[message.conversationId].append(message)
+        return grouped
+
+    async def insert_messages(self, rows: List[tuple], skip_existing: bool = False) -> int:
+        """
+        Bulk-insert message rows, one transaction per partition
+
+        Args:
+            rows: Tuples in MESSAGE_COLUMNS order, timestamps in epoch milliseconds
+            skip_existing: Skip rows whose ID or (conversation, seq) already exists
+                instead of failing
+
+        Returns:
+            int: Number of rows inserted
+
+        Raises:
+            sqlite3.IntegrityError: If a row already exists and `skip_existing` is False
+                (nothing is inserted in that row's partition)
+        """
+        by_partition: Dict[int, List[tuple]] = {}
+        for row in rows:
+            by_partition.setdefault(partition_index(row[3], self.count), []).append(row)
+
+        def insert(partition_rows: List[tuple]):
+            def run(conn: sqlite3.Connection):
+                last_seqs: Dict[str, int] = {}
+                for row in partition_rows:
+                    last_seqs[row[3]] = max(row[4], last_seqs.get(row[3], 0))
+                before = conn.total_changes
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(
+                        f'INSERT {"OR IGNORE " if skip_existing else ""}INTO "Message" ({MESSAGE_COLUMNS}) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        partition_rows
+                    )
+                    inserted = conn.total_changes - before
+                    conn.executemany(
+                        'INSERT INTO "Sequence" ("conversationId", "lastSeq") VALUES (?, ?) '
+                        'ON CONFLICT ("conversationId") DO UPDATE SET "lastSeq" = max("lastSeq", excluded."lastSeq")',
+                        list(last_seqs.items())
+                    )
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                return inserted
+            return run
+
+        counts = await asyncio.gather(*(
+            self.partitions[index].run(insert(partition_rows)) for index, partition_rows in by_partition.items()
+        ))
+        return sum(counts)
+
+    async def messages_older_than(
+        self, cutoff: datetime, limit: int, exclude: Iterable[str] = ()
+    ) -> List[PartitionMessage]:
+        """
+        Messages created before `cutoff`, ordered by conversation and seq, at most `limit` per partition
+
+        Args:
+            cutoff: Creation time bound
+            limit: Rows per partition
+            exclude: Conversations to leave out
+        """
+        cutoff_millis = int(cutoff.timestamp() * 1000)
+        # A JSON array keeps any number of exclusions within one bound parameter
+        excluded = json.dumps(list(exclude))
+
+        def select(conn: sqlite3.Connection):
+            rows = conn.execute(
+                f'SELECT {MESSAGE_COLUMNS} FROM "Message" WHERE "createdAt" < ? '
+                'AND "conversationId" NOT IN (SELECT "value" FROM json_each(?)) '
+                'ORDER BY "conversationId", "seq" LIMIT ?',
+                (cutoff_millis, excluded, limit)
+            ).fetchall()
+            return [PartitionMessage(*row) for row in rows]
+
+        results = await asyncio.gather(*(partition.run(select) for partition in self.partitions))
+        return [message for messages in results for message in messages]
+
+    async def delete_through(self, conversation_id: str, seq: int) -> int:
+        """Delete a conversation's messages up to and including `seq`"""
+        def delete(conn: sqlite3.Connection):
+            return conn.execute(
+                'DELETE FROM "Message" WHERE "conversationId" = ? AND "seq" <= ?',
+                (conversation_id, seq)
+            ).rowcount
+
+        return await self.partition(conversation_id).run(delete)
+
+    async def newest_seq_before(self, conversation_id: str, cutoff: datetime) -> int:
+        """Highest seq of a message created before `cutoff` (0 if none)"""
+        cutoff_millis = int(cutoff.timestamp() * 1000)
+
+        def select(conn: sqlite3.Connection):
+            return conn.execute(
+                'SELECT max("seq") FROM "Message" WHERE "conversationId" = ? AND "createdAt" < ?',
+                (conversation_id, cutoff_millis)
+            ).fetchone()[0] or 0
+
+        return await self.partition(conversation_id).run(select)
+
+    async def purge_through(self, conversation_id: str, seq: int, limit: int) -> int:
+        """Delete at most `limit` of a conversation's oldest messages up to `seq`; returns the count"""
+        def delete(conn: sqlite3.Connection):
+            return conn.execute(
+                'DELETE FROM "Message" WHERE "rowid" IN (SELECT "rowid" FROM "Message" '
+                'WHERE "conversationId" = ? AND "seq" <= ? ORDER BY "seq" LIMIT ?)',
+                (conversation_id, seq, limit)
+            ).rowcount
+
+        return await self.partition(conversation_id).run(delete)
+
+    async def reclaim_space(self, pages: int) -> int:
+        """Return up to `pages` free pages per partition to the filesystem; returns the pages freed"""
+        def vacuum(conn: sqlite3.Connection):
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if before:
+                # executescript steps the pragma to completion (execute stops after one page)
+                conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        return sum(await asyncio.gather(*(partition.run(vacuum) for partition in self.partitions)))
+
+    async def warm(self) -> int:
+        """
+        Open every partition connection and read the seq index and the Sequence table once,
+        so their pages are cached before the first request
+
+        Returns:
+            int: Index entries read
+        """
+        def scan(conn: sqlite3.Connection):
+            return (
+                conn.execute('SELECT count(*) FROM "Message" INDEXED BY "Message_conversationId_seq_key"').fetchone()[0]
+                + conn.execute('SELECT count(*) FROM "Sequence"').fetchone()[0]
+            )
+
+        return sum(await asyncio.gather(*(partition.run(scan) for partition in self.partitions)))
+
+    def close(self):
+        """Close every partition connection. Call during shutdown."""
+        for partition in self.partitions:
+            partition.close()
+
+    async def _fan_out(self, conversation_ids: Iterable[str], make_query) -> list:
+        # One query per partition touched, run concurrently
+        by_partition: Dict[int, List[str]] = {}
+        for conversation_id in conversation_ids:
+            by_partition.setdefault(partition_index(conversation_id, self.count), []).append(conversation_id)
+        return await asyncio.gather(*(
+            self.partitions[index].run(make_query(ids)) for index, ids in by_partition.items()
+        ))
+
+
+def database_path(database_url: str) -> Path:
+    """Filesystem path of a `file:` SQLite URL"""
+    path = database_url[len("file:"):] if database_url.startswith("file:") else database_url
+    return Path(path.split("?", 1)[0])
+
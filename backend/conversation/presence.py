@@ -0,0 +1,185 @@
+"""
+Presence and typing indicators
+
+Online state comes from the connection registry: a user is online while they
+have at least one socket open. Typing is reported by clients with
+
+    {"type": "typing", "conversation_id": "..."}
+
+on the multiplexed socket, repeated while the user keeps typing, and
+`"active": false` when they stop; an indicator that is not refreshed
+expires after TYPING_TTL seconds, and sending a message clears it.
+
+Nothing is forwarded per event. Changes only mark the conversation dirty,
+and every PRESENCE_INTERVAL seconds one `presence` frame
+
+    {"type": "presence", "conversation_id": "...", "online": [1, 2], "typing": [2]}
+
+goes to the multiplexed subscribers of each dirty conversation whose state
+actually changed. Keystroke rate therefore never affects traffic: it is at
+most one frame per conversation per interval. Subscribing returns the
+current state immediately.
+"""
+import asyncio
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+import alog
+from backend.config.settings import settings
+from backend.connection import Connection, manager
+from backend.conversation.chat import chat_service
+from backend.utils.wire import Frame
+
+# Every this many ticks, forget conversations nobody is subscribed to anymore
+SWEEP_TICKS = 30
+
+
+class Presence:
+    """Coalesced online and typing state for conversations with multiplexed subscribers"""
+
+    def __init__(self):
+        self.interval = settings.presence_interval
+        self.typing_ttl = settings.typing_ttl
+        # conversation_id -> members, for conversations someone subscribed to
+        self._watched: Dict[str, FrozenSet[int]] = {}
+        # user_id -> watched conversations they are a member of
+        self._watched_by_user: Dict[int, Set[str]] = {}
+        # conversation_id -> {user_id: loop time their typing indicator expires}
+        self._typing: Dict[str, Dict[int, float]] = {}
+        # conversation_id -> (online, typing) as last sent
+        self._sent: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def watch(self, connection: Connection, conversation_id: str):
+        """Track a conversation a socket subscribed to and send it the current state"""
+        if conversation_id not in self._watched:
+            members = await chat_service.get_member_ids(conversation_id)
+            self._watched[conversation_id] = members
+            for user_id in members:
+                self._watched_by_user.setdefault(user_id, set()).add(conversation_id)
+            self._ensure_task()
+        state = self.state(conversation_id, self._watched[conversation_id])
+        await manager.send([connection], self._frame(conversation_id, *state))
+
+    def state(self, conversation_id: str, members: FrozenSet[int]) -> Tuple[List[int], List[int]]:
+        """
+        Current presence of a conversation
+
+        Args:
+            conversation_id: Conversation to report on
+            members: Its member IDs
+
+        Returns:
+            Tuple[List[int], List[int]]: Online member IDs and IDs of members typing, sorted
+        """
+        online = sorted(user_id for user_id in members if manager.is_online(user_id))
+        typing = sorted(self._typing.get(conversation_id, ()))
+        return online, typing
+
+    def typing(self, user_id: int, conversation_id: str, active: bool = True):
+        """Start, refresh or stop a member's typing indicator"""
+        typers = self._typing.get(conversation_id)
+        if not active:
+            if typers is not None and typers.pop(user_id, None) is not None:
+                self._changed(conversation_id)
+            return
+        if typers is None:
+            typers = self._typing[conversation_id] = {}
+        if user_id not in typers:
+            self._changed(conversation_id)
+        # Refreshing an indicator that is already shown costs one dict write
+        typers[user_id] = asyncio.get_running_loop().time() + self.typing_ttl
+
+    def user_changed(self, user_id: int, online: bool):
+        """Connection listener: a user's first socket opened or last socket closed"""
+        for conversation_id in self._watched_by_user.get(user_id, ()):
+            if not online:
+                self._typing.get(conversation_id, {}).pop(user_id, None)
+            self._changed(conversation_id)
+
+    async def message_sent(self, message, member_ids: FrozenSet[int]):
+        """Message listener: the sender has stopped typing"""
+        typers = self._typing.get(message.conversationId)
+        if typers is not None and message.senderId in typers:
+            self.typing(message.senderId, message.conversationId, active=False)
+
+    async def stop(self):
+        """Stop the flush task. Call during shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _changed(self, conversation_id: str):
+        self._dirty.add(conversation_id)
+        self._ensure_task()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        ticks = 0
+        # Runs while there is anything to watch; activity restarts it
+        while self._watched or self._typing or self._dirty:
+            await asyncio.sleep(self.interval)
+            ticks += 1
+            try:
+                self._expire_typing()
+                if ticks % SWEEP_TICKS == 0:
+                    self._sweep()
+                await self._flush()
+            except Exception as e:
+                alog.error(f"Presence flush failed: {e}")
+
+    def _expire_typing(self):
+        now = asyncio.get_running_loop().time()
+        for conversation_id, typers in list(self._typing.items()):
+            expired = [user_id for user_id, expires in typers.items() if expires <= now]
+            for user_id in expired:
+                del typers[user_id]
+            if expired:
+                self._dirty.add(conversation_id)
+            if not typers:
+                del self._typing[conversation_id]
+
+    def _sweep(self):
+        for conversation_id in [c for c in self._watched if c not in manager.active_connections]:
+            for user_id in self._watched.pop(conversation_id):
+                watched = self._watched_by_user.get(user_id)
+                if watched is not None:
+                    watched.discard(conversation_id)
+                    if not watched:
+                        del self._watched_by_user[user_id]
+            self._sent.pop(conversation_id, None)
+            self._typing.pop(conversation_id, None)
+
+    async def _flush(self):
+        dirty, self._dirty = self._dirty, set()
+        sends = []
+        for conversation_id in dirty:
+            subscribers = [
+                connection
+                for connection in manager.active_connections.get(conversation_id, ())
+                if connection.multiplexed
+            ]
+            if not subscribers:
+                continue
+            state = self.state(conversation_id, self._watched.get(conversation_id, frozenset()))
+            if self._sent.get(conversation_id) == state:
+                continue
+            self._sent[conversation_id] = state
+            sends.append(manager.send(subscribers, self._frame(conversation_id, *state)))
+        await asyncio.gather(*sends)
+
+    @staticmethod
+    def _frame(conversation_id: str, online: List[int], typing: List[int]) -> Frame:
+        return Frame({"type": "presence", "conversation_id": conversation_id, "online": online, "typing": typing})
+
+
+# Global presence instance
+presence = Presence()
+manager.add_presence_listener(presence.user_changed)
+chat_service.add_listener(presence.message_sent)
@@ -0,0 +1,194 @@
+"""
+Multiplexed per-user WebSocket protocol
+
+A single socket carries every conversation a user belongs to. Clients send
+frames (JSON text, or MessagePack when the `chatbox.msgpack` subprotocol was
+negotiated, see backend.utils.wire):
+
+    {"type": "subscribe", "conversation_id": "...", "since": 41}
+    {"type": "unsubscribe", "conversation_id": "..."}
+    {"type": "send", "conversation_id": "...", "content": "..."}
+    {"type": "read", "conversation_id": "...", "seq": 42}
+    {"type": "typing", "conversation_id": "...", "active": true}
+    {"type": "pong"}
+
+and receive full `message` frames for subscribed conversations plus
+lightweight `inbox` frames (last-message preview) for every other
+conversation they are a member of, so there is no need to poll the inbox.
+`unread` frames carry the user's unread count whenever it changes.
+Subscribers also get coalesced `presence` frames (online and typing members,
+see backend.conversation.presence).
+
+Every message carries its per-conversation `seq`. Passing the last seen
+`since` when (re)subscribing replays only the missed messages in a `sync`
+frame; clients should drop any frame whose seq they have already seen.
+"""
+import asyncio
+import json
+from typing import FrozenSet, Union
+from backend.connection import Connection, manager
+from backend.conversation.chat import chat_service
+from backend.conversation.presence import presence
+from backend.conversation.receipts import read_receipts
+from backend.utils.wire import Frame, WireError, decode_binary
+
+PREVIEW_LENGTH = 100
+SYNC_LIMIT = 500
+
+
+def message_payload(message) -> dict:
+    """Serialize a stored message for socket frames"""
+    return {
+        "id": message.id,
+        "conversation_id": message.conversationId,
+        "seq": message.seq,
+        "sender_id": message.senderId,
+        "content": message.content,
+        "created_at": message.createdAt.isoformat(),
+    }
+
+
+def message_frame(message) -> Frame:
+    """Envelope for a single new message"""
+    return Frame({
+        "type": "message",
+        "conversation_id": message.conversationId,
+        "message": message_payload(message),
+    })
+
+
+async def send_sync(connection: Connection, conversation_id: str, since_seq: int):
+    """
+    Replay messages the client missed after `since_seq`
+
+    At most SYNC_LIMIT messages are sent; `has_more` tells the client to
+    page the rest through the REST `since=` endpoint.
+    """
+    messages = await chat_service.get_messages_since(conversation_id, since_seq, SYNC_LIMIT + 1)
+    has_more = len(messages) > SYNC_LIMIT
+    messages = messages[:SYNC_LIMIT]
+    await manager.send([connection], Frame({
+        "type": "sync",
+        "conversation_id": conversation_id,
+        "messages": [message_payload(message) for message in messages],
+        "last_seq": messages[-1].seq if messages else since_seq,
+        "has_more": has_more,
+    }))
+
+
+async def publish_message(message, member_ids: FrozenSet[int]):
+    """
+    Push a new message to every socket that should see it
+
+    Subscribers of the conversation get the full message, and so do
+    per-conversation sockets, whichever endpoint the message was sent
+    through; the sender's per-conversation sockets are skipped, since those
+    clients show their own messages as they send them. Every other
+    multiplexed socket of a member gets an inbox update instead.
+    """
+    conversation_id = message.conversationId
+
+    subscribers = [
+        connection
+        for connection in manager.active_connections.get(conversation_id, ())
+        if connection.multiplexed or connection.user_id != message.senderId
+    ]
+    inbox_targets = [
+        connection
+        for user_id in member_ids
+        for connection in manager.user_connections.get(user_id, ())
+        if connection.multiplexed and conversation_id not in connection.conversations
+    ]
+
+    inbox_frame = Frame({
+        "type": "inbox",
+        "conversation_id": conversation_id,
+        "last_message": {
+            "id": message.id,
+            "seq": message.seq,
+            "sender_id": message.senderId,
+            "preview": message.content[:PREVIEW_LENGTH],
+            "created_at": message.createdAt.isoformat(),
+        },
+    })
+
+    await asyncio.gather(
+        manager.send(subscribers, message_frame(message)),
+        manager.send(inbox_targets, inbox_frame),
+    )
+
+
+async def _send_error(connection: Connection, detail: str):
+    await manager.send([connection], Frame({"type": "error", "detail": detail}))
+
+
+async def handle_frame(connection: Connection, data: Union[str, bytes]):
+    """
+    Handle one frame received on a multiplexed socket
+
+    Args:
+        connection: The sender's connection record
+        data: Raw text frame, or binary frame on MessagePack sockets
+    """
+    try:
+        frame = decode_binary(data) if isinstance(data, bytes) else json.loads(data)
+    except (ValueError, WireError):
+        await _send_error(connection, "Malformed frame")
+        return
+    if not isinstance(frame, dict):
+        await _send_error(connection, "Frames must be objects")
+        return
+
+    frame_type = frame.get("type")
+    if frame_type == "pong":
+        return
+
+    conversation_id = frame.get("conversation_id")
+    if not isinstance(conversation_id, str):
+        await _send_error(connection, "conversation_id is required")
+        return
+
+    if frame_type == "unsubscribe":
+        manager.unsubscribe(connection, conversation_id)
+        return
+
+    if frame_type not in ("subscribe", "send", "read", "typing"):
+        await _send_error(connection, f"Unknown frame type: {frame_type}")
+        return
+
+    if not await chat_service.is_member(conversation_id, connection.user_id):
+        await _send_error(connection, "Not authorized for this conversation")
+        return
+
+    if frame_type == "subscribe":
+        # Subscribe before replaying so nothing published in between is lost
+        manager.subscribe(connection, conversation_id)
+        await manager.send([connection], Frame({"type": "subscribed", "conversation_id": conversation_id}))
+        since = frame.get("since")
+        if isinstance(since, int) and since >= 0:
+            await send_sync(connection, conversation_id, since)
+        await presence.watch(connection, conversation_id)
+    elif frame_type == "typing":
+        # Coalesced: subscribers hear about it at most once per PRESENCE_INTERVAL
+        presence.typing(connection.user_id, conversation_id, frame.get("active", True) is not False)
+    elif frame_type == "read":
+        seq = frame.get("seq")
+        if not isinstance(seq, int) or seq < 0:
+            await _send_error(connection, "seq is required")
+            return
+        count = await read_receipts.mark_read(connection.user_id, conversation_id, seq)
+        # Keep the user's other devices in sync
+        await manager.send_to_user(
+            connection.user_id,
+            Frame({"type": "unread", "conversation_id": conversation_id, "count": count})
+        )
+    else:
+        content = frame.get("content")
+        if not isinstance(content, str) or not content:
+            await _send_error(connection, "content is required")
+            return
+        # Delivery (including the echo back to this socket) happens via publish_message
+        await chat_service.add_message(conversation_id, connection.user_id, content)
+
+
+chat_service.add_listener(publish_message)
@@ -0,0 +1,224 @@
+"""
+Read receipts and unread counters
+
+Each user has a read pointer (the last seq they have read) per conversation.
+Unread counts are `lastSeq - lastReadSeq`, computed from counters kept in
+memory instead of COUNT(*) scans. Marking messages read happens constantly,
+so pointer updates are coalesced in memory (only the highest seq per user
+and conversation survives) and flushed to the ReadState table in batches.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+import alog
+from backend.config.settings import settings
+from backend.connection import manager
+from backend.conversation.chat import chat_service
+from backend.conversation.versions import version_stamps
+from backend.storage import storage
+from backend.utils.wire import Frame
+
+MAX_CACHED_USERS = 50_000
+MAX_CACHED_CONVERSATIONS = 50_000
+
+
+class ReadReceipts:
+    """Coalescing read-pointer store with maintained unread counters"""
+
+    def __init__(self):
+        # user_id -> {conversation_id: last read seq}
+        self._pointers: "OrderedDict[int, Dict[str, int]]" = OrderedDict()
+        # conversation_id -> last allocated seq
+        self._last_seq: "OrderedDict[str, int]" = OrderedDict()
+        # (user_id, conversation_id) -> seq waiting to be written
+        self._pending: Dict[Tuple[int, str], int] = {}
+        self.flush_interval = settings.read_receipt_flush_interval
+        self.flush_batch = settings.read_receipt_flush_batch
+        self._flush_requested = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def mark_read(self, user_id: int, conversation_id: str, seq: int) -> int:
+        """
+        Move a user's read pointer forward (never backwards)
+
+        Args:
+            user_id: Reader
+            conversation_id: Conversation being read
+            seq: Highest sequence number the user has seen
+
+        Returns:
+            int: The user's unread count for the conversation afterwards
+        """
+        last_seq = await self.get_last_seq(conversation_id)
+        pointers = await self._load_pointers(user_id)
+        seq = min(seq, last_seq)
+
+        if seq > pointers.get(conversation_id, 0):
+            pointers[conversation_id] = seq
+            self._pending[(user_id, conversation_id)] = seq
+            # Unread counts are part of the inbox listing
+            version_stamps.bump_inboxes((user_id,))
+            self._ensure_flush_task()
+            if len(self._pending) >= self.flush_batch:
+                self._flush_requested.set()
+
+        return max(0, last_seq - pointers.get(conversation_id, 0))
+
+    async def unread_count(self, user_id: int, conversation_id: str) -> int:
+        last_seq = await self.get_last_seq(conversation_id)
+        pointers = await self._load_pointers(user_id)
+        return max(0, last_seq - pointers.get(conversation_id, 0))
+
+    async def unread_counts(self, user_id: int, conversations: Iterable) -> Dict[str, int]:
+        """
+        Unread counts for a user's inbox
+
+        Args:
+            user_id: Inbox owner
+            conversations: Conversation records (with lastSeq) from list_conversations
+
+        Returns:
+            Dict[str, int]: conversation_id -> unread count
+        """
+        pointers = await self._load_pointers(user_id)
+        counts = {}
+        for conversation in conversations:
+            last_seq = self._note_last_seq(conversation.id, conversation.lastSeq)
+            counts[conversation.id] = max(0, last_seq - pointers.get(conversation.id, 0))
+        return counts
+
+    async def unread_counts_for(self, pairs: Iterable[Tuple[int, str]], conversations: Iterable) -> Dict[Tuple[int, str], int]:
+        """
+        Unread counts for many users at once, e.g. the recipients of a digest batch
+
+        Pointers of users not in the cache are read with one query, limited to
+        the conversations asked about (and not cached, being partial).
+
+        Args:
+            pairs: (user_id, conversation_id) to count
+            conversations: Conversation records (with lastSeq) covering every pair
+
+        Returns:
+            Dict[Tuple[int, str], int]: (user_id, conversation_id) -> unread count
+        """
+        pairs = list(pairs)
+        last_seqs = {
+            conversation.id: self._note_last_seq(conversation.id, conversation.lastSeq) for conversation in conversations
+        }
+        uncached = list({user_id for user_id, _ in pairs if user_id not in self._pointers})
+        stored = await storage.read_pointers_for(uncached, list(last_seqs)) if uncached else {}
+        counts = {}
+        for user_id, conversation_id in pairs:
+            pointers = self._pointers.get(user_id)
+            if pointers is not None:
+                read = pointers.get(conversation_id, 0)
+            else:
+                # Unflushed updates are newer than what the database returned
+                read = max(stored.get((user_id, conversation_id), 0), self._pending.get((user_id, conversation_id), 0))
+            counts[user_id, conversation_id] = max(0, last_seqs.get(conversation_id, 0) - read)
+        return counts
+
+    async def get_last_seq(self, conversation_id: str) -> int:
+        last_seq = self._last_seq.get(conversation_id)
+        if last_seq is None:
+            last_seq = await chat_service.get_last_seq(conversation_id)
+        return self._note_last_seq(conversation_id, last_seq)
+
+    async def message_stored(self, message, member_ids: FrozenSet[int]):
+        """
+        Inline message listener: bump the conversation counter and mark the
+        sender as having read their own message, before the write returns
+        """
+        self._note_last_seq(message.conversationId, message.seq)
+        await self.mark_read(message.senderId, message.conversationId, message.seq)
+
+    async def publish(self, message, member_ids: FrozenSet[int]):
+        """Message listener: push new unread counts to every member who is online, all at once"""
+        await asyncio.gather(*(
+            self._push_unread(user_id, message.conversationId)
+            for user_id in member_ids
+            if user_id != message.senderId and manager.is_online(user_id)
+        ))
+
+    async def flush(self):
+        """Write every pending read pointer in one transaction"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [(user_id, conversation_id, seq) for (user_id, conversation_id), seq in pending.items()]
+
+        try:
+            await storage.save_read_pointers(rows)
+            alog.debug(f"Flushed {len(rows)} read receipts")
+        except Exception as e:
+            alog.error(f"Failed to flush {len(rows)} read receipts: {e}")
+            # Put them back unless a newer pointer arrived meanwhile
+            for key, seq in pending.items():
+                if seq > self._pending.get(key, 0):
+                    self._pending[key] = seq
+
+    async def stop(self):
+        """Stop the flush task and write anything still pending. Call during shutdown."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def _note_last_seq(self, conversation_id: str, seq: int) -> int:
+        seq = max(seq, self._last_seq.get(conversation_id, 0))
+        self._last_seq[conversation_id] = seq
+        self._last_seq.move_to_end(conversation_id)
+        if len(self._last_seq) > MAX_CACHED_CONVERSATIONS:
+            self._last_seq.popitem(last=False)
+        return seq
+
+    async def _push_unread(self, user_id: int, conversation_id: str):
+        count = await self.unread_count(user_id, conversation_id)
+        await manager.send(
+            [c for c in manager.user_connections.get(user_id, ()) if c.multiplexed],
+            Frame({"type": "unread", "conversation_id": conversation_id, "count": count})
+        )
+
+    async def _load_pointers(self, user_id: int) -> Dict[str, int]:
+        pointers = self._pointers.get(user_id)
+        if pointers is not None:
+            self._pointers.move_to_end(user_id)
+            return pointers
+
+        stored = await storage.read_pointers(user_id)
+
+        # Another coroutine may have loaded the same user while we awaited
+        pointers = self._pointers.get(user_id)
+        if pointers is None:
+            pointers = stored
+            # Unflushed updates are newer than what the database returned
+            for (pending_user, conversation_id), seq in self._pending.items():
+                if pending_user == user_id and seq > pointers.get(conversation_id, 0):
+                    pointers[conversation_id] = seq
+            self._pointers[user_id] = pointers
+            if len(self._pointers) > MAX_CACHED_USERS:
+                self._pointers.popitem(last=False)
+        return pointers
+
+    def _ensure_flush_task(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run_flusher())
+
+    async def _run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+
+# Global read receipts instance
+read_receipts = ReadReceipts()
+chat_service.add_listener(read_receipts.message_stored, inline=True)
+chat_service.add_listener(read_receipts.publish)
@@ -0,0 +1,174 @@
+"""
+Copy messages between storage layouts
+
+Moves message rows from the main database (0 partitions) or an existing
+partition layout into a new one, e.g. when enabling partitioning or changing
+the partition count:
+
+    python -m backend.conversation.reshard --to 8             # main database -> 8 partitions
+    python -m backend.conversation.reshard --from 8 --to 16   # 8 -> 16 partitions
+    python -m backend.conversation.reshard --from 16 --to 0   # back into the main database
+
+Rows are copied in keyset-paginated batches with INSERT OR IGNORE, so an
+interrupted run can simply be started again. Sequence counters are carried
+over. The source is left untouched; stop the application (or at least
+message writes) before copying, then set MESSAGE_PARTITIONS to the new count
+and restart. Once the counts printed at the end match, the old files can be
+removed.
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from backend.config.settings import settings
+from backend.conversation.partitions import (
+    MESSAGE_COLUMNS,
+    database_path,
+    open_partition,
+    partition_index,
+    partition_path,
+)
+
+Row = Tuple
+
+
+def to_millis(value) -> int:
+    """Normalize a stored DateTime (epoch milliseconds or ISO-8601 text) to epoch milliseconds"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def open_main_database() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(database_path(settings.database_url)), isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def open_layout(count: int, directory: Path) -> List[sqlite3.Connection]:
+    if count == 0:
+        return [open_main_database()]
+    return [open_partition(partition_path(directory, index, count)) for index in range(count)]
+
+
+def read_rows(conn: sqlite3.Connection, batch_size: int) -> Iterator[List[Row]]:
+    """Every message row in (conversationId, seq) order, in batches"""
+    last = ("", 0)
+    while True:
+        rows = conn.execute(
+            f'SELECT {MESSAGE_COLUMNS} FROM "Message" '
+            'WHERE ("conversationId", "seq") > (?, ?) ORDER BY "conversationId", "seq" LIMIT ?',
+            (*last, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        yield [(*row[:5], to_millis(row[5]), to_millis(row[6])) for row in rows]
+        last = (rows[-1][3], rows[-1][4])
+
+
+def read_sequences(conn: sqlite3.Connection, is_main: bool) -> Dict[str, int]:
+    if is_main:
+        return dict(conn.execute('SELECT "id", "lastSeq" FROM "Conversation" WHERE "lastSeq" > 0'))
+    return dict(conn.execute('SELECT "conversationId", "lastSeq" FROM "Sequence"'))
+
+
+def write_rows(conn: sqlite3.Connection, rows: List[Row]):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            f'INSERT OR IGNORE INTO "Message" ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def write_sequences(conn: sqlite3.Connection, sequences: List[Tuple[str, int]], is_main: bool):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if is_main:
+            conn.executemany(
+                'UPDATE "Conversation" SET "lastSeq" = max("lastSeq", ?) WHERE "id" = ?',
+                [(seq, conversation_id) for conversation_id, seq in sequences]
+            )
+        else:
+            conn.executemany(
+                'INSERT INTO "Sequence" ("conversationId", "lastSeq") VALUES (?, ?) '
+                'ON CONFLICT ("conversationId") DO UPDATE SET "lastSeq" = max("lastSeq", excluded."lastSeq")',
+                sequences
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def count_rows(connections: List[sqlite3.Connection]) -> int:
+    return sum(conn.execute('SELECT count(*) FROM "Message"').fetchone()[0] for conn in connections)
+
+
+def reshard(source_count: int, target_count: int, source_dir: Path, target_dir: Path, batch_size: int):
+    if source_count == target_count and source_dir == target_dir:
+        raise SystemExit("Source and target layouts are the same")
+
+    sources = open_layout(source_count, source_dir)
+    targets = open_layout(target_count, target_dir)
+
+    def target_for(conversation_id: str) -> int:
+        return partition_index(conversation_id, target_count) if target_count else 0
+
+    copied = 0
+    started = time.monotonic()
+    sequences: Dict[str, int] = {}
+    for source in sources:
+        for conversation_id, seq in read_sequences(source, source_count == 0).items():
+            sequences[conversation_id] = max(seq, sequences.get(conversation_id, 0))
+
+        for rows in read_rows(source, batch_size):
+            by_target: Dict[int, List[Row]] = {}
+            for row in rows:
+                by_target.setdefault(target_for(row[3]), []).append(row)
+                sequences[row[3]] = max(row[4], sequences.get(row[3], 0))
+            for index, target_rows in by_target.items():
+                write_rows(targets[index], target_rows)
+            copied += len(rows)
+            rate = copied / max(time.monotonic() - started, 1e-9)
+            print(f"\rcopied {copied} messages ({rate:,.0f}/s)", end="", flush=True)
+    print()
+
+    by_target: Dict[int, List[Tuple[str, int]]] = {}
+    for conversation_id, seq in sequences.items():
+        by_target.setdefault(target_for(conversation_id), []).append((conversation_id, seq))
+    for index, target_sequences in by_target.items():
+        write_sequences(targets[index], target_sequences, target_count == 0)
+
+    source_total, target_total = count_rows(sources), count_rows(targets)
+    print(f"source: {source_total} messages, target: {target_total} messages, {len(sequences)} conversations")
+    for conn in sources + targets:
+        conn.close()
+    if target_total < source_total:
+        raise SystemExit("Target has fewer messages than the source; re-run to resume")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--from", dest="source", type=int, default=settings.message_partitions,
+                        help="current partition count, 0 for the main database (default: MESSAGE_PARTITIONS)")
+    parser.add_argument("--to", dest="target", type=int, required=True,
+                        help="new partition count, 0 for the main database")
+    parser.add_argument("--source-dir", type=Path, default=Path(settings.message_partition_dir))
+    parser.add_argument("--target-dir", type=Path, default=Path(settings.message_partition_dir))
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    reshard(args.source, args.target, args.source_dir, args.target_dir, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Message retention
+
+Messages older than RETENTION_DAYS are deleted by a background job every
+RETENTION_INTERVAL seconds; a conversation's `retentionDays` overrides the
+global setting (0 keeps its history forever). Deletes cover hot rows, the
+message partitions, the cold-storage archive and attachments uploaded
+before the cutoff.
+
+Nothing is deleted in one big statement: each conversation is purged oldest
+first in transactions of at most PURGE_BATCH rows, shrinking the batch while
+a delete takes longer than PURGE_SLICE_MS and sleeping PURGE_PAUSE seconds in
+between, so chat writes keep getting the database lock. Freed pages are then
+handed back to the filesystem a few at a time with `PRAGMA incremental_vacuum`
+instead of a blocking VACUUM. That needs auto_vacuum=INCREMENTAL, which new
+partition files get automatically; convert existing databases once, with the
+server stopped:
+
+    python -m backend.conversation.retention enable-incremental-vacuum
+
+To run a purge by hand:
+
+    python -m backend.conversation.retention purge
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+import alog
+from backend.config.settings import settings
+from backend.conversation.attachments import attachment_store
+from backend.conversation.chat import chat_service
+from backend.conversation.versions import version_stamps
+
+MIN_PURGE_BATCH = 50
+PROGRESS_INTERVAL = 10
+
+
+class RetentionPurger:
+    """Periodic, time-sliced deletion of expired messages"""
+
+    def __init__(self):
+        self.days = settings.retention_days
+        self.interval = settings.retention_interval
+        self.max_batch = settings.purge_batch
+        self.slice = settings.purge_slice_ms / 1000
+        self.pause = settings.purge_pause
+        self.vacuum_pages = settings.vacuum_pages
+        self.batch_size = self.max_batch
+        # Progress of the running (or last) purge
+        self.deleted = 0
+        self.deleted_attachments = 0
+        self.reclaimed_pages = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._reported_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def rate(self) -> float:
+        """Rows deleted per second by the running (or last) purge"""
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.deleted / elapsed if elapsed > 0 else 0.0
+
+    def start(self):
+        """Start the periodic job. Call during startup."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic job. Call during shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def purge(self) -> int:
+        """
+        Delete every message past its conversation's retention period, then reclaim space
+
+        Returns:
+            int: Number of messages deleted
+        """
+        self.deleted, self.deleted_attachments, self.reclaimed_pages = 0, 0, 0
+        self.started_at, self.finished_at = time.monotonic(), None
+        self._reported_at = self.started_at
+        now = datetime.now(timezone.utc)
+
+        overrides = await chat_service.get_retention_overrides()
+        for conversation_id, days in overrides.items():
+            if days > 0:
+                cutoff = now - timedelta(days=days)
+                seq = await chat_service.newest_seq_before(conversation_id, cutoff)
+                await self._purge_through(conversation_id, seq)
+                self.deleted_attachments += await attachment_store.purge_older_than(cutoff, conversation_id)
+
+        if self.days > 0:
+            cutoff = now - timedelta(days=self.days)
+            while True:
+                old = await chat_service.get_messages_older_than(cutoff, self.max_batch, overrides)
+                if not old:
+                    break
+                through: Dict[str, int] = {}
+                for message in old:
+                    through[message.conversationId] = max(message.seq, through.get(message.conversationId, 0))
+                removed = 0
+                for conversation_id, seq in through.items():
+                    removed += await self._purge_through(conversation_id, seq)
+                if removed == 0:
+                    break
+
+            # History that only exists in cold storage
+            for conversation_id in await chat_service.archived_conversation_ids():
+                if conversation_id not in overrides:
+                    seq = await chat_service.archived_newest_seq_before(conversation_id, cutoff)
+                    await self._purge_through(conversation_id, seq)
+
+            self.deleted_attachments += await attachment_store.purge_older_than(cutoff, exclude=list(overrides))
+
+        await self._reclaim()
+        self.finished_at = time.monotonic()
+        return self.deleted
+
+    async def _purge_through(self, conversation_id: str, seq: int) -> int:
+        """Delete a conversation's messages up to `seq`, one short transaction at a time"""
+        if seq <= 0:
+            return 0
+        removed = await chat_service.purge_archived(conversation_id, seq)
+        self._progress(removed)
+        while True:
+            started = time.monotonic()
+            deleted = await chat_service.purge_messages(conversation_id, seq, self.batch_size)
+            self._adapt(time.monotonic() - started)
+            removed += deleted
+            self._progress(deleted)
+            if deleted == 0:
+                break
+            # Let queued chat writes take the lock before the next batch
+            await asyncio.sleep(self.pause)
+
+        if removed:
+            version_stamps.bump_conversation(conversation_id)
+            version_stamps.bump_inboxes(await chat_service.get_member_ids(conversation_id))
+        return removed
+
+    def _adapt(self, elapsed: float):
+        """Halve the batch while deletes overrun the time slice, grow it back while they are quick"""
+        if elapsed > self.slice:
+            self.batch_size = max(MIN_PURGE_BATCH, self.batch_size // 2)
+        elif elapsed < self.slice / 4:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+
+    def _progress(self, deleted: int):
+        self.deleted += deleted
+        now = time.monotonic()
+        if now - self._reported_at >= PROGRESS_INTERVAL:
+            self._reported_at = now
+            alog.info(f"Retention purge: {self.deleted} messages deleted ({self.rate:,.0f} rows/s, batch {self.batch_size})")
+
+    async def _reclaim(self):
+        while True:
+            freed = await chat_service.reclaim_space(self.vacuum_pages)
+            if not freed:
+                break
+            self.reclaimed_pages += freed
+            await asyncio.sleep(self.pause)
+
+    async def _run(self):
+        while True:
+            try:
+                deleted = await self.purge()
+                if deleted or self.deleted_attachments or self.reclaimed_pages:
+                    alog.info(
+                        f"Retention purge deleted {deleted} messages ({self.rate:,.0f} rows/s) "
+                        f"and {self.deleted_attachments} attachments, and reclaimed {self.reclaimed_pages} pages"
+                    )
+            except Exception as e:
+                alog.error(f"Retention purge failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Global purger instance
+retention_purger = RetentionPurger()
+
+
+def enable_incremental_vacuum():
+    """Switch the main database and the partition files to auto_vacuum=INCREMENTAL (rewrites them)"""
+    from backend.conversation.partitions import database_path
+
+    paths = [database_path(settings.database_url)]
+    partition_dir = Path(settings.message_partition_dir)
+    if partition_dir.is_dir():
+        paths += sorted(partition_dir.glob("messages-*-of-*.db"))
+    for path in paths:
+        conn = sqlite3.connect(str(path), isolation_level=None)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                print(f"{path}: already incremental")
+                continue
+            before = path.stat().st_size
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            print(f"{path}: {before / 1e6:,.1f} MB -> {path.stat().st_size / 1e6:,.1f} MB")
+        finally:
+            conn.close()
+
+
+async def _purge():
+    from backend.utils.database import disconnect_database, get_database
+
+    await get_database()
+    try:
+        deleted = await retention_purger.purge()
+        print(f"Deleted {deleted:,} messages ({retention_purger.rate:,.0f} rows/s) "
+              f"and {retention_purger.deleted_attachments:,} attachments, reclaimed {retention_purger.reclaimed_pages:,} pages")
+    finally:
+        await chat_service.stop()
+        await disconnect_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("purge", help="delete expired messages now")
+    commands.add_parser("enable-incremental-vacuum", help="convert the databases (server stopped)")
+    args = parser.parse_args()
+    if args.command == "purge":
+        asyncio.run(_purge())
+    else:
+        enable_incremental_vacuum()
+
+
+if __name__ == "__main__":
+    main()
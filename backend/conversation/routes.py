@@ -1,10 +1,74 @@
-from fastapi import APIRouter, Depends, HTTPException
-from backend.conversation.chat import ChatService
+import asyncio
+import json
+import math
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from backend.config.settings import settings
+from backend.connection import manager
+from backend.conversation.attachments import (
+    INLINE_TYPES,
+    Upload,
+    UploadCorrupt,
+    UploadNotFound,
+    UploadOffsetMismatch,
+    UploadTooLarge,
+    attachment_payload,
+    attachment_store,
+)
+from backend.conversation.chat import chat_service
+from backend.conversation.idempotency import IdempotencyConflict, idempotency_store
+from backend.conversation.presence import presence
+from backend.conversation.receipts import read_receipts
+from backend.conversation.transfer import export_conversation
+from backend.conversation.serializers import (
+    RawJSONResponse, encode_conversation, encode_conversations, encode_history, encode_inbox, encode_sent
+)
+from backend.conversation.versions import etag_matches, version_stamps
+from backend.conversation.waiters import message_waiters
 from backend.auth.dependencies import get_current_user
 from backend.schemas.auth import UserResponse  # assuming this is your user schema
+from backend.schemas.messages import (
+    MAX_BATCH_CONVERSATIONS,
+    AttachmentResponse,
+    AttachmentUploadRequest,
+    BatchSendRequest,
+    ConversationResponse,
+    HistoryMessageResponse,
+    InboxConversationResponse,
+    SentMessageResponse,
+    UploadStatusResponse,
+)
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
-chat_service = ChatService()
+
+SSE_KEEPALIVE_SECONDS = 15
+# Clients may keep a copy but must revalidate it with If-None-Match every time
+CACHE_CONTROL = "private, no-cache"
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def json_response(body: bytes, etag: str) -> RawJSONResponse:
+    return RawJSONResponse(body, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def kept_days(days: Optional[int]) -> float:
+    """Days a retention override keeps messages for, infinite when they are kept forever"""
+    if days is None:
+        days = settings.retention_days
+    return math.inf if days == 0 else days
+
+
+def upload_status(upload: Upload) -> dict:
+    return {
+        "upload_id": upload.id,
+        "offset": upload.offset,
+        "size": upload.size,
+        "chunk_size": attachment_store.chunk_size,
+    }
 
 # ✅ Create a new conversation (current user + list of users)
 @router.post("/conversations")
@@ -13,44 +77,337 @@ async def create_conversation(
     current_user: UserResponse = Depends(get_current_user)
 ):
     all_users = set(user_ids + [current_user.id])
-    return await chat_service.create_conversation(list(all_users))
+    conversation = await chat_service.create_conversation(list(all_users))
+    version_stamps.bump_inboxes(all_users)
+    return conversation
+
+# ✅ Get several conversations in one request
+@router.get("/conversations/batch", response_model=List[ConversationResponse])
+async def get_conversations(
+    ids: List[str] = Query(..., description="Conversation IDs; repeat the parameter for each"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    conversation_ids = list(dict.fromkeys(ids))
+    if len(conversation_ids) > MAX_BATCH_CONVERSATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_CONVERSATIONS} conversations per request")
+    allowed = await asyncio.gather(*(chat_service.is_member(cid, current_user.id) for cid in conversation_ids))
+    if not all(allowed):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
 
-# ✅ Get single conversation
-@router.get("/conversations/{conversation_id}")
+    conversations = await chat_service.get_conversations(conversation_ids)
+    if not all(conversations):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    return RawJSONResponse(encode_conversations(conversations))
+
+# ✅ Get single conversation (304 when unchanged since the client's ETag)
+@router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: str,
+    if_none_match: Optional[str] = Header(None),
     current_user: UserResponse = Depends(get_current_user)
 ):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    etag = version_stamps.conversation_etag(conversation_id, current_user.id)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
     conversation = await chat_service.get_conversation(conversation_id)
-    if not conversation or current_user.id not in [user.id for user in conversation.users]:
+    if not conversation:
         raise HTTPException(status_code=403, detail="Not authorized for this conversation")
-    return conversation
+    return json_response(encode_conversation(conversation), etag)
+
+# ✅ List all conversations of the current user, with unread counts
+@router.get("/conversations", response_model=List[InboxConversationResponse])
+async def list_conversations(
+    if_none_match: Optional[str] = Header(None),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    etag = version_stamps.inbox_etag(current_user.id)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
 
-# ✅ List all conversations of the current user
-@router.get("/conversations")
-async def list_conversations(current_user: UserResponse = Depends(get_current_user)):
-    return await chat_service.list_conversations(current_user.id)
+    conversations = await chat_service.list_conversations(current_user.id)
+    unread = await read_receipts.unread_counts(current_user.id, conversations)
+    return json_response(encode_inbox(conversations, unread), etag)
+
+# ✅ Export a conversation as NDJSON, streamed with constant memory
+@router.get("/conversations/{conversation_id}/export")
+async def export_conversation_ndjson(
+    conversation_id: str,
+    since: int = Query(0, ge=0, description="Only export messages with a greater sequence number"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    return StreamingResponse(
+        export_conversation(conversation_id, since),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{conversation_id}.ndjson"'}
+    )
+
+# ✅ Override how long a conversation's messages are kept
+@router.put("/conversations/{conversation_id}/retention")
+async def set_retention(
+    conversation_id: str,
+    days: Optional[int] = Query(None, ge=0, description="Days to keep messages; 0 keeps them forever, omit for the server default"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    # Purges delete everyone's history, so members may only keep messages longer
+    if current_user.email.lower() not in settings.admin_emails:
+        conversation = await chat_service.get_conversation_info(conversation_id)
+        if kept_days(days) < kept_days(conversation.retentionDays):
+            raise HTTPException(status_code=403, detail="Only administrators can shorten retention")
+    await chat_service.set_retention(conversation_id, days)
+    return {"conversation_id": conversation_id, "retention_days": days}
+
+# ✅ Mark a conversation read up to a sequence number
+@router.post("/conversations/{conversation_id}/read")
+async def mark_read(
+    conversation_id: str,
+    seq: int = Query(..., ge=0, description="Highest sequence number the user has read"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    count = await read_receipts.mark_read(current_user.id, conversation_id, seq)
+    return {"conversation_id": conversation_id, "unread_count": count}
+
+# ✅ Who is online and typing in a conversation (sockets get this as `presence` frames)
+@router.get("/conversations/{conversation_id}/presence")
+async def get_presence(
+    conversation_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    online, typing = presence.state(conversation_id, await chat_service.get_member_ids(conversation_id))
+    return {"conversation_id": conversation_id, "online": online, "typing": typing}
 
-# ✅ Send a message
+# ✅ Send a message (retries carrying the same Idempotency-Key are not stored twice)
 @router.post("/messages/")
 async def send_message(
     conversation_id: str,
     content: str,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    return await chat_service.add_message(
-        conversation_id=conversation_id,
-        sender_id=current_user.id,
-        content=content
-    )
+    if idempotency_key is None:
+        return await chat_service.add_message(
+            conversation_id=conversation_id,
+            sender_id=current_user.id,
+            content=content
+        )
+
+    async def execute(indexes: List[int]):
+        return [await chat_service.add_message(
+            conversation_id=conversation_id,
+            sender_id=current_user.id,
+            content=content
+        )]
+
+    try:
+        [(message, replayed)] = await idempotency_store.run(
+            current_user.id, [(idempotency_key, (conversation_id, content))], execute
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return message
 
-# ✅ Get messages in a conversation
-@router.get("/messages/{conversation_id}")
+# ✅ Send many messages, across conversations, in one transaction
+@router.post("/messages/batch", response_model=List[SentMessageResponse])
+async def send_messages(
+    batch: BatchSendRequest,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    messages = batch.messages
+    conversation_ids = {message.conversation_id for message in messages}
+    allowed = await asyncio.gather(*(chat_service.is_member(cid, current_user.id) for cid in conversation_ids))
+    if not all(allowed):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+
+    async def execute(indexes: List[int]):
+        return await chat_service.add_messages(
+            current_user.id,
+            [(messages[index].conversation_id, messages[index].content) for index in indexes]
+        )
+
+    try:
+        results = await idempotency_store.run(
+            current_user.id,
+            [(message.idempotency_key, (message.conversation_id, message.content)) for message in messages],
+            execute
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return RawJSONResponse(encode_sent(results, [message.idempotency_key for message in messages]))
+
+# ✅ Get messages in a conversation (only those after `since` when resuming)
+@router.get("/messages/{conversation_id}", response_model=List[HistoryMessageResponse])
 async def get_messages(
     conversation_id: str,
+    since: int = Query(0, ge=0, description="Return only messages with a greater sequence number"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    if_none_match: Optional[str] = Header(None),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    conversation = await chat_service.get_conversation(conversation_id)
-    if not conversation or current_user.id not in [user.id for user in conversation.users]:
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    etag = version_stamps.conversation_etag(conversation_id, current_user.id, f"{since}-{limit or 0}")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    messages = await chat_service.get_messages_since(conversation_id, since, limit)
+    return json_response(encode_history(messages, current_user.id), etag)
+
+# ✅ Long-poll for new messages after the client's cursor
+@router.get("/messages/{conversation_id}/poll")
+async def poll_messages(
+    conversation_id: str,
+    since: int = Query(0, ge=0, description="Last sequence number the client has seen"),
+    timeout: float = Query(25, gt=0, le=60, description="Seconds to wait for a new message"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    # Draining for a restart: don't park new waiters; the client polls again after reconnecting
+    if manager.draining:
+        return {"messages": [], "last_seq": since}
+    messages = await message_waiters.wait_for_messages(conversation_id, since, timeout)
+    return {
+        "messages": messages,
+        "last_seq": messages[-1]["seq"] if messages else since
+    }
+
+# ✅ Stream new messages as Server-Sent Events (resumes from Last-Event-ID)
+@router.get("/messages/{conversation_id}/stream")
+async def stream_messages(
+    conversation_id: str,
+    request: Request,
+    since: int = Query(0, ge=0, description="Last sequence number the client has seen"),
+    last_event_id: Optional[str] = Header(None),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized for this conversation")
-    return await chat_service.get_messages(conversation_id, current_user.id)
+    if last_event_id and last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+
+    async def events():
+        cursor = since
+        while not manager.draining and not await request.is_disconnected():
+            messages = await message_waiters.wait_for_messages(conversation_id, cursor, SSE_KEEPALIVE_SECONDS)
+            if not messages:
+                yield ": keepalive\n\n"
+                continue
+            for message in messages:
+                yield f"id: {message['seq']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+            cursor = messages[-1]["seq"]
+        if manager.draining:
+            # End the stream; EventSource reconnects after `retry` ms, resuming from the last id
+            yield f"retry: {manager.reconnect_hint()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ✅ Start a chunked, resumable attachment upload
+@router.post("/conversations/{conversation_id}/attachments", response_model=UploadStatusResponse, status_code=201)
+async def create_upload(
+    conversation_id: str,
+    request: AttachmentUploadRequest,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    if not await chat_service.is_member(conversation_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized for this conversation")
+    try:
+        upload = await attachment_store.create_upload(
+            conversation_id, current_user.id, request.filename, request.content_type, request.size, request.sha256
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return upload_status(upload)
+
+# ✅ Where an interrupted upload resumes
+@router.get("/attachments/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def get_upload(
+    upload_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    try:
+        upload = await attachment_store.get_upload(upload_id, current_user.id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload_status(upload)
+
+# ✅ Append the next chunk (raw request body, starting at Upload-Offset); 201 with the attachment after the last one
+@router.patch(
+    "/attachments/uploads/{upload_id}",
+    response_model=UploadStatusResponse | AttachmentResponse,
+    responses={201: {"model": AttachmentResponse}}
+)
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., ge=0),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    try:
+        result = await attachment_store.append(upload_id, current_user.id, upload_offset, request.stream())
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadCorrupt as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if isinstance(result, Upload):
+        response.headers["Upload-Offset"] = str(result.offset)
+        return upload_status(result)
+    response.status_code = 201
+    return attachment_payload(result)
+
+# ✅ Abandon an unfinished upload
+@router.delete("/attachments/uploads/{upload_id}", status_code=204)
+async def cancel_upload(
+    upload_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    try:
+        await attachment_store.cancel(upload_id, current_user.id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(status_code=204)
+
+# ✅ Download an attachment (Range requests supported; immutable, so cached by its hash)
+@router.get("/attachments/{attachment_id}")
+async def download_attachment(
+    attachment_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    attachment = await chat_service.get_attachment(attachment_id)
+    if attachment is None or not await chat_service.is_member(attachment.conversationId, current_user.id):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    etag = f'"{attachment.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    # Anything that is not plain media is a download, never rendered by the browser
+    inline = attachment.contentType in INLINE_TYPES
+    return FileResponse(
+        attachment_store.blob_path(attachment.sha256),
+        media_type=attachment.contentType if inline else "application/octet-stream",
+        filename=attachment.filename,
+        content_disposition_type="inline" if inline else "attachment",
+        headers={**headers, "X-Content-Type-Options": "nosniff"},
+    )
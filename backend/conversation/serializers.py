@@ -0,0 +1,158 @@
+"""
+JSON serializers for the chat read endpoints
+
+History and inbox responses are written straight to JSON bytes from the
+Prisma records, bypassing FastAPI's jsonable_encoder and response model
+validation: the records were already validated when the client built them,
+so walking them again through pydantic only costs time. Members are encoded
+once per response and reused for every message they sent.
+
+The output matches the schemas in backend.schemas.messages, which the routes
+still declare as their response models for the OpenAPI docs. The NDJSON
+export lines are read back by backend.conversation.transfer.
+"""
+from json.encoder import encode_basestring
+from typing import Dict, Iterable, List, Optional
+from fastapi.responses import Response
+
+
+class RawJSONResponse(Response):
+    """Response whose body is already encoded JSON"""
+    media_type = "application/json"
+
+
+def _string(value: Optional[str]) -> str:
+    return "null" if value is None else encode_basestring(value)
+
+
+def _user(user, cache: Dict[int, str]) -> str:
+    encoded = cache.get(user.id)
+    if encoded is None:
+        encoded = cache[user.id] = (
+            f'{{"id":{user.id},"email":{_string(user.email)},"name":{_string(user.name)},'
+            f'"created_at":"{user.createdAt.isoformat()}","updated_at":"{user.updatedAt.isoformat()}"}}'
+        )
+    return encoded
+
+
+def _users(users: Iterable, cache: Dict[int, str]) -> str:
+    return "[" + ",".join(_user(user, cache) for user in users) + "]"
+
+
+def encode_history(messages: List, current_user_id: Optional[int]) -> bytes:
+    """
+    Encode a message history page (see HistoryMessageResponse)
+
+    Args:
+        messages: Message records, oldest first
+        current_user_id: Requesting user; their messages are marked "me"
+
+    Returns:
+        bytes: JSON array
+    """
+    parts = []
+    for message in messages:
+        sender = "me" if current_user_id and message.senderId == current_user_id else "they"
+        parts.append(
+            f'{{"id":{encode_basestring(message.id)},"seq":{message.seq},"text":{encode_basestring(message.content)},'
+            f'"sender":"{sender}","created_at":"{message.createdAt.isoformat()}",'
+            f'"updated_at":"{message.updatedAt.isoformat()}"}}'
+        )
+    return ("[" + ",".join(parts) + "]").encode("utf-8")
+
+
+def encode_conversation(conversation) -> bytes:
+    """
+    Encode a conversation with members and messages (see ConversationResponse)
+
+    Args:
+        conversation: Conversation record including users and messages with their sender
+
+    Returns:
+        bytes: JSON object
+    """
+    users: Dict[int, str] = {}
+    members = _users(conversation.users or (), users)
+    messages = ",".join(
+        f'{{"id":{encode_basestring(message.id)},"seq":{message.seq},"content":{encode_basestring(message.content)},'
+        f'"sender_id":{message.senderId},"sender":{_user(message.sender, users)},'
+        f'"created_at":"{message.createdAt.isoformat()}","updated_at":"{message.updatedAt.isoformat()}"}}'
+        for message in conversation.messages or ()
+    )
+    return (
+        f'{{"id":{encode_basestring(conversation.id)},"name":{_string(conversation.name)},"last_seq":{conversation.lastSeq},'
+        f'"users":{members},"messages":[{messages}]}}'
+    ).encode("utf-8")
+
+
+def encode_inbox(conversations: List, unread: Dict[str, int]) -> bytes:
+    """
+    Encode a user's conversation list (see InboxConversationResponse)
+
+    Args:
+        conversations: Conversation records including users and messages
+        unread: conversation_id -> unread count
+
+    Returns:
+        bytes: JSON array
+    """
+    users: Dict[int, str] = {}
+    parts = []
+    for conversation in conversations:
+        messages = ",".join(
+            f'{{"id":{encode_basestring(message.id)},"seq":{message.seq},"content":{encode_basestring(message.content)},'
+            f'"sender_id":{message.senderId},"created_at":"{message.createdAt.isoformat()}",'
+            f'"updated_at":"{message.updatedAt.isoformat()}"}}'
+            for message in conversation.messages or ()
+        )
+        parts.append(
+            f'{{"id":{encode_basestring(conversation.id)},"name":{_string(conversation.name)},"last_seq":{conversation.lastSeq},'
+            f'"users":{_users(conversation.users or (), users)},"messages":[{messages}],'
+            f'"unread_count":{unread.get(conversation.id, 0)}}}'
+        )
+    return ("[" + ",".join(parts) + "]").encode("utf-8")
+
+
+def encode_sent(results: List, keys: List[Optional[str]]) -> bytes:
+    """
+    Encode the outcome of a batch send (see SentMessageResponse)
+
+    Args:
+        results: (message, replayed) per request
+        keys: Idempotency key per request
+
+    Returns:
+        bytes: JSON array
+    """
+    parts = []
+    for (message, replayed), key in zip(results, keys):
+        parts.append(
+            f'{{"id":{encode_basestring(message.id)},"conversation_id":{encode_basestring(message.conversationId)},"seq":{message.seq},'
+            f'"content":{encode_basestring(message.content)},"sender_id":{message.senderId},'
+            f'"created_at":"{message.createdAt.isoformat()}","updated_at":"{message.updatedAt.isoformat()}",'
+            f'"idempotency_key":{_string(key)},"replayed":{"true" if replayed else "false"}}}'
+        )
+    return ("[" + ",".join(parts) + "]").encode("utf-8")
+
+
+def encode_conversations(conversations: List) -> bytes:
+    """Encode several conversations (see ConversationResponse) as a JSON array"""
+    return b"[" + b",".join(encode_conversation(conversation) for conversation in conversations) + b"]"
+
+
+def encode_export_header(conversation, member_ids: Iterable[int]) -> bytes:
+    """NDJSON line describing a conversation, written before its messages"""
+    return (
+        f'{{"type":"conversation","id":{encode_basestring(conversation.id)},"name":{_string(conversation.name)},'
+        f'"user_ids":[{",".join(str(user_id) for user_id in sorted(member_ids))}]}}\n'
+    ).encode("utf-8")
+
+
+def encode_export_messages(messages: Iterable) -> bytes:
+    """NDJSON lines for a batch of messages"""
+    return "".join(
+        f'{{"type":"message","id":{encode_basestring(message.id)},"conversation_id":{encode_basestring(message.conversationId)},'
+        f'"seq":{message.seq},"sender_id":{message.senderId},"content":{encode_basestring(message.content)},'
+        f'"created_at":"{message.createdAt.isoformat()}","updated_at":"{message.updatedAt.isoformat()}"}}\n'
+        for message in messages
+    ).encode("utf-8")
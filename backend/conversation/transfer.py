@@ -0,0 +1,286 @@
+"""
+Streaming NDJSON export and bulk import of conversations
+
+Export format, one JSON object per line:
+
+    {"type": "conversation", "id": "...", "name": null, "user_ids": [1, 2]}
+    {"type": "message", "id": "...", "conversation_id": "...", "seq": 1, "sender_id": 1,
+     "content": "...", "created_at": "...", "updated_at": "..."}
+
+Exports walk the history with a seq cursor, so memory use does not depend
+on the conversation's size. Imports insert messages in batched transactions
+(one per storage target) and record a checkpoint after every batch, so an
+interrupted import picks up where it stopped. Message `id`, `seq` and
+timestamps are optional on import; missing sequence numbers continue from
+the conversation's current last seq. Resuming is exact for lines that carry
+their seq (as exports do); lines without one cannot be matched against rows
+a crashed batch already wrote. Outside that first resumed batch, a message
+that already exists fails the import, in every storage layout, instead of
+being silently skipped or duplicated.
+
+Usage:
+    python -m backend.conversation.transfer export CONVERSATION_ID [...] [-o FILE]
+    python -m backend.conversation.transfer export --all -o dump.ndjson
+    python -m backend.conversation.transfer import dump.ndjson [--batch-size N] [--restart]
+
+Imports bypass the in-process caches of a running server (unread counters,
+ETags, long-poll buffers); import into a stopped server or restart it
+afterwards.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from backend.conversation.chat import chat_service
+from backend.conversation.partitions import new_message_id, now_millis
+from backend.conversation.serializers import encode_export_header, encode_export_messages
+
+EXPORT_BATCH = 1000
+IMPORT_BATCH = 5000
+# IDs end up in file names (archive segments) and URLs; only cuid-like ones are imported
+ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+async def export_conversation(conversation_id: str, since_seq: int = 0, batch_size: int = EXPORT_BATCH) -> AsyncIterator[bytes]:
+    """
+    Stream a conversation as NDJSON
+
+    Args:
+        conversation_id: Conversation to export
+        since_seq: Only export messages after this sequence number
+        batch_size: Messages per query (and per yielded chunk)
+
+    Yields:
+        bytes: The conversation line, then chunks of message lines
+    """
+    conversation = await chat_service.get_conversation_info(conversation_id)
+    if conversation is None:
+        raise ValueError(f"Conversation {conversation_id} not found")
+    yield encode_export_header(conversation, await chat_service.get_member_ids(conversation_id))
+    async for messages in chat_service.iter_messages(conversation_id, since_seq, batch_size):
+        yield encode_export_messages(messages)
+
+
+def _checked_id(value, field: str) -> str:
+    value = str(value)
+    if not ID_PATTERN.fullmatch(value):
+        raise ValueError(f"{field} must be 1-64 letters, digits, '-' or '_'")
+    return value
+
+
+def _millis(value: Optional[str], default: int) -> int:
+    if value is None:
+        return default
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+class ImportProgress:
+    """Snapshot passed to the progress callback after every committed batch"""
+    __slots__ = ("offset", "size", "lines", "inserted", "elapsed")
+
+    def __init__(self, offset: int, size: int, lines: int, inserted: int, elapsed: float):
+        self.offset = offset
+        self.size = size
+        self.lines = lines
+        self.inserted = inserted
+        self.elapsed = elapsed
+
+    def __str__(self) -> str:
+        rate = self.lines / self.elapsed if self.elapsed else 0.0
+        percent = 100.0 * self.offset / self.size if self.size else 100.0
+        remaining = (self.size - self.offset) * self.elapsed / self.offset if self.offset else 0.0
+        return (
+            f"{percent:5.1f}%  {self.lines:,} lines  {self.inserted:,} inserted  "
+            f"{rate:,.0f} lines/s  ETA {remaining:,.0f}s"
+        )
+
+
+class NDJSONImporter:
+    """Resumable bulk importer for NDJSON exports"""
+
+    def __init__(
+        self,
+        path,
+        batch_size: int = IMPORT_BATCH,
+        resume: bool = True,
+        progress: Optional[Callable[[ImportProgress], None]] = None
+    ):
+        """
+        Args:
+            path: NDJSON file to import
+            batch_size: Messages per transaction
+            resume: Continue from the checkpoint left by an interrupted run
+            progress: Called after every committed batch
+        """
+        self.path = Path(path)
+        self.checkpoint_path = self.path.with_name(self.path.name + ".checkpoint")
+        self.batch_size = batch_size
+        self.resume = resume
+        self.progress = progress
+        # conversation_id -> next seq to hand out to messages without one
+        self._next_seq: Dict[str, int] = {}
+
+    async def run(self) -> int:
+        """
+        Import the file
+
+        Returns:
+            int: Number of messages inserted by this run
+
+        Raises:
+            ValueError: If a line is malformed (the checkpoint allows resuming once it is fixed)
+        """
+        offset, lines, inserted = 0, 0, 0
+        if self.resume and self.checkpoint_path.exists():
+            checkpoint = json.loads(self.checkpoint_path.read_text())
+            offset, lines = checkpoint["offset"], checkpoint["lines"]
+        # The first batch after a resume may already be in the database
+        skip_existing = offset > 0
+
+        size = self.path.stat().st_size
+        started = time.monotonic()
+        rows: List[tuple] = []
+
+        with open(self.path, "rb") as source:
+            source.seek(offset)
+            for line in source:
+                offset += len(line)
+                lines += 1
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    row = await self._handle(record)
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{self.path}:{lines}: {e}") from e
+                if row is not None:
+                    rows.append(row)
+                if len(rows) >= self.batch_size:
+                    inserted += await chat_service.import_messages(rows, skip_existing)
+                    rows, skip_existing = [], False
+                    self._save_checkpoint(offset, lines)
+                    self._report(offset, size, lines, inserted, started)
+
+        inserted += await chat_service.import_messages(rows, skip_existing)
+        self._report(offset, size, lines, inserted, started)
+        if self.checkpoint_path.exists():
+            self.checkpoint_path.unlink()
+        return inserted
+
+    async def _handle(self, record: dict) -> Optional[tuple]:
+        record_type = record.get("type", "message")
+        if record_type == "conversation":
+            user_ids = [int(user_id) for user_id in record.get("user_ids", [])]
+            await chat_service.ensure_conversation(_checked_id(record["id"], "id"), user_ids, record.get("name"))
+            return None
+        if record_type != "message":
+            raise ValueError(f"Unknown record type: {record_type}")
+
+        conversation_id = _checked_id(record["conversation_id"], "conversation_id")
+        content = record["content"]
+        if not isinstance(content, str):
+            raise ValueError("content must be a string")
+
+        next_seq = self._next_seq.get(conversation_id)
+        if next_seq is None:
+            next_seq = await chat_service.get_last_seq(conversation_id) + 1
+        seq = int(record.get("seq") or next_seq)
+        self._next_seq[conversation_id] = max(next_seq, seq + 1)
+
+        now = now_millis()
+        created_at = _millis(record.get("created_at"), now)
+        return (
+            _checked_id(record["id"], "id") if record.get("id") else new_message_id(),
+            content,
+            int(record["sender_id"]),
+            conversation_id,
+            seq,
+            created_at,
+            _millis(record.get("updated_at"), created_at),
+        )
+
+    def _save_checkpoint(self, offset: int, lines: int):
+        # Write-then-rename so a crash never leaves a torn checkpoint
+        temporary = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        temporary.write_text(json.dumps({"offset": offset, "lines": lines}))
+        os.replace(temporary, self.checkpoint_path)
+
+    def _report(self, offset: int, size: int, lines: int, inserted: int, started: float):
+        if self.progress is not None:
+            self.progress(ImportProgress(offset, size, lines, inserted, time.monotonic() - started))
+
+
+async def _export(args):
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        if args.all:
+            after = None
+            while True:
+                ids = await chat_service.list_conversation_ids(after)
+                if not ids:
+                    break
+                for conversation_id in ids:
+                    async for chunk in export_conversation(conversation_id):
+                        output.write(chunk)
+                after = ids[-1]
+        else:
+            for conversation_id in args.conversation_ids:
+                async for chunk in export_conversation(conversation_id, args.since):
+                    output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+async def _import(args):
+    def show(progress: ImportProgress):
+        print(f"\r{progress}", end="", file=sys.stderr, flush=True)
+
+    importer = NDJSONImporter(args.file, args.batch_size, resume=not args.restart, progress=show)
+    inserted = await importer.run()
+    print(f"\nImported {inserted:,} messages", file=sys.stderr)
+
+
+async def _main(args):
+    from backend.utils.database import disconnect_database, get_database
+
+    await get_database()
+    try:
+        await (_export(args) if args.command == "export" else _import(args))
+    finally:
+        await chat_service.stop()
+        await disconnect_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write conversations as NDJSON")
+    export.add_argument("conversation_ids", nargs="*")
+    export.add_argument("--all", action="store_true", help="export every conversation")
+    export.add_argument("--since", type=int, default=0, help="only messages after this seq")
+    export.add_argument("-o", "--output", help="output file (default: stdout)")
+
+    load = commands.add_parser("import", help="bulk-load an NDJSON export")
+    load.add_argument("file")
+    load.add_argument("--batch-size", type=int, default=IMPORT_BATCH)
+    load.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+
+    args = parser.parse_args()
+    if args.command == "export" and not args.all and not args.conversation_ids:
+        parser.error("pass conversation IDs or --all")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
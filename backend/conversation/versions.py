@@ -0,0 +1,102 @@
+"""
+Version stamps for conditional GETs
+
+Every conversation and every user inbox carries a counter that is bumped on
+writes. ETags are built from the counters (plus a per-process epoch, so a
+restart invalidates everything), which lets unchanged resources be answered
+with 304 Not Modified without running any query. The counters of the least
+recently used entries are dropped past MAX_CONVERSATIONS / MAX_INBOXES;
+those resources then get a fresh ETag (one extra 200, never a wrong 304).
+"""
+import secrets
+from collections import OrderedDict
+from typing import FrozenSet, Hashable, Iterable
+from backend.conversation.chat import chat_service
+
+MAX_CONVERSATIONS = 50_000
+MAX_INBOXES = 50_000
+
+
+class _Versions:
+    """
+    LRU map of key -> version, bounded to `max_entries`
+
+    Versions come from one clock shared by every key, so a key that is
+    evicted and bumped again never reuses a version an earlier ETag carried.
+    Keys not in the map report the clock at the last eviction: higher than
+    any version an evicted key had, so their old ETags stop matching.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._versions: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+
+    def bump(self, key: Hashable):
+        self._clock += 1
+        self._versions[key] = self._clock
+        self._versions.move_to_end(key)
+        if len(self._versions) > self.max_entries:
+            self._versions.popitem(last=False)
+            self._floor = self._clock
+
+    def get(self, key: Hashable) -> int:
+        version = self._versions.get(key)
+        if version is None:
+            return self._floor
+        self._versions.move_to_end(key)
+        return version
+
+
+class VersionStamps:
+    """Per-conversation and per-inbox write counters"""
+
+    def __init__(self):
+        self.epoch = secrets.token_hex(4)
+        self._conversations = _Versions(MAX_CONVERSATIONS)
+        self._inboxes = _Versions(MAX_INBOXES)
+
+    def bump_conversation(self, conversation_id: str):
+        self._conversations.bump(conversation_id)
+
+    def bump_inboxes(self, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            self._inboxes.bump(user_id)
+
+    def conversation_etag(self, conversation_id: str, user_id: int, variant: str = "") -> str:
+        """
+        ETag for a conversation as seen by one user
+
+        Args:
+            conversation_id: Conversation the response describes
+            user_id: Viewer; responses are rendered relative to them ("me"/"they")
+            variant: Query parameters that change the response body
+
+        Returns:
+            str: Weak ETag
+        """
+        version = self._conversations.get(conversation_id)
+        suffix = f".{variant}" if variant else ""
+        return f'W/"{self.epoch}.c{version}.u{user_id}{suffix}"'
+
+    def inbox_etag(self, user_id: int) -> str:
+        return f'W/"{self.epoch}.i{self._inboxes.get(user_id)}.u{user_id}"'
+
+    async def publish(self, message, member_ids: FrozenSet[int]):
+        """Message listener: a new message changes the conversation and every member's inbox"""
+        self.bump_conversation(message.conversationId)
+        self.bump_inboxes(member_ids)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# Global version stamps instance
+version_stamps = VersionStamps()
+chat_service.add_listener(version_stamps.publish, inline=True)
@@ -0,0 +1,130 @@
+"""
+Wakeups for long-poll and Server-Sent Events clients
+
+Idle pollers of a conversation all await one shared future, which
+`add_message` resolves, so waiting costs neither CPU nor database queries.
+Recent messages are kept in a small per-conversation tail buffer so woken
+pollers are answered from memory; only clients whose cursor has fallen
+behind the buffer hit the database.
+"""
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, Dict, FrozenSet, List
+from backend.conversation.chat import chat_service
+from backend.conversation.realtime import message_payload
+
+TAIL_SIZE = 64
+MAX_CONVERSATIONS = 5_000
+MAX_BATCH = 500
+
+
+class MessageWaiters:
+    """Per-conversation waiters woken by new messages"""
+
+    def __init__(self):
+        self._futures: Dict[str, asyncio.Future] = {}
+        # conversation_id -> recent message payloads, oldest first
+        self._tails: "OrderedDict[str, Deque[dict]]" = OrderedDict()
+        # conversation_id -> highest seq this process knows to exist
+        self._last_seq: "OrderedDict[str, int]" = OrderedDict()
+
+    async def publish(self, message, member_ids: FrozenSet[int]):
+        """Message listener: buffer the message and wake every waiter"""
+        conversation_id = message.conversationId
+
+        tail = self._tails.get(conversation_id)
+        if tail is None:
+            tail = self._tails[conversation_id] = deque(maxlen=TAIL_SIZE)
+        payload = message_payload(message)
+        if tail and tail[-1]["seq"] > message.seq:
+            # Listeners of concurrent writes can run out of order; keep the tail sorted
+            position = next(i for i, buffered in enumerate(tail) if buffered["seq"] > message.seq)
+            if len(tail) < tail.maxlen:
+                tail.insert(position, payload)
+            elif position > 0:
+                tail.popleft()
+                tail.insert(position - 1, payload)
+        else:
+            tail.append(payload)
+        self._tails.move_to_end(conversation_id)
+        if len(self._tails) > MAX_CONVERSATIONS:
+            self._tails.popitem(last=False)
+        self._remember_seq(conversation_id, message.seq)
+
+        future = self._futures.pop(conversation_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def wait_for_messages(self, conversation_id: str, since_seq: int, timeout: float) -> List[dict]:
+        """
+        Return messages after `since_seq`, waiting up to `timeout` seconds for one to arrive
+
+        Args:
+            conversation_id: Conversation to watch
+            since_seq: Client cursor (last sequence number seen)
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            List[dict]: New message payloads, oldest first; empty on timeout
+        """
+        # Take the future before looking: a message published while _collect
+        # awaits the database resolves it, instead of being missed
+        future = self._futures.get(conversation_id)
+        if future is None or future.done():
+            future = self._futures[conversation_id] = asyncio.get_running_loop().create_future()
+        messages = await self._collect(conversation_id, since_seq)
+        if messages:
+            return messages
+        try:
+            # Shield so one waiter timing out does not cancel the shared future
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return await self._collect(conversation_id, since_seq)
+
+    def wake_all(self):
+        """Release every waiting poller and stream, e.g. while draining for a restart"""
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_result(None)
+
+    async def _collect(self, conversation_id: str, since_seq: int) -> List[dict]:
+        last_seq = self._last_seq.get(conversation_id)
+        if last_seq is not None and since_seq >= last_seq:
+            return []
+
+        tail = self._tails.get(conversation_id)
+        if tail and tail[0]["seq"] <= since_seq + 1:
+            # Only hand out the gap-free run after the cursor; a message whose
+            # listener has not run yet must not be skipped over
+            messages = []
+            expected = since_seq + 1
+            for payload in tail:
+                if payload["seq"] < expected:
+                    continue
+                if payload["seq"] != expected or len(messages) == MAX_BATCH:
+                    break
+                messages.append(payload)
+                expected += 1
+            return messages
+
+        # Cursor is behind the buffer (or nothing is buffered yet)
+        messages = await chat_service.get_messages_since(conversation_id, since_seq, MAX_BATCH)
+        if messages:
+            self._remember_seq(conversation_id, messages[-1].seq)
+        else:
+            self._remember_seq(conversation_id, await chat_service.get_last_seq(conversation_id))
+        return [message_payload(message) for message in messages]
+
+    def _remember_seq(self, conversation_id: str, seq: int):
+        if seq >= self._last_seq.get(conversation_id, -1):
+            self._last_seq[conversation_id] = seq
+        self._last_seq.move_to_end(conversation_id)
+        if len(self._last_seq) > MAX_CONVERSATIONS:
+            self._last_seq.popitem(last=False)
+
+
+# Global waiters instance
+message_waiters = MessageWaiters()
+chat_service.add_listener(message_waiters.publish, inline=True)
@@ -0,0 +1,92 @@
+"""
+Graceful drain for rolling restarts
+
+On SIGTERM uvicorn stops listening and closes every WebSocket at once with
+no hint, so all clients reconnect to the remaining instances in the same
+instant. The drain runs first instead: /ready turns 503, new sockets are
+refused, long-polls and event streams are released, fan-outs in flight
+finish, every socket is closed with a jittered reconnect hint, and buffered
+read receipts are written, all within DRAIN_TIMEOUT seconds. Only then is the
+signal handed on to the server's own shutdown.
+
+The drain also runs at the start of the lifespan shutdown, for servers where
+the signal hook could not be installed; it only ever runs once.
+"""
+import asyncio
+import signal
+import threading
+from typing import Optional
+import alog
+from backend.config.settings import settings
+from backend.connection import manager
+from backend.conversation.chat import chat_service
+from backend.conversation.receipts import read_receipts
+from backend.conversation.waiters import message_waiters
+
+
+class GracefulDrain:
+    """Drains sockets and buffered writes once, on SIGTERM or at shutdown"""
+
+    def __init__(self):
+        self.timeout = settings.drain_timeout
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous_handler = None
+
+    def install(self):
+        """Hook SIGTERM so the drain runs before the server shuts down. Call during startup."""
+        # Signal handlers can only be set from the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._previous_handler = signal.signal(signal.SIGTERM, self._handle_sigterm)
+
+    def uninstall(self):
+        """Put the server's own SIGTERM handler back. Call during shutdown."""
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGTERM, self._previous_handler)
+            self._previous_handler = None
+
+    async def drain(self):
+        """Run the drain, or wait for the one already running"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        await asyncio.shield(self._task)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        alog.info(f"Draining within {self.timeout:g} s...")
+
+        # Pollers return now; event streams see `manager.draining` and end with a retry hint
+        manager.draining = True
+        message_waiters.wake_all()
+        try:
+            # Messages already stored still reach their sockets before those close
+            await chat_service.wait_for_listeners(max(0.0, deadline - loop.time()) / 2)
+            await manager.drain(max(0.0, deadline - loop.time()))
+            await asyncio.wait_for(read_receipts.flush(), timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            # Whatever is left is written by the regular shutdown
+            alog.warning("Drain deadline reached with writes still pending")
+        except Exception as e:
+            alog.error(f"Drain failed: {e}")
+        alog.info(f"Drain finished in {self.timeout - (deadline - loop.time()):.2f} s")
+
+    def _handle_sigterm(self, signum, frame):
+        previous = self._previous_handler
+        self.uninstall()
+        # Runs between bytecodes on the main thread; the loop may be mid-callback
+        self._loop.call_soon_threadsafe(self._drain_then_forward, previous, signum, frame)
+
+    def _drain_then_forward(self, previous, signum, frame):
+        def forward(_):
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                signal.raise_signal(signum)
+        asyncio.ensure_future(self.drain()).add_done_callback(forward)
+
+
+# Global drain instance
+graceful_drain = GracefulDrain()
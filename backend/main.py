@@ -1,17 +1,39 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, status
+from fastapi.responses import JSONResponse
 from backend.auth.dependencies import get_current_user
 from backend.schemas.auth import UserResponse
 from fastapi.middleware.cors import CORSMiddleware
-from backend.connection import manager
+from fastapi.middleware.gzip import GZipMiddleware
+from backend.connection import manager, parse_control_frame
 from backend.auth.routes import router as auth_router
 from backend.data.routes import router as data_router
+from backend.admin.routes import router as admin_router
 from backend.conversation.routes import router as conversation_router
 from backend.config.settings import settings
-from backend.conversation.chat import ChatService
-from backend.utils.database import get_database, disconnect_database
+from backend.conversation.chat import chat_service
+from backend.conversation.analytics import conversation_analytics
+from backend.conversation.compaction import archive_compactor
+from backend.conversation.digests import digest_mailer
+from backend.conversation.realtime import handle_frame, send_sync
+from backend.conversation.presence import presence
+from backend.conversation.receipts import read_receipts
+from backend.conversation.retention import retention_purger
+from backend.utils.security import verify_token
+from backend.utils.wire import negotiate_subprotocol
+from backend.storage import storage
+from backend.utils.backup import database_backup
+from backend.warmup import warmup
+from backend.drain import graceful_drain
 from contextlib import asynccontextmanager
+from typing import Optional
 import alog
 
+# Seconds spent importing the application, reported by /ready
+import_seconds = time.perf_counter() - _import_started
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -19,13 +41,32 @@ async def lifespan(app: FastAPI):
     """
     # Startup: Initialize database connection
     alog.info("Starting up application...")
-    await get_database()  # This will create and connect the database
+    await storage.connect()  # Connects the database unless STORAGE_ENGINE=memory
+    archive_compactor.start()
+    retention_purger.start()
+    database_backup.start()
+    digest_mailer.start()
+    conversation_analytics.start()
+    warmup.start(import_seconds)
+    graceful_drain.install()
 
     yield
 
     # Shutdown: Clean up database connection
     alog.info("Shutting down application...")
-    await disconnect_database()
+    graceful_drain.uninstall()
+    await graceful_drain.drain()  # No-op if SIGTERM already drained
+    await warmup.stop()
+    await manager.stop()
+    await presence.stop()
+    await archive_compactor.stop()
+    await retention_purger.stop()
+    await database_backup.stop()
+    await digest_mailer.stop()
+    await conversation_analytics.stop()
+    await read_receipts.stop()
+    await chat_service.stop()
+    await storage.disconnect()
 
 app = FastAPI(
     title=settings.app_name,
@@ -42,32 +83,114 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class GZipExceptAttachmentsMiddleware(GZipMiddleware):
+    """GZip that leaves attachment downloads alone: media is already compressed and Range responses must stay byte-exact"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/api/chat/attachments/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Compress large JSON bodies (conversation lists, history pages); SSE streams and attachments are left alone
+app.add_middleware(
+    GZipExceptAttachmentsMiddleware,
+    minimum_size=settings.gzip_minimum_size,
+    compresslevel=settings.gzip_compress_level,
+)
+
 # Include authentication routes
 app.include_router(auth_router, prefix="/api")
 app.include_router(data_router, prefix="/api")
 app.include_router(conversation_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
+
+# ✅ Readiness probe: 503 until the startup warmup has finished, and again once draining
+@app.get("/ready")
+async def ready():
+    if manager.draining:
+        return JSONResponse({**warmup.status(), "status": "draining"}, status_code=503)
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
 
-chat_service = ChatService()
+def socket_user_id(websocket: WebSocket) -> Optional[int]:
+    """User ID from the access token passed as the `token` query parameter, or None if it is missing or invalid"""
+    payload = verify_token(websocket.query_params.get("token", ""), "access")
+    if payload is None or not str(payload.get("sub", "")).isdigit():
+        return None
+    return int(payload["sub"])
 
 @app.websocket("/ws/{conversation_id}")
 async def chat_websocket(websocket: WebSocket, conversation_id: str):
-    await manager.connect(conversation_id, websocket)
+    """
+    Socket for a single conversation, authenticated like /ws; only members may connect.
+    Clients send plain text messages and receive JSON `message` envelopes.
+    """
+    if manager.draining:
+        await manager.refuse(websocket)
+        return
+
+    user_id = socket_user_id(websocket)
+    # Presence, digests and deliveries all trust this identity
+    if user_id is None or not await chat_service.is_member(conversation_id, user_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
 
-    user_id = websocket.query_params.get("user_id") if websocket.query_params else None
-    if user_id:
-        user_id = int(user_id)  # Convert to int since User.id is int
+    connection = await manager.connect(websocket, user_id, conversation_id)
 
     alog.info(f"User {user_id} connected to conversation {conversation_id}")
 
     try:
+        # Reconnecting clients pass the last seq they saw and only get the gap
+        since = websocket.query_params.get("since")
+        if since and since.isdigit():
+            await send_sync(connection, conversation_id, int(since))
+
         while True:
             data = await websocket.receive_text()
+            manager.touch(websocket)
 
-            alog.info(f"User {user_id} sent message: {data}")
+            control = parse_control_frame(data)
+            if control is not None:
+                if control["type"] == "resume" and isinstance(control.get("seq"), int):
+                    await send_sync(connection, conversation_id, control["seq"])
+                continue
 
-            message = await chat_service.add_message(conversation_id, user_id, data)
+            alog.info(f"User {user_id} sent message: {data}")
 
-            await manager.broadcast(conversation_id, data, sender=websocket)
+            # Delivery to the other sockets happens via publish_message
+            await chat_service.add_message(conversation_id, user_id, data)
     except WebSocketDisconnect:
-        manager.disconnect(conversation_id, websocket)
+        manager.disconnect(websocket)
         alog.info(f"User {user_id} disconnected from conversation {conversation_id}")
+
+@app.websocket("/ws")
+async def user_websocket(websocket: WebSocket):
+    """
+    Single per-user socket multiplexing every conversation the user belongs to.
+    Authenticated with an access token passed as the `token` query parameter.
+    Clients may offer the `chatbox.msgpack` subprotocol for binary frames.
+    """
+    if manager.draining:
+        await manager.refuse(websocket)
+        return
+
+    user_id = socket_user_id(websocket)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    connection = await manager.connect(websocket, user_id, multiplexed=True, subprotocol=subprotocol)
+    alog.info(f"User {user_id} connected to multiplexed socket ({subprotocol or 'json'})")
+
+    try:
+        while True:
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", status.WS_1000_NORMAL_CLOSURE))
+            manager.touch(websocket)
+            data = received.get("bytes")
+            await handle_frame(connection, data if data is not None else received.get("text", ""))
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
+        alog.info(f"User {user_id} disconnected from multiplexed socket")
@@ -1,8 +1,8 @@
 """
 Messages-related Pydantic schemas
 """
-from typing import Optional
-from pydantic import BaseModel, EmailStr, field_validator
+from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from backend.schemas.auth import UserResponse
 import re
 
@@ -10,13 +10,102 @@ class MessageRequest(BaseModel):
     """Message request schema"""
     content: str
 
+MAX_BATCH_MESSAGES = 100
+MAX_BATCH_CONVERSATIONS = 100
+
+class BatchMessageRequest(BaseModel):
+    """One message of a batch send"""
+    conversation_id: str
+    content: str
+    # Client-generated; retries with the same key return the first result instead of a duplicate
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=255)
+
+class BatchSendRequest(BaseModel):
+    """Batch send request schema"""
+    messages: List[BatchMessageRequest] = Field(..., min_length=1, max_length=MAX_BATCH_MESSAGES)
+
 class MessageResponse(BaseModel):
     """Message response schema"""
     id: str
+    seq: int
     content: str
+    sender_id: int
     sender: UserResponse
     created_at: str
     updated_at: str
 
     class Config:
         from_attributes = True
+
+class HistoryMessageResponse(BaseModel):
+    """Message history entry, rendered relative to the requesting user"""
+    id: str
+    seq: int
+    text: str
+    sender: str  # "me" or "they"
+    created_at: str
+    updated_at: str
+
+class InboxMessageResponse(BaseModel):
+    """Message entry in the conversation list (sender not expanded)"""
+    id: str
+    seq: int
+    content: str
+    sender_id: int
+    created_at: str
+    updated_at: str
+
+class SentMessageResponse(BaseModel):
+    """Result of one message of a batch send"""
+    id: str
+    conversation_id: str
+    seq: int
+    content: str
+    sender_id: int
+    created_at: str
+    updated_at: str
+    idempotency_key: Optional[str] = None
+    replayed: bool  # True when the key was seen before and nothing new was stored
+
+class ConversationResponse(BaseModel):
+    """Single conversation with its members and messages"""
+    id: str
+    name: Optional[str] = None
+    last_seq: int
+    users: List[UserResponse]
+    messages: List[MessageResponse]
+
+class InboxConversationResponse(BaseModel):
+    """Conversation list entry with the user's unread count"""
+    id: str
+    name: Optional[str] = None
+    last_seq: int
+    users: List[UserResponse]
+    messages: List[InboxMessageResponse]
+    unread_count: int
+
+class AttachmentUploadRequest(BaseModel):
+    """Start of a chunked attachment upload"""
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field("application/octet-stream", min_length=1, max_length=255)
+    size: int = Field(..., ge=1)
+    # Optional; when given, the finished upload is rejected unless its content hashes to it
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-fA-F]{64}$")
+
+class UploadStatusResponse(BaseModel):
+    """An unfinished upload and where the next chunk starts"""
+    upload_id: str
+    offset: int
+    size: int
+    chunk_size: int
+
+class AttachmentResponse(BaseModel):
+    """A stored attachment; messages reference it by `url`"""
+    id: str
+    conversation_id: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    url: str
+    created_at: str
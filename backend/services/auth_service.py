@@ -1,10 +1,10 @@
 """
 Authentication service layer containing business logic
 """
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import alog
-from backend.utils.database import get_db_session
+from backend.storage import DuplicateKeyError, Storage, storage as default_storage
 from backend.utils.security import (
     verify_password,
     get_password_hash,
@@ -15,6 +15,7 @@ from backend.utils.security import (
     verify_token
 )
 from backend.utils.email import send_password_reset_email
+from backend.utils.loader import BatchLoader
 from backend.schemas.auth import (
     UserSignupRequest,
     UserSigninRequest,
@@ -30,8 +31,10 @@ from backend.schemas.auth import (
 class AuthService:
     """Authentication service class"""
 
-    def __init__(self):
-        pass
+    def __init__(self, storage: Optional[Storage] = None):
+        self._storage = storage or default_storage
+        # Every authenticated request looks up its user; concurrent lookups share queries
+        self._user_loader = BatchLoader(self._load_users, name="users")
 
     async def signup(self, signup_data: UserSignupRequest) -> Tuple[bool, str, Optional[AuthResponse]]:
         """
@@ -41,49 +44,44 @@ class AuthService:
             Tuple[bool, str, Optional[AuthResponse]]: (success, message, auth_response)
         """
         try:
-            async with get_db_session() as db:
-                # Check if user already exists
-                existing_user = await db.user.find_unique(
-                    where={"email": signup_data.email}
-                )
-
-                if existing_user:
-                    return False, "User with this email already exists", None
-
-                # Hash password
-                hashed_password = get_password_hash(signup_data.password)
-
-                # Create user
-                user = await db.user.create(
-                    data={
-                        "email": signup_data.email,
-                        "name": signup_data.name,
-                        "password": hashed_password
-                    }
-                )
-
-                # Generate tokens
-                access_token = create_access_token(data={"sub": str(user.id), "email": user.email})
-                refresh_token = create_refresh_token(data={"sub": str(user.id), "email": user.email})
-
-                # Create response
-                user_response = UserResponse(
-                    id=user.id,
-                    email=user.email,
-                    name=user.name,
-                    created_at=user.createdAt.isoformat(),
-                    updated_at=user.updatedAt.isoformat()
-                )
-
-                tokens = TokenResponse(
-                    access_token=access_token,
-                    refresh_token=refresh_token
-                )
-
-                auth_response = AuthResponse(user=user_response, tokens=tokens)
-
-                alog.info(f"User registered successfully: {user.email}")
-                return True, "User registered successfully", auth_response
+            # Check if user already exists
+            existing_user = await self._storage.find_user_by_email(signup_data.email)
+
+            if existing_user:
+                return False, "User with this email already exists", None
+
+            # Hash password
+            hashed_password = get_password_hash(signup_data.password)
+
+            # Create user
+            try:
+                user = await self._storage.create_user(signup_data.email, signup_data.name, hashed_password)
+            except DuplicateKeyError:
+                # Registered concurrently since the check above
+                return False, "User with this email already exists", None
+
+            # Generate tokens
+            access_token = create_access_token(data={"sub": str(user.id), "email": user.email})
+            refresh_token = create_refresh_token(data={"sub": str(user.id), "email": user.email})
+
+            # Create response
+            user_response = UserResponse(
+                id=user.id,
+                email=user.email,
+                name=user.name,
+                created_at=user.createdAt.isoformat(),
+                updated_at=user.updatedAt.isoformat()
+            )
+
+            tokens = TokenResponse(
+                access_token=access_token,
+                refresh_token=refresh_token
+            )
+
+            auth_response = AuthResponse(user=user_response, tokens=tokens)
+
+            alog.info(f"User registered successfully: {user.email}")
+            return True, "User registered successfully", auth_response
 
         except Exception as e:
             alog.error(f"Error during signup: {str(e)}")
@@ -97,41 +95,38 @@ class AuthService:
             Tuple[bool, str, Optional[AuthResponse]]: (success, message, auth_response)
         """
         try:
-            async with get_db_session() as db:
-                # Find user by email
-                user = await db.user.find_unique(
-                    where={"email": signin_data.email}
-                )
-
-                if not user or not user.password:
-                    return False, "Invalid email or password", None
-
-                # Verify password
-                if not verify_password(signin_data.password, user.password):
-                    return False, "Invalid email or password", None
-
-                # Generate tokens
-                access_token = create_access_token(data={"sub": str(user.id), "email": user.email})
-                refresh_token = create_refresh_token(data={"sub": str(user.id), "email": user.email})
-
-                # Create response
-                user_response = UserResponse(
-                    id=user.id,
-                    email=user.email,
-                    name=user.name,
-                    created_at=user.createdAt.isoformat(),
-                    updated_at=user.updatedAt.isoformat()
-                )
-
-                tokens = TokenResponse(
-                    access_token=access_token,
-                    refresh_token=refresh_token
-                )
-
-                auth_response = AuthResponse(user=user_response, tokens=tokens)
-
-                alog.info(f"User signed in successfully: {user.email}")
-                return True, "Signed in successfully", auth_response
+            # Find user by email
+            user = await self._storage.find_user_by_email(signin_data.email)
+
+            if not user or not user.password:
+                return False, "Invalid email or password", None
+
+            # Verify password
+            if not verify_password(signin_data.password, user.password):
+                return False, "Invalid email or password", None
+
+            # Generate tokens
+            access_token = create_access_token(data={"sub": str(user.id), "email": user.email})
+            refresh_token = create_refresh_token(data={"sub": str(user.id), "email": user.email})
+
+            # Create response
+            user_response = UserResponse(
+                id=user.id,
+                email=user.email,
+                name=user.name,
+                created_at=user.createdAt.isoformat(),
+                updated_at=user.updatedAt.isoformat()
+            )
+
+            tokens = TokenResponse(
+                access_token=access_token,
+                refresh_token=refresh_token
+            )
+
+            auth_response = AuthResponse(user=user_response, tokens=tokens)
+
+            alog.info(f"User signed in successfully: {user.email}")
+            return True, "Signed in successfully", auth_response
 
         except Exception as e:
             alog.error(f"Error during signin: {str(e)}")
@@ -145,28 +140,25 @@ class AuthService:
             Tuple[bool, str]: (success, message)
         """
         try:
-            async with get_db_session() as db:
-                # Find user by email
-                user = await db.user.find_unique(
-                    where={"email": forgot_data.email}
-                )
+            # Find user by email
+            user = await self._storage.find_user_by_email(forgot_data.email)
 
-                if not user:
-                    # Don't reveal if email exists or not for security
-                    return True, "If the email exists, a password reset link has been sent"
+            if not user:
+                # Don't reveal if email exists or not for security
+                return True, "If the email exists, a password reset link has been sent"
 
-                # Generate reset token
-                reset_token = create_password_reset_token(user.email)
+            # Generate reset token
+            reset_token = create_password_reset_token(user.email)
 
-                # Send email
-                email_sent = send_password_reset_email(user.email, reset_token)
+            # Send email
+            email_sent = send_password_reset_email(user.email, reset_token)
 
-                if email_sent:
-                    alog.info(f"Password reset email sent to: {user.email}")
-                    return True, "Password reset link has been sent to your email"
-                else:
-                    alog.error(f"Failed to send password reset email to: {user.email}")
-                    return False, "Failed to send password reset email"
+            if email_sent:
+                alog.info(f"Password reset email sent to: {user.email}")
+                return True, "Password reset link has been sent to your email"
+            else:
+                alog.error(f"Failed to send password reset email to: {user.email}")
+                return False, "Failed to send password reset email"
 
         except Exception as e:
             alog.error(f"Error during forgot password: {str(e)}")
@@ -185,26 +177,20 @@ class AuthService:
             if not email:
                 return False, "Invalid or expired reset token"
 
-            async with get_db_session() as db:
-                # Find user by email
-                user = await db.user.find_unique(
-                    where={"email": email}
-                )
+            # Find user by email
+            user = await self._storage.find_user_by_email(email)
 
-                if not user:
-                    return False, "User not found"
+            if not user:
+                return False, "User not found"
 
-                # Hash new password
-                hashed_password = get_password_hash(reset_data.new_password)
+            # Hash new password
+            hashed_password = get_password_hash(reset_data.new_password)
 
-                # Update user password
-                await db.user.update(
-                    where={"id": user.id},
-                    data={"password": hashed_password}
-                )
+            # Update user password
+            await self._storage.set_password(user.id, hashed_password)
 
-                alog.info(f"Password reset successfully for user: {user.email}")
-                return True, "Password has been reset successfully"
+            alog.info(f"Password reset successfully for user: {user.email}")
+            return True, "Password has been reset successfully"
 
         except Exception as e:
             alog.error(f"Error during password reset: {str(e)}")
@@ -218,30 +204,24 @@ class AuthService:
             Tuple[bool, str]: (success, message)
         """
         try:
-            async with get_db_session() as db:
-                # Find user
-                user = await db.user.find_unique(
-                    where={"id": user_id}
-                )
+            # Find user
+            user = await self._storage.find_user(user_id)
 
-                if not user or not user.password:
-                    return False, "User not found"
+            if not user or not user.password:
+                return False, "User not found"
 
-                # Verify current password
-                if not verify_password(change_data.current_password, user.password):
-                    return False, "Current password is incorrect"
+            # Verify current password
+            if not verify_password(change_data.current_password, user.password):
+                return False, "Current password is incorrect"
 
-                # Hash new password
-                hashed_password = get_password_hash(change_data.new_password)
+            # Hash new password
+            hashed_password = get_password_hash(change_data.new_password)
 
-                # Update user password
-                await db.user.update(
-                    where={"id": user.id},
-                    data={"password": hashed_password}
-                )
+            # Update user password
+            await self._storage.set_password(user.id, hashed_password)
 
-                alog.info(f"Password changed successfully for user: {user.email}")
-                return True, "Password has been changed successfully"
+            alog.info(f"Password changed successfully for user: {user.email}")
+            return True, "Password has been changed successfully"
 
         except Exception as e:
             alog.error(f"Error during password change: {str(e)}")
@@ -289,26 +269,26 @@ class AuthService:
             Optional[UserResponse]: User information or None
         """
         try:
-            async with get_db_session() as db:
-                user = await db.user.find_unique(
-                    where={"id": user_id}
-                )
-
-                if not user:
-                    return None
-
-                return UserResponse(
-                    id=user.id,
-                    email=user.email,
-                    name=user.name,
-                    created_at=user.createdAt.isoformat(),
-                    updated_at=user.updatedAt.isoformat()
-                )
-
+            return await self._user_loader.load(user_id)
         except Exception as e:
             alog.error(f"Error getting current user: {str(e)}")
             return None
 
+    async def _load_users(self, user_ids: List[int]) -> Dict[int, UserResponse]:
+        """Batch function for the user loader: one query for every user requested this tick"""
+        users = await self._storage.find_users(user_ids)
+
+        return {
+            user.id: UserResponse(
+                id=user.id,
+                email=user.email,
+                name=user.name,
+                created_at=user.createdAt.isoformat(),
+                updated_at=user.updatedAt.isoformat()
+            )
+            for user in users
+        }
+
 
 # Global service instance
 auth_service = AuthService()
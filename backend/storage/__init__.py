@@ -0,0 +1,25 @@
+"""
+Pluggable storage behind the chat and auth services
+
+STORAGE_ENGINE selects the implementation the global services use:
+"prisma" (the SQLite database, default) or "memory" (indexed in-memory
+structures, for benchmarks and simulations; nothing is persisted).
+"""
+from backend.config.settings import settings
+from backend.storage.base import DuplicateKeyError, Storage
+
+
+def create_storage(engine: str) -> Storage:
+    if engine == "memory":
+        from backend.storage.memory_store import MemoryStorage
+        return MemoryStorage()
+    if engine == "prisma":
+        from backend.storage.prisma_store import PrismaStorage
+        return PrismaStorage()
+    raise ValueError(f"Unknown storage engine: {engine}")
+
+
+# Global storage instance
+storage = create_storage(settings.storage_engine)
+
+__all__ = ["DuplicateKeyError", "Storage", "create_storage", "storage"]
@@ -0,0 +1,225 @@
+"""
+Storage interface of the chat and auth services
+
+ChatService and AuthService keep their business rules (member caching,
+listeners, partitions, the archive, tokens and passwords) and reach the
+database only through these methods. Records have the attribute names of the
+Prisma models: `user.createdAt`, `conversation.users`, `message.seq`, ...
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+class DuplicateKeyError(Exception):
+    """A unique field (user email, conversation member hash) is already taken"""
+
+
+class Storage(ABC):
+    """Users, conversations, messages, read pointers and attachments"""
+
+    async def connect(self):
+        """Open connections. Call during startup."""
+
+    async def disconnect(self):
+        """Close connections. Call during shutdown."""
+
+    async def warm(self) -> Dict[str, int]:
+        """Load the indexes requests use most into the page cache; returns entries read per index"""
+        return {}
+
+    # Users
+
+    @abstractmethod
+    async def find_user(self, user_id: int):
+        """User by ID, or None"""
+
+    @abstractmethod
+    async def find_user_by_email(self, email: str):
+        """User by email, or None"""
+
+    @abstractmethod
+    async def find_users(self, user_ids: List[int]) -> List:
+        """Existing users among `user_ids`, ordered by ID"""
+
+    @abstractmethod
+    async def list_users(self) -> List:
+        """Every user"""
+
+    @abstractmethod
+    async def create_user(self, email: str, name: Optional[str], password: Optional[str]):
+        """
+        Store a new user
+
+        Raises:
+            DuplicateKeyError: If the email is taken
+        """
+
+    @abstractmethod
+    async def set_password(self, user_id: int, password: str):
+        """Replace a user's password hash; a missing user is ignored"""
+
+    # Conversations
+
+    @abstractmethod
+    async def find_conversation(self, conversation_id: str):
+        """Conversation record without members or messages, or None"""
+
+    @abstractmethod
+    async def find_conversation_by_hash(self, member_hash: str):
+        """Conversation owning a member-set hash, or None"""
+
+    @abstractmethod
+    async def create_conversation(
+        self,
+        user_ids: Iterable[int],
+        member_hash: Optional[str],
+        conversation_id: Optional[str] = None,
+        name: Optional[str] = None
+    ):
+        """
+        Store a new conversation
+
+        Raises:
+            DuplicateKeyError: If another conversation owns `member_hash`
+        """
+
+    @abstractmethod
+    async def load_conversations(self, conversation_ids: List[str], with_messages: bool = True) -> List:
+        """
+        Conversations with their users and, unless `with_messages` is False, their
+        messages in seq order with the sender attached; missing IDs are skipped
+        """
+
+    @abstractmethod
+    async def user_conversations(self, user_id: int, with_messages: bool = True) -> List:
+        """A user's conversations with their users and, unless `with_messages` is False, their messages newest first (without senders)"""
+
+    @abstractmethod
+    async def load_members(self, conversation_ids: List[str]) -> Dict[str, FrozenSet[int]]:
+        """conversation_id -> member IDs; missing IDs are skipped"""
+
+    @abstractmethod
+    async def conversation_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        """Conversation IDs greater than `after`, ascending"""
+
+    @abstractmethod
+    async def retention_overrides(self) -> Dict[str, int]:
+        """conversation_id -> retentionDays, for conversations that set it"""
+
+    @abstractmethod
+    async def set_retention(self, conversation_id: str, days: Optional[int]):
+        """Set (or with None, clear) a conversation's retentionDays; returns the record"""
+
+    # Messages; the method names match MessagePartitions
+
+    @abstractmethod
+    async def create_message(self, conversation_id: str, sender_id: int, content: str):
+        """
+        Store a message with the conversation's next seq, in one transaction
+
+        Raises:
+            ValueError: If the conversation does not exist
+        """
+
+    @abstractmethod
+    async def create_messages(self, sender_id: int, messages: List[Tuple[str, str]]) -> List:
+        """
+        Store (conversation_id, content) pairs in one transaction, consecutive seqs per conversation
+
+        Returns:
+            List: Stored messages, in input order
+
+        Raises:
+            ValueError: If a conversation does not exist (nothing is stored)
+        """
+
+    @abstractmethod
+    async def insert_messages(self, rows: List[tuple], skip_existing: bool = False) -> int:
+        """
+        Bulk-insert (id, content, senderId, conversationId, seq, createdAt, updatedAt) rows
+        (timestamps in epoch milliseconds) and raise each conversation's lastSeq to match
+
+        Rows whose (conversationId, seq) already exists are skipped with `skip_existing`,
+        and fail the whole batch without it.
+
+        Returns:
+            int: Number of rows inserted
+
+        Raises:
+            DuplicateKeyError: If a row already exists and `skip_existing` is False (nothing is inserted)
+        """
+
+    @abstractmethod
+    async def messages_since(self, conversation_id: str, since_seq: int = 0, limit: Optional[int] = None) -> List:
+        """Messages with seq greater than `since_seq`, oldest first"""
+
+    @abstractmethod
+    async def messages_older_than(self, cutoff: datetime, limit: int, exclude: List[str]) -> List:
+        """Messages created before `cutoff`, ordered by conversation and seq, skipping `exclude`d conversations"""
+
+    @abstractmethod
+    async def newest_seq_before(self, conversation_id: str, cutoff: datetime) -> int:
+        """Highest seq of a message created before `cutoff` (0 if none)"""
+
+    @abstractmethod
+    async def purge_through(self, conversation_id: str, seq: int, limit: int) -> int:
+        """Delete at most `limit` of the oldest messages with seq <= `seq`; returns the count"""
+
+    @abstractmethod
+    async def delete_through(self, conversation_id: str, seq: int) -> int:
+        """Delete every message with seq <= `seq`; returns the count"""
+
+    @abstractmethod
+    async def last_seq(self, conversation_id: str) -> int:
+        """Highest seq allocated in a conversation (0 if none)"""
+
+    async def reclaim_space(self, pages: int) -> int:
+        """Return up to `pages` free pages to the filesystem; returns the number freed"""
+        return 0
+
+    # Read pointers
+
+    @abstractmethod
+    async def read_pointers(self, user_id: int) -> Dict[str, int]:
+        """conversation_id -> last read seq, for one user"""
+
+    @abstractmethod
+    async def read_pointers_for(self, user_ids: List[int], conversation_ids: List[str]) -> Dict[Tuple[int, str], int]:
+        """(user_id, conversation_id) -> last read seq, for every stored pair among the given users and conversations"""
+
+    @abstractmethod
+    async def save_read_pointers(self, rows: List[Tuple[int, str, int]]):
+        """Upsert (user_id, conversation_id, seq) pointers in one transaction; pointers never move back"""
+
+    # Attachments
+
+    @abstractmethod
+    async def create_attachment(
+        self,
+        sha256: str,
+        size: int,
+        content_type: str,
+        filename: str,
+        uploader_id: int,
+        conversation_id: str
+    ):
+        """Record a finished upload; the file itself lives under ATTACHMENT_DIR"""
+
+    @abstractmethod
+    async def find_attachment(self, attachment_id: str):
+        """Attachment by ID, or None"""
+
+    @abstractmethod
+    async def attachments_older_than(
+        self, cutoff: datetime, limit: int, conversation_id: Optional[str] = None, exclude: List[str] = ()
+    ) -> List:
+        """Attachments created before `cutoff`, in one conversation or all but the `exclude`d ones"""
+
+    @abstractmethod
+    async def delete_attachments(self, attachment_ids: List[str]) -> int:
+        """Delete attachment rows; returns the count"""
+
+    @abstractmethod
+    async def attachment_content_in_use(self, sha256: str) -> bool:
+        """Whether any attachment row still references this content"""
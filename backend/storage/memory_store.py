@@ -0,0 +1,406 @@
+"""
+In-memory storage
+
+Same semantics as PrismaStorage (unique emails and member hashes, per-conversation
+seqs, pydantic records shaped like prisma.models) with everything held in
+indexed Python structures, for benchmarks and simulations of the service layers without a
+generated Prisma client or a database file. Nothing survives a restart.
+
+Every method runs without awaiting, so on the event loop each call is atomic,
+like a transaction. Reads return fresh record objects, as Prisma does, so
+callers may modify them.
+"""
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+from pydantic import BaseModel
+from backend.conversation.partitions import from_millis, new_message_id, now_millis
+from backend.storage.base import DuplicateKeyError, Storage
+
+
+class UserRecord(BaseModel):
+    """Mirrors prisma.models.User"""
+    id: int
+    email: str
+    name: Optional[str] = None
+    password: Optional[str] = None
+    createdAt: datetime
+    updatedAt: datetime
+
+
+class MessageRecord(BaseModel):
+    """Mirrors prisma.models.Message"""
+    id: str
+    content: str
+    senderId: int
+    conversationId: str
+    seq: int
+    createdAt: datetime
+    updatedAt: datetime
+    sender: Optional[UserRecord] = None
+
+
+class ConversationRecord(BaseModel):
+    """Mirrors prisma.models.Conversation; relations are None unless loaded"""
+    id: str
+    name: Optional[str] = None
+    lastSeq: int = 0
+    memberHash: Optional[str] = None
+    retentionDays: Optional[int] = None
+    users: Optional[List[UserRecord]] = None
+    messages: Optional[List[MessageRecord]] = None
+
+
+class AttachmentRecord(BaseModel):
+    """Mirrors prisma.models.Attachment"""
+    id: str
+    sha256: str
+    size: int
+    contentType: str
+    filename: str
+    uploaderId: int
+    conversationId: str
+    createdAt: datetime
+
+
+def _message(row: tuple) -> MessageRecord:
+    message_id, content, sender_id, conversation_id, seq, created_at, updated_at = row
+    # Built without validation: rows are only ever written by this module
+    return MessageRecord.model_construct(
+        id=message_id, content=content, senderId=sender_id, conversationId=conversation_id, seq=seq,
+        createdAt=from_millis(created_at), updatedAt=from_millis(updated_at), sender=None
+    )
+
+
+class _History:
+    """A conversation's messages as (id, content, senderId, conversationId, seq, createdAt, updatedAt) rows, by seq"""
+    __slots__ = ("seqs", "rows")
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.rows: List[tuple] = []
+
+
+class MemoryStorage(Storage):
+    """Indexed in-memory storage"""
+
+    def __init__(self):
+        self._users: Dict[int, UserRecord] = {}
+        self._user_ids_by_email: Dict[str, int] = {}
+        self._next_user_id = 1
+        self._conversations: Dict[str, ConversationRecord] = {}
+        # Every conversation ID, sorted, for paging
+        self._sorted_conversation_ids: List[str] = []
+        self._conversation_ids_by_hash: Dict[str, str] = {}
+        self._members: Dict[str, FrozenSet[int]] = {}
+        # user_id -> conversation IDs in creation order (dict as an ordered set)
+        self._user_conversations: Dict[int, Dict[str, None]] = {}
+        self._histories: Dict[str, _History] = {}
+        # user_id -> {conversation_id: last read seq}
+        self._read_pointers: Dict[int, Dict[str, int]] = {}
+        self._attachments: Dict[str, AttachmentRecord] = {}
+
+    # Users
+
+    async def find_user(self, user_id: int):
+        user = self._users.get(user_id)
+        return user.model_copy() if user else None
+
+    async def find_user_by_email(self, email: str):
+        user_id = self._user_ids_by_email.get(email)
+        return await self.find_user(user_id) if user_id is not None else None
+
+    async def find_users(self, user_ids: List[int]) -> List:
+        return [self._users[user_id].model_copy() for user_id in sorted(set(user_ids)) if user_id in self._users]
+
+    async def list_users(self) -> List:
+        return [user.model_copy() for user in self._users.values()]
+
+    async def create_user(self, email: str, name: Optional[str], password: Optional[str]):
+        if email in self._user_ids_by_email:
+            raise DuplicateKeyError(email)
+        now = from_millis(now_millis())
+        user = UserRecord.model_construct(
+            id=self._next_user_id, email=email, name=name, password=password, createdAt=now, updatedAt=now
+        )
+        self._next_user_id += 1
+        self._users[user.id] = user
+        self._user_ids_by_email[email] = user.id
+        return user.model_copy()
+
+    async def set_password(self, user_id: int, password: str):
+        user = self._users.get(user_id)
+        if user is None:
+            return None
+        user.password = password
+        user.updatedAt = from_millis(now_millis())
+
+    # Conversations
+
+    async def find_conversation(self, conversation_id: str):
+        conversation = self._conversations.get(conversation_id)
+        return conversation.model_copy() if conversation else None
+
+    async def find_conversation_by_hash(self, member_hash: str):
+        conversation_id = self._conversation_ids_by_hash.get(member_hash)
+        return await self.find_conversation(conversation_id) if conversation_id is not None else None
+
+    async def create_conversation(
+        self,
+        user_ids: Iterable[int],
+        member_hash: Optional[str],
+        conversation_id: Optional[str] = None,
+        name: Optional[str] = None
+    ):
+        members = frozenset(user_ids)
+        if member_hash is not None and member_hash in self._conversation_ids_by_hash:
+            raise DuplicateKeyError(member_hash)
+        conversation_id = conversation_id or new_message_id()
+        if conversation_id in self._conversations:
+            raise DuplicateKeyError(conversation_id)
+        for user_id in members:
+            if user_id not in self._users:
+                raise ValueError(f"User {user_id} not found")
+
+        conversation = ConversationRecord.model_construct(
+            id=conversation_id, name=name, lastSeq=0, memberHash=member_hash, retentionDays=None, users=None, messages=None
+        )
+        self._conversations[conversation_id] = conversation
+        insort(self._sorted_conversation_ids, conversation_id)
+        if member_hash is not None:
+            self._conversation_ids_by_hash[member_hash] = conversation_id
+        self._members[conversation_id] = members
+        for user_id in members:
+            self._user_conversations.setdefault(user_id, {})[conversation_id] = None
+        return conversation.model_copy()
+
+    async def load_conversations(self, conversation_ids: List[str], with_messages: bool = True) -> List:
+        return [
+            self._full_conversation(conversation_id, with_messages, newest_first=False, with_senders=True)
+            for conversation_id in dict.fromkeys(conversation_ids) if conversation_id in self._conversations
+        ]
+
+    async def user_conversations(self, user_id: int, with_messages: bool = True) -> List:
+        return [
+            self._full_conversation(conversation_id, with_messages, newest_first=True, with_senders=False)
+            for conversation_id in self._user_conversations.get(user_id, ())
+        ]
+
+    async def load_members(self, conversation_ids: List[str]) -> Dict[str, FrozenSet[int]]:
+        return {
+            conversation_id: self._members[conversation_id]
+            for conversation_id in conversation_ids if conversation_id in self._members
+        }
+
+    async def conversation_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        ids = self._sorted_conversation_ids
+        start = bisect_right(ids, after) if after else 0
+        return ids[start:start + limit]
+
+    async def retention_overrides(self) -> Dict[str, int]:
+        return {
+            conversation.id: conversation.retentionDays
+            for conversation in self._conversations.values() if conversation.retentionDays is not None
+        }
+
+    async def set_retention(self, conversation_id: str, days: Optional[int]):
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return None
+        conversation.retentionDays = days
+        return conversation.model_copy()
+
+    # Messages
+
+    async def create_message(self, conversation_id: str, sender_id: int, content: str):
+        [message] = await self.create_messages(sender_id, [(conversation_id, content)])
+        return message
+
+    async def create_messages(self, sender_id: int, messages: List[Tuple[str, str]]) -> List:
+        for conversation_id, _ in messages:
+            if conversation_id not in self._conversations:
+                raise ValueError(f"Conversation {conversation_id} not found")
+        if sender_id not in self._users:
+            raise ValueError(f"User {sender_id} not found")
+
+        now = now_millis()
+        created = []
+        for conversation_id, content in messages:
+            conversation = self._conversations[conversation_id]
+            conversation.lastSeq += 1
+            row = (new_message_id(), content, sender_id, conversation_id, conversation.lastSeq, now, now)
+            self._insert(row)
+            created.append(_message(row))
+        return created
+
+    async def insert_messages(self, rows: List[tuple], skip_existing: bool = False) -> int:
+        batch: Dict[Tuple[str, int], tuple] = {}
+        for row in rows:
+            key = (row[3], row[4])
+            if self._has_seq(*key) or key in batch:
+                if not skip_existing:
+                    raise DuplicateKeyError(f"{key[0]}/{key[1]}")
+                continue
+            if row[3] not in self._conversations:
+                raise ValueError(f"Conversation {row[3]} not found")
+            batch[key] = row
+
+        for row in batch.values():
+            self._insert(row)
+            conversation = self._conversations[row[3]]
+            conversation.lastSeq = max(conversation.lastSeq, row[4])
+        return len(batch)
+
+    async def messages_since(self, conversation_id: str, since_seq: int = 0, limit: Optional[int] = None) -> List:
+        history = self._histories.get(conversation_id)
+        if history is None:
+            return []
+        start = bisect_right(history.seqs, since_seq)
+        end = len(history.rows) if limit is None else start + limit
+        return [_message(row) for row in history.rows[start:end]]
+
+    async def messages_older_than(self, cutoff: datetime, limit: int, exclude: List[str]) -> List:
+        cutoff_ms = int(cutoff.timestamp() * 1000)
+        excluded = set(exclude)
+        result = []
+        for conversation_id in sorted(self._histories):
+            if conversation_id in excluded:
+                continue
+            for row in self._histories[conversation_id].rows:
+                if row[5] < cutoff_ms:
+                    result.append(_message(row))
+                    if len(result) == limit:
+                        return result
+        return result
+
+    async def newest_seq_before(self, conversation_id: str, cutoff: datetime) -> int:
+        cutoff_ms = int(cutoff.timestamp() * 1000)
+        history = self._histories.get(conversation_id)
+        for row in reversed(history.rows if history else ()):
+            if row[5] < cutoff_ms:
+                return row[4]
+        return 0
+
+    async def purge_through(self, conversation_id: str, seq: int, limit: int) -> int:
+        return self._delete_through(conversation_id, seq, limit)
+
+    async def delete_through(self, conversation_id: str, seq: int) -> int:
+        return self._delete_through(conversation_id, seq)
+
+    async def last_seq(self, conversation_id: str) -> int:
+        conversation = self._conversations.get(conversation_id)
+        return conversation.lastSeq if conversation else 0
+
+    # Read pointers
+
+    async def read_pointers(self, user_id: int) -> Dict[str, int]:
+        return dict(self._read_pointers.get(user_id, ()))
+
+    async def read_pointers_for(self, user_ids: List[int], conversation_ids: List[str]) -> Dict[Tuple[int, str], int]:
+        return {
+            (user_id, conversation_id): seq
+            for user_id in user_ids
+            for conversation_id, seq in self._read_pointers.get(user_id, {}).items()
+            if conversation_id in conversation_ids
+        }
+
+    async def save_read_pointers(self, rows: List[Tuple[int, str, int]]):
+        for user_id, conversation_id, seq in rows:
+            pointers = self._read_pointers.setdefault(user_id, {})
+            pointers[conversation_id] = max(seq, pointers.get(conversation_id, 0))
+
+    # Attachments
+
+    async def create_attachment(
+        self,
+        sha256: str,
+        size: int,
+        content_type: str,
+        filename: str,
+        uploader_id: int,
+        conversation_id: str
+    ):
+        if conversation_id not in self._conversations:
+            raise ValueError(f"Conversation {conversation_id} not found")
+        if uploader_id not in self._users:
+            raise ValueError(f"User {uploader_id} not found")
+        attachment = AttachmentRecord.model_construct(
+            id=new_message_id(), sha256=sha256, size=size, contentType=content_type, filename=filename,
+            uploaderId=uploader_id, conversationId=conversation_id, createdAt=from_millis(now_millis())
+        )
+        self._attachments[attachment.id] = attachment
+        return attachment.model_copy()
+
+    async def find_attachment(self, attachment_id: str):
+        attachment = self._attachments.get(attachment_id)
+        return attachment.model_copy() if attachment else None
+
+    async def attachments_older_than(
+        self, cutoff: datetime, limit: int, conversation_id: Optional[str] = None, exclude: List[str] = ()
+    ) -> List:
+        excluded = set(exclude)
+        old = sorted(
+            (
+                attachment for attachment in self._attachments.values()
+                if attachment.createdAt < cutoff
+                and (attachment.conversationId == conversation_id if conversation_id is not None
+                     else attachment.conversationId not in excluded)
+            ),
+            key=lambda attachment: attachment.createdAt
+        )
+        return [attachment.model_copy() for attachment in old[:limit]]
+
+    async def delete_attachments(self, attachment_ids: List[str]) -> int:
+        return sum(self._attachments.pop(attachment_id, None) is not None for attachment_id in attachment_ids)
+
+    async def attachment_content_in_use(self, sha256: str) -> bool:
+        return any(attachment.sha256 == sha256 for attachment in self._attachments.values())
+
+    def _full_conversation(
+        self, conversation_id: str, with_messages: bool, newest_first: bool, with_senders: bool
+    ) -> ConversationRecord:
+        users = {user_id: self._users[user_id].model_copy() for user_id in sorted(self._members[conversation_id])}
+        messages = None
+        if with_messages:
+            history = self._histories.get(conversation_id)
+            rows = history.rows if history else []
+            messages = [_message(row) for row in (reversed(rows) if newest_first else rows)]
+            if with_senders:
+                for message in messages:
+                    message.sender = users.get(message.senderId)
+        return self._conversations[conversation_id].model_copy(
+            update={"users": list(users.values()), "messages": messages}
+        )
+
+    def _has_seq(self, conversation_id: str, seq: int) -> bool:
+        history = self._histories.get(conversation_id)
+        if history is None:
+            return False
+        index = bisect_left(history.seqs, seq)
+        return index < len(history.seqs) and history.seqs[index] == seq
+
+    def _insert(self, row: tuple):
+        history = self._histories.get(row[3])
+        if history is None:
+            history = self._histories[row[3]] = _History()
+        seq = row[4]
+        if not history.seqs or history.seqs[-1] < seq:
+            history.seqs.append(seq)
+            history.rows.append(row)
+        else:
+            index = bisect_left(history.seqs, seq)
+            history.seqs.insert(index, seq)
+            history.rows.insert(index, row)
+
+    def _delete_through(self, conversation_id: str, seq: int, limit: Optional[int] = None) -> int:
+        history = self._histories.get(conversation_id)
+        if history is None:
+            return 0
+        count = bisect_right(history.seqs, seq)
+        if limit is not None:
+            count = min(count, limit)
+        del history.seqs[:count]
+        del history.rows[:count]
+        if not history.rows:
+            del self._histories[conversation_id]
+        return count
@@ -0,0 +1,368 @@
+"""
+Prisma storage: the SQLite database behind prisma/schema.prisma
+"""
+from datetime import datetime, timezone
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+from prisma.errors import UniqueViolationError
+from backend.conversation.partitions import from_millis, new_message_id
+from backend.storage.base import DuplicateKeyError, Storage
+from backend.utils.database import disconnect_database, get_database, get_db_session
+
+# Three bound parameters per row keeps each statement under SQLite's variable limit
+ROWS_PER_STATEMENT = 300
+# (table, index) read by warm(): sign-in, membership checks, inbox listing, history paging, read pointers
+HOT_INDEXES = [
+    ("User", "User_email_key"),
+    ("Conversation", "Conversation_memberHash_key"),
+    ("_ConversationUsers", "_ConversationUsers_AB_unique"),
+    ("_ConversationUsers", "_ConversationUsers_B_index"),
+    ("Message", "Message_conversationId_seq_key"),
+    ("ReadState", "sqlite_autoindex_ReadState_1"),
+]
+
+
+class PrismaStorage(Storage):
+    """Storage in the main database, through the shared Prisma client"""
+
+    async def connect(self):
+        await get_database()
+
+    async def disconnect(self):
+        await disconnect_database()
+
+    async def warm(self) -> Dict[str, int]:
+        entries = {}
+        async with get_db_session() as db:
+            for table, index in HOT_INDEXES:
+                # A count through the index reads every one of its pages and nothing else
+                [row] = await db.query_raw(f'SELECT count(*) AS "entries" FROM "{table}" INDEXED BY "{index}"')
+                entries[index] = row["entries"]
+        return entries
+
+    # Users
+
+    async def find_user(self, user_id: int):
+        async with get_db_session() as db:
+            return await db.user.find_unique(where={"id": user_id})
+
+    async def find_user_by_email(self, email: str):
+        async with get_db_session() as db:
+            return await db.user.find_unique(where={"email": email})
+
+    async def find_users(self, user_ids: List[int]) -> List:
+        async with get_db_session() as db:
+            return await db.user.find_many(where={"id": {"in": user_ids}}, order={"id": "asc"})
+
+    async def list_users(self) -> List:
+        async with get_db_session() as db:
+            return await db.user.find_many()
+
+    async def create_user(self, email: str, name: Optional[str], password: Optional[str]):
+        async with get_db_session() as db:
+            try:
+                return await db.user.create(data={"email": email, "name": name, "password": password})
+            except UniqueViolationError as e:
+                raise DuplicateKeyError(email) from e
+
+    async def set_password(self, user_id: int, password: str):
+        async with get_db_session() as db:
+            await db.user.update(where={"id": user_id}, data={"password": password})
+
+    # Conversations
+
+    async def find_conversation(self, conversation_id: str):
+        async with get_db_session() as db:
+            return await db.conversation.find_unique(where={"id": conversation_id})
+
+    async def find_conversation_by_hash(self, member_hash: str):
+        async with get_db_session() as db:
+            return await db.conversation.find_unique(where={"memberHash": member_hash})
+
+    async def create_conversation(
+        self,
+        user_ids: Iterable[int],
+        member_hash: Optional[str],
+        conversation_id: Optional[str] = None,
+        name: Optional[str] = None
+    ):
+        data = {"memberHash": member_hash, "users": {"connect": [{"id": uid} for uid in user_ids]}}
+        if conversation_id is not None:
+            data.update(id=conversation_id, name=name)
+        async with get_db_session() as db:
+            try:
+                return await db.conversation.create(data=data)
+            except UniqueViolationError as e:
+                raise DuplicateKeyError(member_hash) from e
+
+    async def load_conversations(self, conversation_ids: List[str], with_messages: bool = True) -> List:
+        include = {"users": True}
+        if with_messages:
+            include["messages"] = {"include": {"sender": True}}
+        async with get_db_session() as db:
+            return await db.conversation.find_many(where={"id": {"in": conversation_ids}}, include=include)
+
+    async def user_conversations(self, user_id: int, with_messages: bool = True) -> List:
+        include = {"users": True}
+        if with_messages:
+            include["messages"] = {"orderBy": {"createdAt": "desc"}}
+        async with get_db_session() as db:
+            return await db.conversation.find_many(where={"users": {"some": {"id": user_id}}}, include=include)
+
+    async def load_members(self, conversation_ids: List[str]) -> Dict[str, FrozenSet[int]]:
+        conversations = await self.load_conversations(conversation_ids, with_messages=False)
+        return {
+            conversation.id: frozenset(user.id for user in conversation.users or ())
+            for conversation in conversations
+        }
+
+    async def conversation_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        async with get_db_session() as db:
+            conversations = await db.conversation.find_many(
+                where={"id": {"gt": after}} if after else None,
+                order={"id": "asc"},
+                take=limit
+            )
+        return [conversation.id for conversation in conversations]
+
+    async def retention_overrides(self) -> Dict[str, int]:
+        async with get_db_session() as db:
+            conversations = await db.conversation.find_many(where={"retentionDays": {"not": None}})
+        return {conversation.id: conversation.retentionDays for conversation in conversations}
+
+    async def set_retention(self, conversation_id: str, days: Optional[int]):
+        async with get_db_session() as db:
+            return await db.conversation.update(where={"id": conversation_id}, data={"retentionDays": days})
+
+    # Messages
+
+    async def create_message(self, conversation_id: str, sender_id: int, content: str):
+        async with get_db_session() as db:
+            # Allocate the next per-conversation sequence number in the same transaction
+            async with db.tx() as tx:
+                conversation = await tx.conversation.update(
+                    where={"id": conversation_id},
+                    data={"lastSeq": {"increment": 1}}
+                )
+                if conversation is None:
+                    raise ValueError(f"Conversation {conversation_id} not found")
+                return await tx.message.create(
+                    data={
+                        "content": content,
+                        "seq": conversation.lastSeq,
+                        "sender": {"connect": {"id": sender_id}},
+                        "conversation": {"connect": {"id": conversation_id}}
+                    }
+                )
+
+    async def create_messages(self, sender_id: int, messages: List[Tuple[str, str]]) -> List:
+        counts: Dict[str, int] = {}
+        for conversation_id, _ in messages:
+            counts[conversation_id] = counts.get(conversation_id, 0) + 1
+
+        async with get_db_session() as db:
+            async with db.tx() as tx:
+                # Reserve a block of seqs per conversation, then insert every row at once
+                next_seqs: Dict[str, int] = {}
+                for conversation_id, count in counts.items():
+                    conversation = await tx.conversation.update(
+                        where={"id": conversation_id},
+                        data={"lastSeq": {"increment": count}}
+                    )
+                    if conversation is None:
+                        raise ValueError(f"Conversation {conversation_id} not found")
+                    next_seqs[conversation_id] = conversation.lastSeq - count + 1
+                now = datetime.now(timezone.utc)
+                rows = []
+                for conversation_id, content in messages:
+                    rows.append({
+                        "id": new_message_id(),
+                        "content": content,
+                        "senderId": sender_id,
+                        "conversationId": conversation_id,
+                        "seq": next_seqs[conversation_id],
+                        "createdAt": now,
+                        "updatedAt": now,
+                    })
+                    next_seqs[conversation_id] += 1
+                await tx.message.create_many(data=rows)
+                stored = await tx.message.find_many(where={"id": {"in": [row["id"] for row in rows]}})
+        by_id = {message.id: message for message in stored}
+        return [by_id[row["id"]] for row in rows]
+
+    async def insert_messages(self, rows: List[tuple], skip_existing: bool = False) -> int:
+        async with get_db_session() as db:
+            if skip_existing:
+                seqs: Dict[str, List[int]] = {}
+                for row in rows:
+                    seqs.setdefault(row[3], []).append(row[4])
+                existing = await db.message.find_many(where={"OR": [
+                    {"conversationId": conversation_id, "seq": {"in": conversation_seqs}}
+                    for conversation_id, conversation_seqs in seqs.items()
+                ]})
+                present = {(message.conversationId, message.seq) for message in existing}
+                rows = [row for row in rows if (row[3], row[4]) not in present]
+                if not rows:
+                    return 0
+
+            last_seqs: Dict[str, int] = {}
+            for row in rows:
+                last_seqs[row[3]] = max(row[4], last_seqs.get(row[3], 0))
+            try:
+                async with db.tx() as tx:
+                    inserted = await tx.message.create_many(data=[
+                        {
+                            "id": message_id,
+                            "content": content,
+                            "senderId": sender_id,
+                            "conversationId": conversation_id,
+                            "seq": seq,
+                            "createdAt": from_millis(created_at),
+                            "updatedAt": from_millis(updated_at),
+                        }
+                        for message_id, content, sender_id, conversation_id, seq, created_at, updated_at in rows
+                    ])
+                    for conversation_id, seq in last_seqs.items():
+                        await tx.execute_raw(
+                            'UPDATE "Conversation" SET "lastSeq" = max("lastSeq", ?) WHERE "id" = ?',
+                            seq, conversation_id
+                        )
+            except UniqueViolationError as e:
+                raise DuplicateKeyError(f"Message already exists: {e}") from e
+        return inserted
+
+    async def messages_since(self, conversation_id: str, since_seq: int = 0, limit: Optional[int] = None) -> List:
+        async with get_db_session() as db:
+            return await db.message.find_many(
+                where={"conversationId": conversation_id, "seq": {"gt": since_seq}},
+                order={"seq": "asc"},
+                take=limit
+            )
+
+    async def messages_older_than(self, cutoff: datetime, limit: int, exclude: List[str]) -> List:
+        where = {"createdAt": {"lt": cutoff}}
+        if exclude:
+            where["conversationId"] = {"not_in": exclude}
+        async with get_db_session() as db:
+            return await db.message.find_many(
+                where=where,
+                order=[{"conversationId": "asc"}, {"seq": "asc"}],
+                take=limit
+            )
+
+    async def newest_seq_before(self, conversation_id: str, cutoff: datetime) -> int:
+        async with get_db_session() as db:
+            message = await db.message.find_first(
+                where={"conversationId": conversation_id, "createdAt": {"lt": cutoff}},
+                order={"seq": "desc"}
+            )
+        return message.seq if message else 0
+
+    async def purge_through(self, conversation_id: str, seq: int, limit: int) -> int:
+        async with get_db_session() as db:
+            messages = await db.message.find_many(
+                where={"conversationId": conversation_id, "seq": {"lte": seq}},
+                order={"seq": "asc"},
+                take=limit
+            )
+            if not messages:
+                return 0
+            return await db.message.delete_many(where={"id": {"in": [message.id for message in messages]}})
+
+    async def delete_through(self, conversation_id: str, seq: int) -> int:
+        async with get_db_session() as db:
+            return await db.message.delete_many(
+                where={"conversationId": conversation_id, "seq": {"lte": seq}}
+            )
+
+    async def last_seq(self, conversation_id: str) -> int:
+        conversation = await self.find_conversation(conversation_id)
+        return conversation.lastSeq if conversation else 0
+
+    async def reclaim_space(self, pages: int) -> int:
+        # Only databases in auto_vacuum=INCREMENTAL mode are vacuumed
+        async with get_db_session() as db:
+            [mode] = await db.query_raw("PRAGMA auto_vacuum")
+            if mode["auto_vacuum"] != 2:
+                return 0
+            [before] = await db.query_raw("PRAGMA freelist_count")
+            if not before["freelist_count"]:
+                return 0
+            await db.query_raw(f"PRAGMA incremental_vacuum({int(pages)})")
+            [after] = await db.query_raw("PRAGMA freelist_count")
+        return before["freelist_count"] - after["freelist_count"]
+
+    # Read pointers
+
+    async def read_pointers(self, user_id: int) -> Dict[str, int]:
+        async with get_db_session() as db:
+            states = await db.readstate.find_many(where={"userId": user_id})
+        return {state.conversationId: state.lastReadSeq for state in states}
+
+    async def read_pointers_for(self, user_ids: List[int], conversation_ids: List[str]) -> Dict[Tuple[int, str], int]:
+        if not user_ids or not conversation_ids:
+            return {}
+        async with get_db_session() as db:
+            states = await db.readstate.find_many(
+                where={"userId": {"in": user_ids}, "conversationId": {"in": conversation_ids}}
+            )
+        return {(state.userId, state.conversationId): state.lastReadSeq for state in states}
+
+    async def save_read_pointers(self, rows: List[Tuple[int, str, int]]):
+        async with get_db_session() as db:
+            async with db.tx() as tx:
+                for start in range(0, len(rows), ROWS_PER_STATEMENT):
+                    chunk = rows[start:start + ROWS_PER_STATEMENT]
+                    placeholders = ", ".join(["(?, ?, ?)"] * len(chunk))
+                    await tx.execute_raw(
+                        'INSERT INTO "ReadState" ("userId", "conversationId", "lastReadSeq") '
+                        f"VALUES {placeholders} "
+                        'ON CONFLICT ("userId", "conversationId") '
+                        'DO UPDATE SET "lastReadSeq" = max("lastReadSeq", excluded."lastReadSeq")',
+                        *[value for row in chunk for value in row]
+                    )
+
+    # Attachments
+
+    async def create_attachment(
+        self,
+        sha256: str,
+        size: int,
+        content_type: str,
+        filename: str,
+        uploader_id: int,
+        conversation_id: str
+    ):
+        async with get_db_session() as db:
+            return await db.attachment.create(data={
+                "sha256": sha256,
+                "size": size,
+                "contentType": content_type,
+                "filename": filename,
+                "uploader": {"connect": {"id": uploader_id}},
+                "conversation": {"connect": {"id": conversation_id}},
+            })
+
+    async def find_attachment(self, attachment_id: str):
+        async with get_db_session() as db:
+            return await db.attachment.find_unique(where={"id": attachment_id})
+
+    async def attachments_older_than(
+        self, cutoff: datetime, limit: int, conversation_id: Optional[str] = None, exclude: List[str] = ()
+    ) -> List:
+        where = {"createdAt": {"lt": cutoff}}
+        if conversation_id is not None:
+            where["conversationId"] = conversation_id
+        elif exclude:
+            where["conversationId"] = {"not_in": list(exclude)}
+        async with get_db_session() as db:
+            return await db.attachment.find_many(where=where, order={"createdAt": "asc"}, take=limit)
+
+    async def delete_attachments(self, attachment_ids: List[str]) -> int:
+        if not attachment_ids:
+            return 0
+        async with get_db_session() as db:
+            return await db.attachment.delete_many(where={"id": {"in": attachment_ids}})
+
+    async def attachment_content_in_use(self, sha256: str) -> bool:
+        async with get_db_session() as db:
+            return await db.attachment.find_first(where={"sha256": sha256}) is not None
@@ -0,0 +1,409 @@
+"""
+Online backups of the SQLite databases
+
+Copies the main database and every message partition with the SQLite online
+backup API while the application keeps running. Pages are copied
+BACKUP_STEP_PAGES at a time with a short pause between steps. The databases
+run in WAL mode (see DATABASE_WAL), where the copy reads one snapshot and
+`add_message` writes are never blocked or cause a restart; the WAL just
+cannot be checkpointed past the snapshot until the copy finishes.
+
+Each snapshot is gzip-compressed in fixed-size chunks (constant memory) and
+the uncompressed copy removed. A backup is a directory
+
+    backup-20251019-140000/
+        manifest.json           sizes, SHA-256, row counts, timings
+        main.db.gz
+        messages-000-of-004.db.gz ...
+
+written as `*.partial` and renamed once complete, so a directory without the
+suffix is always a finished backup. Archive files (ARCHIVE_DIR) are plain
+files; back them up with file-level tools.
+
+Run a backup or check that one restores cleanly:
+
+    python -m backend.utils.backup create
+    python -m backend.utils.backup verify prisma/backups/backup-20251019-140000
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import alog
+from backend.config.settings import settings
+from backend.conversation.partitions import database_path
+
+CHUNK_SIZE = 1 << 20
+# Restarts tolerated at one step size before the step size is quadrupled
+MAX_RESTARTS = 3
+HISTORY_SIZE = 20
+
+
+class BackupInProgress(Exception):
+    """A backup is already running"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_files() -> List[Tuple[str, Path]]:
+    """(name, path) of every database to back up: the main database, then the partitions"""
+    files = [("main.db", database_path(settings.database_url))]
+    partition_dir = Path(settings.message_partition_dir)
+    if settings.message_partitions > 0 and partition_dir.is_dir():
+        files += [(path.name, path) for path in sorted(partition_dir.glob("messages-*-of-*.db"))]
+    return files
+
+
+def copy_database(source: Path, target: Path, step_pages: int, pause: float) -> Tuple[int, int]:
+    """
+    Copy a live database with the online backup API
+
+    In WAL mode the copy runs inside a read transaction: it sees one
+    consistent snapshot while writers keep appending to the WAL, so it never
+    restarts. In rollback-journal mode no lock is held between steps; a write
+    from another connection then restarts the copy, and the step size grows
+    whenever that keeps happening.
+
+    Args:
+        source: Database to copy
+        target: New file receiving the copy
+        step_pages: Pages per step
+        pause: Seconds to sleep between steps
+
+    Returns:
+        Tuple[int, int]: (pages copied, restarts caused by concurrent writes)
+    """
+    restarts = 0
+    while True:
+        state = {"remaining": None, "restarts": 0}
+
+        def progress(status, remaining, total):
+            # `remaining` only grows when a concurrent write restarted the copy
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+                if state["restarts"] > MAX_RESTARTS and step_pages > 0:
+                    raise _Restarted()
+            state["remaining"] = remaining
+
+        source_conn = sqlite3.connect(str(source), isolation_level=None)
+        target_conn = sqlite3.connect(str(target))
+        try:
+            source_conn.execute("PRAGMA busy_timeout=5000")
+            snapshot = source_conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            if snapshot:
+                source_conn.execute("BEGIN")
+                source_conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            source_conn.backup(target_conn, pages=step_pages, progress=progress, sleep=pause)
+            if snapshot:
+                source_conn.execute("COMMIT")
+            # The copy inherits WAL mode; a single self-contained file restores more easily
+            target_conn.execute("PRAGMA journal_mode=DELETE")
+            pages = target_conn.execute("PRAGMA page_count").fetchone()[0]
+            return pages, restarts + state["restarts"]
+        except _Restarted:
+            restarts += state["restarts"]
+            # Bigger steps finish before the next write gets in; -1 copies everything in one step
+            step_pages = step_pages * 4 if step_pages * 4 < (1 << 20) else -1
+            alog.info(f"Backup of {source.name} kept restarting, retrying with {step_pages} pages per step")
+        finally:
+            target_conn.close()
+            source_conn.close()
+
+
+class _HashingWriter:
+    """File wrapper hashing everything written through it"""
+
+    def __init__(self, out):
+        self.out = out
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.digest.update(data)
+        return self.out.write(data)
+
+    def flush(self):
+        self.out.flush()
+
+
+def compress_file(source: Path, target: Path, level: int) -> Tuple[int, str]:
+    """Gzip a file chunk by chunk, in constant memory; returns the compressed size and its SHA-256"""
+    with open(source, "rb") as raw, open(target, "wb") as out:
+        writer = _HashingWriter(out)
+        with gzip.GzipFile(filename=source.name, mode="wb", compresslevel=level, fileobj=writer, mtime=0) as compressed:
+            shutil.copyfileobj(raw, compressed, CHUNK_SIZE)
+    return target.stat().st_size, writer.digest.hexdigest()
+
+
+def row_counts(path: Path) -> Dict[str, int]:
+    conn = sqlite3.connect(str(path))
+    try:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return {table: conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+
+def verify_backup(directory: Path) -> List[str]:
+    """
+    Restore every file of a backup into a scratch directory and check it
+
+    Checks the SHA-256 of each compressed file, decompresses it, runs
+    `PRAGMA integrity_check` and compares the row counts with the manifest.
+
+    Returns:
+        List[str]: Problems found (empty when the backup is good)
+    """
+    manifest = json.loads((directory / "manifest.json").read_text())
+    problems = []
+    with tempfile.TemporaryDirectory(prefix="chatbox-restore-") as scratch:
+        for entry in manifest["files"]:
+            compressed = directory / entry["file"]
+            digest = hashlib.sha256()
+            with open(compressed, "rb") as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != entry["sha256"]:
+                problems.append(f"{entry['file']}: checksum mismatch")
+                continue
+
+            restored = Path(scratch) / entry["name"]
+            with gzip.open(compressed, "rb") as source, open(restored, "wb") as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+            conn = sqlite3.connect(str(restored))
+            try:
+                result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            except sqlite3.DatabaseError as e:
+                result = str(e)
+            finally:
+                conn.close()
+            if result != "ok":
+                problems.append(f"{entry['name']}: integrity check failed: {result}")
+                continue
+            counts = row_counts(restored)
+            if counts != entry["rows"]:
+                problems.append(f"{entry['name']}: row counts {counts} differ from the manifest {entry['rows']}")
+            restored.unlink()
+    return problems
+
+
+class BackupResult:
+    """Metrics of one finished backup"""
+    __slots__ = ("name", "started_at", "copy_seconds", "compress_seconds", "pages", "restarts",
+                 "raw_bytes", "compressed_bytes", "files")
+
+    def __init__(self, name: str, started_at: datetime):
+        self.name = name
+        self.started_at = started_at
+        self.copy_seconds = 0.0
+        self.compress_seconds = 0.0
+        self.pages = 0
+        self.restarts = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.files: List[dict] = []
+
+    def as_dict(self) -> dict:
+        seconds = self.copy_seconds + self.compress_seconds
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "copy_seconds": round(self.copy_seconds, 3),
+            "compress_seconds": round(self.compress_seconds, 3),
+            "pages": self.pages,
+            "restarts": self.restarts,
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "compression_ratio": round(self.raw_bytes / self.compressed_bytes, 2) if self.compressed_bytes else None,
+            "throughput_mb_s": round(self.raw_bytes / 1e6 / seconds, 1) if seconds else None,
+            "files": self.files,
+        }
+
+
+class DatabaseBackup:
+    """Scheduled and on-demand online backups"""
+
+    def __init__(self):
+        self.directory = Path(settings.backup_dir)
+        self.interval = settings.backup_interval
+        self.keep = settings.backup_keep
+        self.step_pages = settings.backup_step_pages
+        self.pause = settings.backup_step_pause
+        self.level = settings.backup_compress_level
+        self.history: "deque[BackupResult]" = deque(maxlen=HISTORY_SIZE)
+        # Name of the file being copied or compressed while a backup runs
+        self.current: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._triggered: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked() or (self._triggered is not None and not self._triggered.done())
+
+    def trigger(self):
+        """
+        Start a backup in the background (admin endpoint)
+
+        Raises:
+            BackupInProgress: If another backup is running
+        """
+        if self.running:
+            raise BackupInProgress("A backup is already running")
+        self._triggered = asyncio.create_task(self._backup_logged())
+
+    def start(self):
+        """Start scheduled backups (no-op when BACKUP_INTERVAL is 0). Call during startup."""
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop scheduled backups. Call during shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def backup(self) -> BackupResult:
+        """
+        Take a backup now
+
+        Raises:
+            BackupInProgress: If another backup is running
+        """
+        if self._lock.locked():
+            raise BackupInProgress("A backup is already running")
+        async with self._lock:
+            result = await asyncio.to_thread(self._backup)
+            self.history.append(result)
+            await asyncio.to_thread(self._prune)
+        alog.info(
+            f"Backup {result.name}: {result.raw_bytes / 1e6:,.1f} MB -> {result.compressed_bytes / 1e6:,.1f} MB "
+            f"in {result.copy_seconds + result.compress_seconds:.1f}s ({result.restarts} restarts)"
+        )
+        return result
+
+    def list_backups(self) -> List[dict]:
+        """Finished backups on disk, newest first"""
+        backups = []
+        for path in sorted(self.directory.glob("backup-*"), reverse=True):
+            if path.suffix == ".partial" or not (path / "manifest.json").exists():
+                continue
+            manifest = json.loads((path / "manifest.json").read_text())
+            backups.append({
+                "name": path.name,
+                "started_at": manifest["started_at"],
+                "compressed_bytes": sum(entry["compressed_bytes"] for entry in manifest["files"]),
+            })
+        return backups
+
+    def _backup(self) -> BackupResult:
+        started_at = datetime.now(timezone.utc)
+        name = started_at.strftime("backup-%Y%m%d-%H%M%S")
+        result = BackupResult(name, started_at)
+        staging = self.directory / f"{name}.partial"
+        staging.mkdir(parents=True, exist_ok=True)
+        try:
+            for file_name, source in database_files():
+                self.current = file_name
+                snapshot = staging / file_name
+
+                started = time.monotonic()
+                pages, restarts = copy_database(source, snapshot, self.step_pages, self.pause)
+                copy_seconds = time.monotonic() - started
+                raw_bytes = snapshot.stat().st_size
+                rows = row_counts(snapshot)
+
+                started = time.monotonic()
+                compressed_bytes, digest = compress_file(snapshot, staging / f"{file_name}.gz", self.level)
+                compress_seconds = time.monotonic() - started
+                snapshot.unlink()
+
+                result.copy_seconds += copy_seconds
+                result.compress_seconds += compress_seconds
+                result.pages += pages
+                result.restarts += restarts
+                result.raw_bytes += raw_bytes
+                result.compressed_bytes += compressed_bytes
+                result.files.append({
+                    "name": file_name,
+                    "file": f"{file_name}.gz",
+                    "raw_bytes": raw_bytes,
+                    "compressed_bytes": compressed_bytes,
+                    "sha256": digest,
+                    "rows": rows,
+                    "copy_seconds": round(copy_seconds, 3),
+                    "compress_seconds": round(compress_seconds, 3),
+                })
+
+            (staging / "manifest.json").write_text(json.dumps(result.as_dict(), indent=2))
+            staging.rename(self.directory / name)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            self.current = None
+        return result
+
+    def _prune(self):
+        finished = [path for path in sorted(self.directory.glob("backup-*")) if path.suffix != ".partial"]
+        for path in finished[:-self.keep] if self.keep > 0 else []:
+            shutil.rmtree(path, ignore_errors=True)
+
+    async def _backup_logged(self):
+        try:
+            await self.backup()
+        except BackupInProgress:
+            pass
+        except Exception as e:
+            alog.error(f"Backup failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._backup_logged()
+
+
+# Global backup instance
+database_backup = DatabaseBackup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="take a backup now")
+    verify = commands.add_parser("verify", help="restore a backup into a scratch directory and check it")
+    verify.add_argument("directory", type=Path)
+    args = parser.parse_args()
+
+    if args.command == "create":
+        result = asyncio.run(database_backup.backup())
+        print(json.dumps(result.as_dict(), indent=2))
+        print(f"Written to {database_backup.directory / result.name}")
+        return
+
+    problems = verify_backup(args.directory)
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print(f"{args.directory}: OK")
+
+
+if __name__ == "__main__":
+    main()
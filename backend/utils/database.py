@@ -4,6 +4,8 @@ Database connection management utilities
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from prisma import Prisma
+from backend.config.settings import settings
+from backend.utils.query_log import InstrumentedClient, query_log
 import alog
 
 # Global database instance
@@ -23,6 +25,9 @@ async def get_database() -> Prisma:
     if not _db_instance.is_connected():
         await _db_instance.connect()
         alog.info("Database connected")
+        if settings.database_wal:
+            # Persistent: stored in the database file
+            await _db_instance.query_raw("PRAGMA journal_mode=WAL")
     
     return _db_instance
 
@@ -42,8 +47,11 @@ async def get_db_session() -> AsyncGenerator[Prisma, None]:
     """
     Context manager for database operations.
     Use this for operations that need a database session.
+    With QUERY_STATS on, the client times every query (see backend.utils.query_log).
     """
     db = await get_database()
+    if settings.query_stats:
+        db = InstrumentedClient(db, query_log)
     try:
         yield db
     except Exception as e:
@@ -1,14 +1,139 @@
 """
-Email utilities for sending password reset emails
+Email utilities for sending password reset and digest emails
+
+Mail goes through a small pool of logged-in SMTP connections, so a batch of
+messages pays for the connect, STARTTLS and login round trips once instead
+of once per message.
 """
+import html
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional
+from typing import List, Optional, Tuple
 import alog
 from backend.config.settings import settings
 
 
+def mail_configured() -> bool:
+    return all([settings.smtp_server, settings.smtp_username, settings.smtp_password, settings.email_from])
+
+
+def build_message(
+    to_email: str,
+    subject: str,
+    html_content: str,
+    text_content: Optional[str] = None
+) -> MIMEMultipart:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = f"{settings.email_from_name} <{settings.email_from}>"
+    msg["To"] = to_email
+
+    # Add text content if provided
+    if text_content:
+        msg.attach(MIMEText(text_content, "plain"))
+
+    # Add HTML content
+    msg.attach(MIMEText(html_content, "html"))
+    return msg
+
+
+class MailPool:
+    """Reusable SMTP connections; blocking, so call from a thread when on the event loop"""
+
+    def __init__(self, size: int, idle_timeout: float):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # (connection, time it was returned), most recently used last
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+
+    def send(self, messages: List[MIMEMultipart]) -> List[bool]:
+        """
+        Send messages over one pooled connection
+
+        A connection the server dropped is replaced once per message; a
+        message the server refuses fails alone.
+
+        Returns:
+            List[bool]: Whether each message was accepted, in order
+        """
+        results = []
+        server = None
+        try:
+            for index, msg in enumerate(messages):
+                for attempt in range(2):
+                    try:
+                        if server is None:
+                            server = self._acquire()
+                        server.send_message(msg)
+                        results.append(True)
+                        break
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        alog.error(f"Failed to send email to {msg['To']}: {e}")
+                        results.append(False)
+                        break
+                    except (smtplib.SMTPException, OSError) as e:
+                        self._discard(server)
+                        server = None
+                        if attempt:
+                            # Even a fresh connection failed: the server is unreachable, give up on the rest
+                            alog.error(f"Failed to send {len(messages) - index} emails: {e}")
+                            return results + [False] * (len(messages) - index)
+        finally:
+            if server is not None:
+                self._release(server)
+        return results
+
+    def close(self):
+        """Log out of every idle connection. Call during shutdown."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._discard(server)
+
+    def _acquire(self) -> smtplib.SMTP:
+        now = time.monotonic()
+        server = None
+        with self._lock:
+            # Servers drop idle sessions; do not bother trying old ones
+            stale = [idle for idle, returned_at in self._idle if now - returned_at >= self.idle_timeout]
+            self._idle = [(idle, returned_at) for idle, returned_at in self._idle if now - returned_at < self.idle_timeout]
+            if self._idle:
+                server, _ = self._idle.pop()
+        for idle in stale:
+            self._discard(idle)
+        if server is not None:
+            return server
+        server = smtplib.SMTP(settings.smtp_server, settings.smtp_port, timeout=30)
+        if settings.smtp_use_tls:
+            server.starttls()
+        server.login(settings.smtp_username, settings.smtp_password)
+        return server
+
+    def _release(self, server: smtplib.SMTP):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._discard(server)
+
+    @staticmethod
+    def _discard(server: Optional[smtplib.SMTP]):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+
+# Global mail pool
+mail_pool = MailPool(settings.mail_pool_size, settings.mail_pool_idle_timeout)
+
+
 def send_email(
     to_email: str,
     subject: str,
@@ -27,39 +152,14 @@ def send_email(
     Returns:
         bool: True if email was sent successfully, False otherwise
     """
-    if not all([settings.smtp_server, settings.smtp_username, settings.smtp_password, settings.email_from]):
+    if not mail_configured():
         alog.warning("Email configuration is incomplete. Cannot send email.")
         return False
-    
-    try:
-        # Create message
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = f"{settings.email_from_name} <{settings.email_from}>"
-        msg["To"] = to_email
-        
-        # Add text content if provided
-        if text_content:
-            text_part = MIMEText(text_content, "plain")
-            msg.attach(text_part)
-        
-        # Add HTML content
-        html_part = MIMEText(html_content, "html")
-        msg.attach(html_part)
-        
-        # Connect to server and send email
-        with smtplib.SMTP(settings.smtp_server, settings.smtp_port) as server:
-            if settings.smtp_use_tls:
-                server.starttls()
-            server.login(settings.smtp_username, settings.smtp_password)
-            server.send_message(msg)
-        
+
+    [sent] = mail_pool.send([build_message(to_email, subject, html_content, text_content)])
+    if sent:
         alog.info(f"Email sent successfully to {to_email}")
-        return True
-        
-    except Exception as e:
-        alog.error(f"Failed to send email to {to_email}: {str(e)}")
-        return False
+    return sent
 
 
 def send_password_reset_email(email: str, reset_token: str) -> bool:
@@ -138,3 +238,78 @@ def send_password_reset_email(email: str, reset_token: str) -> bool:
     """
     
     return send_email(email, subject, html_content, text_content)
+
+
+def build_digest_email(
+    email: str,
+    name: Optional[str],
+    conversations: List[Tuple[str, int, List[Tuple[str, str]]]]
+) -> MIMEMultipart:
+    """
+    Build the summary of messages a user missed
+
+    Args:
+        email: User's email address
+        name: User's display name
+        conversations: (title, unread message count, [(sender name, preview)]) per conversation
+
+    Returns:
+        MIMEMultipart: The message, ready for MailPool.send
+    """
+    total = sum(count for _, count, _ in conversations)
+    subject = f"{total} new message{'s' if total != 1 else ''} - {settings.app_name}"
+    greeting = f"Hello {name}," if name else "Hello,"
+
+    sections_html = []
+    sections_text = []
+    for title, count, previews in conversations:
+        lines_html = "".join(
+            f'<p style="margin: 4px 0;"><strong>{html.escape(sender)}:</strong> {html.escape(preview)}</p>'
+            for sender, preview in previews
+        )
+        sections_html.append(f"""
+            <div style="border-left: 3px solid #2563eb; padding-left: 12px; margin: 20px 0;">
+                <h3 style="margin: 0 0 8px;">{html.escape(title)} ({count} new)</h3>
+                {lines_html}
+            </div>""")
+        lines_text = "\n".join(f"        {sender}: {preview}" for sender, preview in previews)
+        sections_text.append(f"    {title} ({count} new)\n{lines_text}")
+
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>New messages</title>
+    </head>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+            <h2 style="color: #2563eb;">You have {total} unread message{'s' if total != 1 else ''}</h2>
+
+            <p>{html.escape(greeting)}</p>
+
+            <p>Here is what you missed on {settings.app_name} while you were away:</p>
+            {"".join(sections_html)}
+
+            <hr style="border: none; border-top: 1px solid #eee; margin: 30px 0;">
+            <p style="color: #666; font-size: 12px;">
+                This email was sent by {settings.app_name}.
+                Please do not reply to this email.
+            </p>
+        </div>
+    </body>
+    </html>
+    """
+
+    text_content = f"""
+    {greeting}
+
+    Here is what you missed on {settings.app_name} while you were away:
+
+""" + "\n\n".join(sections_text) + f"""
+
+    ---
+    This email was sent by {settings.app_name}.
+    """
+
+    return build_message(email, subject, html_content, text_content)
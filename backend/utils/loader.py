@@ -0,0 +1,120 @@
+"""
+Request coalescing and batching for database lookups
+
+`BatchLoader` sits in front of a batch function such as
+`find_many(where={"id": {"in": keys}})`:
+
+- identical lookups that are already in flight share one future
+  (singleflight), so N concurrent requests for the same user cost one query;
+- distinct keys requested during the same event-loop tick are collected and
+  fetched together with a single call to the batch function (DataLoader).
+
+Nothing is cached once a batch completes; the loader only merges lookups
+that overlap in time. State is kept per event loop, so a loader created at
+import time is safe to use from any loop.
+"""
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, Set, TypeVar
+import alog
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# Keys per batch call; keeps `IN (...)` lists well under SQLite's variable limit
+MAX_BATCH_SIZE = 500
+
+
+class _LoopState:
+    __slots__ = ("in_flight", "queue", "scheduled", "batches")
+
+    def __init__(self):
+        # key -> future shared by every caller waiting for that key
+        self.in_flight: Dict = {}
+        # keys waiting for the next dispatch, in request order
+        self.queue: List = []
+        self.scheduled = False
+        # Running batch tasks; the loop only keeps weak references to tasks
+        self.batches: Set[asyncio.Task] = set()
+
+
+class BatchLoader(Generic[K, V]):
+    """Coalesces concurrent lookups by key and batches distinct keys"""
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[K]], Awaitable[Dict[K, V]]],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        name: str = "loader"
+    ):
+        """
+        Args:
+            batch_fn: Coroutine taking a list of keys and returning a dict of the
+                keys that were found; missing keys resolve to None
+            max_batch_size: Maximum number of keys passed to one batch_fn call
+            name: Used in log messages
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+    async def load(self, key: K) -> Optional[V]:
+        """
+        Load one record, sharing the query with concurrent callers
+
+        Args:
+            key: Record key
+
+        Returns:
+            Optional[V]: The record, or None if the batch function did not return it
+        """
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState()
+
+        future = state.in_flight.get(key)
+        if future is None:
+            future = state.in_flight[key] = loop.create_future()
+            state.queue.append(key)
+            if not state.scheduled:
+                state.scheduled = True
+                # Runs after every callback that is already ready, i.e. at the end of this tick
+                loop.call_soon(self._dispatch, loop, state)
+        # Shield so a cancelled caller does not cancel the result others wait for
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[K]) -> List[Optional[V]]:
+        """Load several records; results are in the order of `keys`"""
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop, state: _LoopState):
+        keys, state.queue, state.scheduled = state.queue, [], False
+        for start in range(0, len(keys), self.max_batch_size):
+            task = loop.create_task(self._run_batch(state, keys[start:start + self.max_batch_size]))
+            state.batches.add(task)
+            task.add_done_callback(state.batches.discard)
+
+    async def _run_batch(self, state: _LoopState, keys: List[K]):
+        try:
+            results = await self.batch_fn(keys)
+        except Exception as e:
+            alog.error(f"{self.name}: batch of {len(keys)} failed: {e}")
+            for key in keys:
+                future = state.in_flight.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # Cancelled (e.g. loop shutdown): release the waiters rather than hang them
+            for key in keys:
+                future = state.in_flight.pop(key, None)
+                if future is not None and not future.done():
+                    future.cancel()
+            raise
+
+        for key in keys:
+            future = state.in_flight.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(results.get(key))
@@ -0,0 +1,434 @@
+"""
+Query timing, slow-query log and query plans
+
+`get_db_session` hands out an InstrumentedClient that wraps the Prisma
+client: every model action (`db.message.find_many(...)`), raw query and
+transaction is timed and aggregated per query shape, i.e. the model, the
+action and the structure of its arguments with the values left out. Queries
+slower than SLOW_QUERY_MS are logged with their (shortened) arguments and
+the SQLite query plan.
+
+Prisma builds its SQL inside the query engine, so the plan is taken for an
+equivalent statement derived from the arguments here (tables and columns
+follow prisma/schema.prisma; `include`d relations become the separate
+IN (...) lookups Prisma issues for them). `EXPLAIN QUERY PLAN` runs on a
+separate read-only connection, at most once per shape every PLAN_TTL
+seconds, so the log itself never adds load to a slow database.
+"""
+import asyncio
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import alog
+from backend.config.settings import settings
+
+PLAN_TTL = 300
+MAX_SHAPES = 1000
+MAX_LOGGED_STRING = 64
+MAX_LOGGED_ITEMS = 10
+WHITESPACE = re.compile(r"\s+")
+
+# Prisma client attribute -> model (table) name
+MODELS = {
+    "user": "User", "conversation": "Conversation", "message": "Message", "readstate": "ReadState",
+    "attachment": "Attachment",
+}
+
+# model -> relation field -> (kind, related model, columns); "many" relations are joined through a
+# foreign key on the related table, "one" relations through one on this table, "m2m" through a join table
+RELATIONS = {
+    "User": {
+        "conversations": ("m2m", "Conversation", ("_ConversationUsers", "B", "A")),
+        "messages": ("many", "Message", "senderId"),
+        "readStates": ("many", "ReadState", "userId"),
+        "attachments": ("many", "Attachment", "uploaderId"),
+    },
+    "Conversation": {
+        "users": ("m2m", "User", ("_ConversationUsers", "A", "B")),
+        "messages": ("many", "Message", "conversationId"),
+        "readStates": ("many", "ReadState", "conversationId"),
+        "attachments": ("many", "Attachment", "conversationId"),
+    },
+    "Message": {
+        "sender": ("one", "User", "senderId"),
+        "conversation": ("one", "Conversation", "conversationId"),
+    },
+    "ReadState": {
+        "user": ("one", "User", "userId"),
+        "conversation": ("one", "Conversation", "conversationId"),
+    },
+    "Attachment": {
+        "uploader": ("one", "User", "uploaderId"),
+        "conversation": ("one", "Conversation", "conversationId"),
+    },
+}
+
+OPERATORS = {"lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+FILTER_KEYS = {"equals", "in", "not_in", "lt", "lte", "gt", "gte", "not", "contains", "startswith", "endswith", "mode"}
+LOOKUP_ACTIONS = {
+    "find_unique", "find_unique_or_raise", "find_first", "find_first_or_raise", "find_many", "count",
+    "update", "update_many", "delete", "delete_many", "upsert",
+}
+
+
+class PlanUnavailable(Exception):
+    """The arguments use a filter the plan derivation does not know"""
+
+
+def _value(value):
+    # DateTime columns hold epoch milliseconds on SQLite
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _condition(model: str, alias: str, where: dict, params: list) -> str:
+    clauses = []
+    for key, value in where.items():
+        if key in ("AND", "OR"):
+            items = value if isinstance(value, list) else [value]
+            joined = f" {key} ".join(f"({_condition(model, alias, item, params)})" for item in items)
+            clauses.append(f"({joined})" if joined else ("1" if key == "AND" else "0"))
+        elif key == "NOT":
+            items = value if isinstance(value, list) else [value]
+            clauses.extend(f"NOT ({_condition(model, alias, item, params)})" for item in items)
+        elif key in RELATIONS[model]:
+            clauses.append(_relation_condition(model, alias, key, value, params))
+        elif isinstance(value, dict) and value and not set(value) & FILTER_KEYS:
+            # Compound unique key, e.g. userId_conversationId: {userId: 1, conversationId: "..."}
+            clauses.append(_condition(model, alias, value, params))
+        else:
+            clauses.append(_field_condition(f'{alias}."{key}"', value, params))
+    return " AND ".join(clauses) or "1"
+
+
+def _field_condition(column: str, value, params: list) -> str:
+    if not isinstance(value, dict):
+        if value is None:
+            return f"{column} IS NULL"
+        params.append(_value(value))
+        return f"{column} = ?"
+
+    clauses = []
+    for operator, operand in value.items():
+        if operator == "equals":
+            clauses.append(_field_condition(column, operand, params))
+        elif operator in ("in", "not_in"):
+            params.extend(_value(item) for item in operand)
+            negate = "NOT " if operator == "not_in" else ""
+            clauses.append(f"{column} {negate}IN ({', '.join('?' * len(operand))})")
+        elif operator in OPERATORS:
+            params.append(_value(operand))
+            clauses.append(f"{column} {OPERATORS[operator]} ?")
+        elif operator == "not":
+            if operand is None:
+                clauses.append(f"{column} IS NOT NULL")
+            else:
+                clauses.append(f"NOT ({_field_condition(column, operand, params)})")
+        elif operator in ("contains", "startswith", "endswith"):
+            pattern = {"contains": "%{}%", "startswith": "{}%", "endswith": "%{}"}[operator]
+            params.append(pattern.format(operand))
+            clauses.append(f"{column} LIKE ?")
+        elif operator != "mode":
+            raise PlanUnavailable(operator)
+    return " AND ".join(clauses) or "1"
+
+
+def _relation_condition(model: str, alias: str, field: str, value, params: list) -> str:
+    kind, related, columns = RELATIONS[model][field]
+    inner = f"r{len(params)}_{field}"
+    if kind == "one":
+        filters = value if isinstance(value, dict) and set(value) & {"is", "is_not"} else {"is": value}
+        clauses = []
+        for operator, where in filters.items():
+            exists = (
+                f'EXISTS (SELECT 1 FROM "{related}" AS {inner} WHERE {inner}."id" = {alias}."{columns}" '
+                f"AND {_condition(related, inner, where or {}, params)})"
+            )
+            clauses.append(exists if operator == "is" else f"NOT {exists}")
+        return " AND ".join(clauses)
+
+    if kind == "many":
+        source = f'"{related}" AS {inner} WHERE {inner}."{columns}" = {alias}."id"'
+    else:
+        table, own_column, related_column = columns
+        source = (
+            f'"{table}" AS j_{inner} JOIN "{related}" AS {inner} ON {inner}."id" = j_{inner}."{related_column}" '
+            f'WHERE j_{inner}."{own_column}" = {alias}."id"'
+        )
+    clauses = []
+    for operator, where in value.items():
+        if operator == "some":
+            clauses.append(f"EXISTS (SELECT 1 FROM {source} AND {_condition(related, inner, where, params)})")
+        elif operator == "none":
+            clauses.append(f"NOT EXISTS (SELECT 1 FROM {source} AND {_condition(related, inner, where, params)})")
+        elif operator == "every":
+            clauses.append(f"NOT EXISTS (SELECT 1 FROM {source} AND NOT ({_condition(related, inner, where, params)}))")
+        else:
+            raise PlanUnavailable(operator)
+    return " AND ".join(clauses)
+
+
+def _order(alias: str, order) -> str:
+    if not order:
+        return ""
+    items = order if isinstance(order, list) else [order]
+    terms = [f'{alias}."{column}" {direction.upper()}' for item in items for column, direction in item.items()]
+    return " ORDER BY " + ", ".join(terms)
+
+
+def derive_statements(model: str, action: str, args: dict) -> List[Tuple[str, list]]:
+    """
+    SQL statements equivalent to a Prisma model action, for EXPLAIN QUERY PLAN
+
+    Returns:
+        List[Tuple[str, list]]: (sql, params) for the main lookup and every included relation
+
+    Raises:
+        PlanUnavailable: If the action or a filter cannot be translated
+    """
+    if action not in LOOKUP_ACTIONS:
+        raise PlanUnavailable(action)
+    params: list = []
+    sql = f'SELECT * FROM "{model}" AS t WHERE {_condition(model, "t", args.get("where") or {}, params)}'
+    sql += _order("t", args.get("order"))
+    if args.get("take") is not None:
+        sql += f" LIMIT {int(args['take'])}"
+        if args.get("skip"):
+            sql += f" OFFSET {int(args['skip'])}"
+    statements = [(sql, params)]
+    statements += _include_statements(model, args.get("include") or {})
+    return statements
+
+
+def _include_statements(model: str, include: dict) -> List[Tuple[str, list]]:
+    statements = []
+    for field, options in include.items():
+        if not options or field not in RELATIONS[model]:
+            continue
+        options = options if isinstance(options, dict) else {}
+        kind, related, columns = RELATIONS[model][field]
+        params: list = [""]
+        if kind == "one":
+            sql = f'SELECT * FROM "{related}" AS t WHERE t."id" IN (?)'
+        elif kind == "many":
+            sql = f'SELECT * FROM "{related}" AS t WHERE t."{columns}" IN (?)'
+        else:
+            table, own_column, related_column = columns
+            statements.append((f'SELECT * FROM "{table}" WHERE "{own_column}" IN (?)', [""]))
+            sql = f'SELECT * FROM "{related}" AS t WHERE t."id" IN (?)'
+        if options.get("where"):
+            sql += f' AND {_condition(related, "t", options["where"], params)}'
+        sql += _order("t", options.get("orderBy") or options.get("order_by"))
+        statements.append((sql, params))
+        statements += _include_statements(related, options.get("include") or {})
+    return statements
+
+
+def explain(statements: List[Tuple[str, list]]) -> List[str]:
+    """Run EXPLAIN QUERY PLAN for each statement on a read-only connection to the main database"""
+    from backend.conversation.partitions import database_path
+
+    conn = sqlite3.connect(f"file:{database_path(settings.database_url)}?mode=ro", uri=True)
+    try:
+        lines = []
+        for sql, params in statements:
+            lines.append(sql)
+            for _, parent, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+                lines.append(f"  {'  ' if parent else ''}{detail}")
+        return lines
+    finally:
+        conn.close()
+
+
+def _shape(value):
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and isinstance(value[0], dict):
+            return [_shape(value[0])]
+        return "[?]"
+    return "?"
+
+
+def _summarize(value):
+    """Arguments shortened for the log: long strings cut, long lists truncated"""
+    if isinstance(value, dict):
+        return {key: _summarize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [_summarize(item) for item in value[:MAX_LOGGED_ITEMS]]
+        if len(value) > MAX_LOGGED_ITEMS:
+            items.append(f"... {len(value) - MAX_LOGGED_ITEMS} more")
+        return items
+    if isinstance(value, str) and len(value) > MAX_LOGGED_STRING:
+        return value[:MAX_LOGGED_STRING] + "..."
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class ShapeStats:
+    """Aggregated timings of one query shape"""
+    __slots__ = ("shape", "count", "total", "max", "slow", "plan", "plan_at", "sample")
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.plan: Optional[List[str]] = None
+        self.plan_at = 0.0
+        self.sample = None
+
+    def as_dict(self) -> dict:
+        return {
+            "shape": self.shape,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 2),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0,
+            "max_ms": round(self.max * 1000, 2),
+            "slow": self.slow,
+            "plan": self.plan,
+            "sample": self.sample,
+        }
+
+
+class QueryLog:
+    """Per-shape query statistics and the slow-query log"""
+
+    def __init__(self, slow_ms: float = 100, capture_plans: bool = True):
+        self.slow = slow_ms / 1000
+        self.capture_plans = capture_plans
+        self._stats: Dict[str, ShapeStats] = {}
+        self._since = time.time()
+
+    def record(self, model: str, action: str, args: dict, elapsed: float):
+        if model == "raw":
+            shape = "raw " + WHITESPACE.sub(" ", args.get("sql", "")).strip()
+        else:
+            shape = f"{model}.{action} {json.dumps(_shape(args), sort_keys=True)}"
+        stats = self._stats.get(shape)
+        if stats is None:
+            if len(self._stats) >= MAX_SHAPES:
+                shape = "(other shapes)"
+                stats = self._stats.get(shape)
+            if stats is None:
+                stats = self._stats[shape] = ShapeStats(shape)
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        if elapsed < self.slow:
+            return
+
+        stats.slow += 1
+        stats.sample = _summarize(args)
+        alog.warning(f"Slow query {elapsed * 1000:.1f} ms: {model}.{action} {stats.sample}")
+        now = time.monotonic()
+        if self.capture_plans and now - stats.plan_at >= PLAN_TTL:
+            stats.plan_at = now
+            asyncio.get_running_loop().create_task(self._capture_plan(stats, model, action, args))
+
+    def stats(self, sort: str = "total", limit: int = 50) -> dict:
+        rows = sorted(self._stats.values(), key=lambda stats: getattr(stats, sort), reverse=True)
+        return {
+            "since": datetime.fromtimestamp(self._since).astimezone().isoformat(),
+            "slow_query_ms": self.slow * 1000,
+            "shapes": [stats.as_dict() for stats in rows[:limit]],
+        }
+
+    def reset(self):
+        self._stats.clear()
+        self._since = time.time()
+
+    async def _capture_plan(self, stats: ShapeStats, model: str, action: str, args: dict):
+        try:
+            if model == "raw":
+                statements = [(args["sql"], list(args.get("params") or ()))]
+            else:
+                statements = derive_statements(model, action, args)
+            stats.plan = await asyncio.to_thread(explain, statements)
+            alog.warning("Query plan for " + stats.shape + ":\n" + "\n".join(stats.plan))
+        except PlanUnavailable as e:
+            stats.plan = [f"(no plan: cannot translate {e})"]
+        except Exception as e:
+            stats.plan = [f"(no plan: {e})"]
+
+
+class _ModelProxy:
+    """Times every action of one Prisma model"""
+    __slots__ = ("_actions", "_model", "_log")
+
+    def __init__(self, actions, model: str, log: QueryLog):
+        self._actions = actions
+        self._model = model
+        self._log = log
+
+    def __getattr__(self, action: str):
+        method = getattr(self._actions, action)
+        if action.startswith("_") or not callable(method):
+            return method
+        model, log = self._model, self._log
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                log.record(model, action, kwargs, time.perf_counter() - started)
+        return timed
+
+
+class _TransactionProxy:
+    """`async with db.tx() as tx:` yielding an instrumented client; the whole transaction is timed too"""
+
+    def __init__(self, manager, log: QueryLog):
+        self._manager = manager
+        self._log = log
+        self._started = 0.0
+
+    async def __aenter__(self):
+        client = await self._manager.__aenter__()
+        self._started = time.perf_counter()
+        return InstrumentedClient(client, self._log)
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._manager.__aexit__(*exc_info)
+        finally:
+            self._log.record("transaction", "tx", {}, time.perf_counter() - self._started)
+
+
+class InstrumentedClient:
+    """Prisma client wrapper that reports every query to a QueryLog"""
+
+    def __init__(self, client, log: QueryLog):
+        self._client = client
+        self._log = log
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        if name in MODELS:
+            return _ModelProxy(attribute, MODELS[name], self._log)
+        if name in ("query_raw", "query_first", "execute_raw"):
+            log = self._log
+
+            async def timed(sql, *params, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await attribute(sql, *params, **kwargs)
+                finally:
+                    log.record("raw", name, {"sql": sql, "params": list(params)}, time.perf_counter() - started)
+            return timed
+        if name == "tx":
+            return lambda *args, **kwargs: _TransactionProxy(attribute(*args, **kwargs), self._log)
+        return attribute
+
+
+# Global query log
+query_log = QueryLog(settings.slow_query_ms, settings.query_plan_capture)
@@ -0,0 +1,81 @@
+"""
+Hashed timing wheel for scheduling large numbers of coarse deadlines
+"""
+import math
+from typing import Dict, Hashable, List
+
+
+class TimerWheel:
+    """
+    Single-level hashed timing wheel.
+
+    Deadlines are rounded up to whole ticks and bucketed into slots, so
+    scheduling and cancelling are O(1) and advancing the wheel only touches
+    the keys that land in the current slot. Keys further away than one full
+    revolution carry a remaining-rounds counter.
+    """
+
+    def __init__(self, tick: float, slots: int = 64):
+        if tick <= 0:
+            raise ValueError("tick must be positive")
+        if slots <= 0:
+            raise ValueError("slots must be positive")
+
+        self.tick = tick
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._locations: Dict[Hashable, int] = {}
+        self._position = 0
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._locations
+
+    def schedule(self, key: Hashable, delay: float):
+        """
+        Schedule (or reschedule) a key to expire after `delay` seconds
+
+        Args:
+            key: Hashable key identifying the timer
+            delay: Delay in seconds, rounded up to whole ticks
+        """
+        self.cancel(key)
+
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._position + ticks) % len(self._slots)
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._locations[key] = slot
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Cancel a scheduled key
+
+        Returns:
+            bool: True if the key was scheduled
+        """
+        slot = self._locations.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def advance(self) -> List[Hashable]:
+        """
+        Move the wheel forward by one tick
+
+        Returns:
+            List[Hashable]: Keys whose deadline expired on this tick
+        """
+        self._position = (self._position + 1) % len(self._slots)
+        bucket = self._slots[self._position]
+
+        expired = []
+        for key, rounds in list(bucket.items()):
+            if rounds:
+                bucket[key] = rounds - 1
+            else:
+                del bucket[key]
+                del self._locations[key]
+                expired.append(key)
+        return expired
@@ -0,0 +1,129 @@
+"""
+WebSocket wire protocol: JSON text frames or compact binary frames
+
+Clients choose the encoding with the WebSocket subprotocol header:
+
+- `chatbox.json` (or no subprotocol): UTF-8 JSON text frames
+- `chatbox.msgpack`: binary frames made of a one-byte header followed by a
+  MessagePack body. Header 0x00 means the body is stored as-is, 0x01 means
+  it is raw-deflate compressed. Only bodies above the configured threshold
+  are compressed, since short chat messages do not shrink.
+
+Outbound frames are wrapped in `Frame`, which encodes lazily and caches the
+result per encoding, so a broadcast encodes (and compresses) each frame once
+no matter how many recipients it has.
+"""
+import json
+import zlib
+from typing import Any, Iterable, Optional
+import msgpack
+from backend.config.settings import settings
+
+JSON_SUBPROTOCOL = "chatbox.json"
+BINARY_SUBPROTOCOL = "chatbox.msgpack"
+SUBPROTOCOLS = (BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL)
+
+HEADER_PLAIN = 0x00
+HEADER_DEFLATE = 0x01
+# Largest inbound body accepted, after decompression
+MAX_FRAME = 1024 * 1024
+
+
+class WireError(ValueError):
+    """Raised when an inbound frame cannot be decoded"""
+
+
+def negotiate_subprotocol(offered: Iterable[str]) -> Optional[str]:
+    """
+    Pick the subprotocol to accept, preferring the binary encoding
+
+    Args:
+        offered: Subprotocols listed by the client, in its preference order
+
+    Returns:
+        Optional[str]: The accepted subprotocol, or None for plain JSON text
+    """
+    offered = set(offered)
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
+# --- MessagePack -----------------------------------------------------------
+
+def packb(obj: Any) -> bytes:
+    """Encode an object as MessagePack"""
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpackb(data: bytes) -> Any:
+    """
+    Decode a MessagePack document
+
+    Raises:
+        WireError: If the data is malformed, nested too deeply or has trailing bytes
+    """
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise WireError(f"Malformed MessagePack data: {e}") from e
+
+
+# --- Frames ----------------------------------------------------------------
+
+def encode_binary(payload: Any) -> bytes:
+    """Encode a payload as a binary frame, compressing large bodies"""
+    body = packb(payload)
+    if len(body) >= settings.ws_compress_threshold:
+        compressor = zlib.compressobj(settings.ws_compress_level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(body) + compressor.flush()
+        if len(compressed) < len(body):
+            return bytes((HEADER_DEFLATE,)) + compressed
+    return bytes((HEADER_PLAIN,)) + body
+
+
+def decode_binary(data: bytes) -> Any:
+    """
+    Decode a binary frame produced by `encode_binary`
+
+    Raises:
+        WireError: If the frame is malformed or its body is over MAX_FRAME bytes
+    """
+    if not data:
+        raise WireError("Empty frame")
+    header, body = data[0], data[1:]
+    if header == HEADER_DEFLATE:
+        # Inflate at most MAX_FRAME bytes, so a small frame cannot expand into a huge one
+        decompressor = zlib.decompressobj(-15)
+        try:
+            body = decompressor.decompress(body, MAX_FRAME)
+        except zlib.error as e:
+            raise WireError("Corrupt compressed frame") from e
+        if decompressor.unconsumed_tail:
+            raise WireError(f"Frames are limited to {MAX_FRAME} bytes")
+    elif header != HEADER_PLAIN:
+        raise WireError(f"Unknown frame header 0x{header:02x}")
+    if len(body) > MAX_FRAME:
+        raise WireError(f"Frames are limited to {MAX_FRAME} bytes")
+    return unpackb(body)
+
+
+class Frame:
+    """An outbound frame, encoded at most once per wire format"""
+    __slots__ = ("payload", "_text", "_binary")
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.payload, separators=(",", ":"))
+        return self._text
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = encode_binary(self.payload)
+        return self._binary
@@ -0,0 +1,157 @@
+"""
+Startup warmup and readiness
+
+Right after startup the first requests would pay for cold caches: the
+database and partition page caches, passlib's bcrypt backend detection, the
+first JWT encode, pydantic's first validations and serializations, and empty
+member caches. The warmup job does all of that once, in the background, and
+GET /ready answers 503 until it has finished, so a load balancer only shifts
+traffic over to warm instances.
+
+Import time of the application is reported too. For a per-module breakdown:
+
+    python -m backend.warmup imports [--top N]
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+import alog
+from backend.config.settings import settings
+from backend.conversation.chat import MEMBER_CACHE_SIZE, chat_service
+from backend.schemas.auth import AuthResponse, TokenResponse, UserResponse
+from backend.utils.security import (
+    create_access_token,
+    create_refresh_token,
+    get_password_hash,
+    verify_password,
+    verify_token
+)
+
+
+class Warmup:
+    """Runs the warmup steps once and tracks readiness"""
+
+    def __init__(self):
+        self.enabled = settings.warmup
+        self.conversations = min(settings.warmup_conversations, MEMBER_CACHE_SIZE)
+        self.import_seconds: Optional[float] = None
+        self.ready = False
+        self.error: Optional[str] = None
+        # step -> seconds taken
+        self.timings: Dict[str, float] = {}
+        # index -> entries read into the page cache
+        self.entries: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, import_seconds: Optional[float] = None):
+        """Start warming up in the background. Call during startup, after the database is connected."""
+        self.import_seconds = import_seconds
+        if import_seconds is not None:
+            alog.info(f"Application imported in {import_seconds * 1000:.0f} ms")
+        if not self.enabled:
+            self.ready = True
+        elif self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Cancel a warmup still in progress. Call during shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        started = time.perf_counter()
+        try:
+            self.entries = await self._step("page cache and member cache", chat_service.warm(self.conversations))
+            await self._step("bcrypt", asyncio.to_thread(_warm_bcrypt))
+            await self._step("jwt", asyncio.to_thread(_warm_jwt))
+            await self._step("pydantic", asyncio.to_thread(_warm_pydantic))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Serve anyway: a failed warmup only means slower first requests
+            self.error = str(e)
+            alog.error(f"Warmup failed: {e}")
+        self.ready = True
+        steps = ", ".join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in self.timings.items())
+        alog.info(f"Warmup finished in {(time.perf_counter() - started) * 1000:.0f} ms ({steps})")
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "warming up",
+            "import_ms": round(self.import_seconds * 1000, 1) if self.import_seconds is not None else None,
+            "warmup_ms": {step: round(seconds * 1000, 1) for step, seconds in self.timings.items()},
+            "cached_entries": self.entries,
+            "error": self.error,
+        }
+
+    async def _step(self, name: str, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+
+def _warm_bcrypt():
+    # The first hash makes passlib load and self-test the bcrypt backend
+    verify_password("warmup", get_password_hash("warmup"))
+
+
+def _warm_jwt():
+    data = {"sub": "0", "email": "warmup@localhost"}
+    verify_token(create_access_token(data=data), "access")
+    verify_token(create_refresh_token(data=data), "refresh")
+
+
+def _warm_pydantic():
+    now = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+    user = UserResponse(id=0, email="warmup@localhost", name=None, created_at=now, updated_at=now)
+    response = AuthResponse(user=user, tokens=TokenResponse(access_token="", refresh_token=""))
+    AuthResponse.model_validate_json(response.model_dump_json())
+
+
+# Global warmup instance
+warmup = Warmup()
+
+
+def import_times(top: int):
+    """Print the modules that take longest to import when loading the application"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if own.isdigit():  # skips the header line
+            rows.append((int(cumulative), int(own), name))
+    if result.returncode:
+        print(result.stderr.splitlines()[-1] if result.stderr else "import failed", file=sys.stderr)
+    total = next((cumulative for cumulative, _, name in rows if name == "backend.main"), 0)
+    print(f"import backend.main: {total / 1000:,.0f} ms\n")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative, own, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>14,.1f} {own / 1000:>8,.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    imports = commands.add_parser("imports", help="report the slowest imports of the application")
+    imports.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+    import_times(args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+/*
+  Warnings:
+
+  - Added the required column `seq` to the `Message` table. Existing rows are numbered per conversation in `createdAt` order.
+
+*/
+-- RedefineTables
+PRAGMA defer_foreign_keys=ON;
+PRAGMA foreign_keys=OFF;
+CREATE TABLE "new_Conversation" (
+    "id" TEXT NOT NULL PRIMARY KEY,
+    "name" TEXT,
+    "lastSeq" INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO "new_Conversation" ("id", "name", "lastSeq") SELECT "id", "name", (SELECT COUNT(*) FROM "Message" WHERE "Message"."conversationId" = "Conversation"."id") FROM "Conversation";
+DROP TABLE "Conversation";
+ALTER TABLE "new_Conversation" RENAME TO "Conversation";
+CREATE TABLE "new_Message" (
+    "id" TEXT NOT NULL PRIMARY KEY,
+    "content" TEXT NOT NULL,
+    "senderId" INTEGER NOT NULL,
+    "conversationId" TEXT NOT NULL,
+    "seq" INTEGER NOT NULL,
+    "createdAt" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" DATETIME NOT NULL,
+    CONSTRAINT "Message_senderId_fkey" FOREIGN KEY ("senderId") REFERENCES "User" ("id") ON DELETE RESTRICT ON UPDATE CASCADE,
+    CONSTRAINT "Message_conversationId_fkey" FOREIGN KEY ("conversationId") REFERENCES "Conversation" ("id") ON DELETE RESTRICT ON UPDATE CASCADE
+);
+INSERT INTO "new_Message" ("content", "conversationId", "createdAt", "id", "senderId", "seq", "updatedAt") SELECT "content", "conversationId", "createdAt", "id", "senderId", ROW_NUMBER() OVER (PARTITION BY "conversationId" ORDER BY "createdAt", "id"), "updatedAt" FROM "Message";
+DROP TABLE "Message";
+ALTER TABLE "new_Message" RENAME TO "Message";
+CREATE UNIQUE INDEX "Message_conversationId_seq_key" ON "Message"("conversationId", "seq");
+PRAGMA foreign_keys=ON;
+PRAGMA defer_foreign_keys=OFF;
@@ -0,0 +1,13 @@
+-- CreateTable
+CREATE TABLE "ReadState" (
+    "userId" INTEGER NOT NULL,
+    "conversationId" TEXT NOT NULL,
+    "lastReadSeq" INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY ("userId", "conversationId"),
+    CONSTRAINT "ReadState_userId_fkey" FOREIGN KEY ("userId") REFERENCES "User" ("id") ON DELETE CASCADE ON UPDATE CASCADE,
+    CONSTRAINT "ReadState_conversationId_fkey" FOREIGN KEY ("conversationId") REFERENCES "Conversation" ("id") ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- CreateIndex
+CREATE INDEX "ReadState_conversationId_idx" ON "ReadState"("conversationId");
@@ -0,0 +1,5 @@
+-- AlterTable
+ALTER TABLE "Conversation" ADD COLUMN "memberHash" TEXT;
+
+-- CreateIndex
+CREATE UNIQUE INDEX "Conversation_memberHash_key" ON "Conversation"("memberHash");
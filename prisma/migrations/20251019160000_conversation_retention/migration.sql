@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "Conversation" ADD COLUMN "retentionDays" INTEGER;
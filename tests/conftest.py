@@ -0,0 +1,34 @@
+import os
+import tempfile
+import pytest
+
+# Settings are read at import time; tests never touch a real database or mail server
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("STORAGE_ENGINE", "memory")
+os.environ.setdefault("DIGEST_WINDOW", "0")
+# Whatever the services write goes to a scratch directory, never into prisma/
+_scratch = tempfile.mkdtemp(prefix="chat-tests-")
+for _name in ("ANALYTICS_DIR", "ARCHIVE_DIR", "ATTACHMENT_DIR", "BACKUP_DIR", "MESSAGE_PARTITION_DIR"):
+    os.environ.setdefault(_name, os.path.join(_scratch, _name.lower()))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The application with its lifespan running; shared, since the global services bind to its event loop"""
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def signup(client):
+    """Create a user and return (user_id, access_token)"""
+    def create(name: str):
+        body = client.post(
+            "/api/auth/signup",
+            json={"email": f"{name}-{os.urandom(4).hex()}@example.com", "password": "Passw0rd!x", "name": name}
+        ).json()
+        return body["user"]["id"], body["tokens"]["access_token"]
+    return create
@@ -0,0 +1,165 @@
+import asyncio
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pytest
+from backend.conversation import analytics
+from backend.conversation.analytics import ColumnarSnapshot, ConversationAnalytics, activity_report
+from backend.conversation.chat import ChatService
+from backend.storage.memory_store import MemoryStorage
+
+UNTIL = datetime(2025, 3, 31, 12, tzinfo=timezone.utc)
+
+
+def random_snapshot(rows=3000, seed=7):
+    generator = random.Random(seed)
+    snapshot = ColumnarSnapshot(capacity=16)
+    start = int((UNTIL - timedelta(days=40)).timestamp())
+    for _ in range(rows):
+        code = snapshot.code(f"c{int(generator.paretovariate(1.2)) % 30}")
+        snapshot.append(code, generator.randint(1, 60), start + generator.randint(0, 41 * 86_400))
+    return snapshot
+
+
+def expected_report(snapshot, days, offset_minutes, conversation_code=None):
+    """The same aggregates, one message at a time"""
+    last = (UNTIL + timedelta(minutes=offset_minutes)).date()
+    first = last - timedelta(days=days - 1)
+    per_day, by_hour, by_weekday_hour = Counter(), Counter(), Counter()
+    senders_per_day, conversations = defaultdict(set), Counter()
+    for timestamp, sender, code in zip(*(column.tolist() for column in snapshot.columns())):
+        local = datetime.fromtimestamp(timestamp, timezone.utc) + timedelta(minutes=offset_minutes)
+        if not first <= local.date() <= last or conversation_code not in (None, code):
+            continue
+        per_day[local.date()] += 1
+        by_hour[local.hour] += 1
+        by_weekday_hour[local.weekday(), local.hour] += 1
+        senders_per_day[local.date()].add(sender)
+        conversations[code] += 1
+    dates = [first + timedelta(days=index) for index in range(days)]
+    return {
+        "days": [date.isoformat() for date in dates],
+        "messages": sum(per_day.values()),
+        "messages_per_day": [per_day[date] for date in dates],
+        "active_users": [len(senders_per_day[date]) for date in dates],
+        "active_total": len(set().union(*senders_per_day.values())),
+        "by_hour": [by_hour[hour] for hour in range(24)],
+        "by_weekday_hour": [[by_weekday_hour[weekday, hour] for hour in range(24)] for weekday in range(7)],
+        "conversation_totals": conversations,
+    }
+
+
+@pytest.mark.parametrize("days, offset_minutes", [(1, 0), (7, 0), (30, 330), (30, -480)])
+@pytest.mark.parametrize("bitmap", [True, False], ids=["bitmap", "sorted"])
+def test_report_matches_a_row_by_row_count(monkeypatch, days, offset_minutes, bitmap):
+    if not bitmap:
+        monkeypatch.setattr(analytics, "MAX_BITMAP", 0)
+    snapshot = random_snapshot()
+    report = activity_report(snapshot.columns(), snapshot.conversation_ids, days, UNTIL, offset_minutes, top=5)
+    expected = expected_report(snapshot, days, offset_minutes)
+
+    assert report["days"] == expected["days"]
+    assert report["messages"] == expected["messages"] > 0
+    assert report["messages_per_day"] == expected["messages_per_day"]
+    assert report["active_users"] == {"total": expected["active_total"], "per_day": expected["active_users"]}
+    assert report["peak_hours"]["by_hour"] == expected["by_hour"]
+    assert report["peak_hours"]["by_weekday_hour"] == expected["by_weekday_hour"]
+    busiest = [(entry["conversation_id"], entry["messages"]) for entry in report["top_conversations"]]
+    assert [count for _, count in busiest] == [count for _, count in expected["conversation_totals"].most_common(5)]
+    for entry in report["top_conversations"]:
+        code = snapshot.find_code(entry["conversation_id"])
+        assert entry["messages_per_day"] == expected_report(snapshot, days, offset_minutes, code)["messages_per_day"]
+
+
+def test_an_empty_window():
+    snapshot = ColumnarSnapshot()
+    report = activity_report(snapshot.columns(), [], 3, UNTIL)
+    assert report["messages"] == 0 and report["messages_per_day"] == [0, 0, 0]
+    assert report["active_users"] == {"total": 0, "per_day": [0, 0, 0]}
+    assert report["peak_hours"]["peak_hour"] is None and report["top_conversations"] == []
+
+
+def test_snapshot_grows_and_survives_a_save(tmp_path):
+    snapshot = random_snapshot(rows=1000)
+    snapshot.last_seqs[0] = 42
+    views = snapshot.columns()
+    snapshot.append(snapshot.code("late"), 1, 1)
+    # Views taken before an append are unchanged by it
+    assert len(views[0]) == 1000
+
+    snapshot.save(tmp_path / "messages.npz")
+    loaded = ColumnarSnapshot.load(tmp_path / "messages.npz")
+    for before, after in zip(snapshot.columns(), loaded.columns()):
+        assert np.array_equal(before, after)
+    assert loaded.conversation_ids == snapshot.conversation_ids and loaded.last_seqs == snapshot.last_seqs
+    assert loaded.find_code("late") == snapshot.find_code("late")
+    assert not list(tmp_path.glob("*.tmp*"))
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    storage = MemoryStorage()
+    asyncio.run(storage.create_user("u1@example.com", None, None))
+    service = ChatService(storage)
+    monkeypatch.setattr(analytics, "chat_service", service)
+    monkeypatch.setattr(analytics.settings, "analytics", True)
+    monkeypatch.setattr(analytics.settings, "analytics_dir", str(tmp_path))
+    return service
+
+
+async def import_messages(service, conversation_id, seqs):
+    await service.ensure_conversation(conversation_id, [1])
+    millis = int((UNTIL - timedelta(hours=1)).timestamp() * 1000)
+    await service.import_messages([(f"{conversation_id}-{seq}", "hi", 1, conversation_id, seq, millis, millis) for seq in seqs])
+
+
+async def caught_up(instance):
+    instance.start()
+    await instance._catch_up_task
+    return await instance.report(1, until=UNTIL)
+
+
+def test_restarts_only_read_messages_after_the_saved_snapshot(service):
+    async def main():
+        await import_messages(service, "c1", range(1, 11))
+        first = ConversationAnalytics()
+        assert (await caught_up(first))["messages"] == 10
+        await first.stop()
+
+        await import_messages(service, "c1", range(11, 16))
+        await import_messages(service, "c2", range(1, 4))
+        second = ConversationAnalytics()
+        read = []
+        original = service.iter_messages
+
+        async def iter_messages(conversation_id, since_seq=0, batch_size=1000):
+            read.append((conversation_id, since_seq))
+            async for batch in original(conversation_id, since_seq, batch_size):
+                yield batch
+        service.iter_messages = iter_messages
+
+        report = await caught_up(second)
+        assert read == [("c1", 10), ("c2", 0)]
+        assert report["messages"] == 18 and report["snapshot"] == {"rows": 18, "building": False}
+        assert (await second.report(1, until=UNTIL, conversation_id="c2"))["messages"] == 3
+        assert (await second.report(1, until=UNTIL, conversation_id="unknown"))["messages"] == 0
+        await second.stop()
+    asyncio.run(main())
+
+
+def test_messages_arriving_during_the_catch_up_are_counted_once(service):
+    async def main():
+        await import_messages(service, "c1", range(1, 6))
+        instance = ConversationAnalytics()
+        instance.start()
+        assert instance.building
+        # Stored and announced before the catch-up has read that far
+        await import_messages(service, "c1", [6])
+        for message in await service.get_messages_since("c1", 4):
+            await instance.record(message, frozenset({1}))
+        await instance._catch_up_task
+        assert not instance.building
+        assert (await instance.report(1, until=UNTIL))["messages"] == 6
+        await instance.stop()
+    asyncio.run(main())
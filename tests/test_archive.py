@@ -0,0 +1,164 @@
+import os
+import pytest
+from backend.conversation import archive as archive_module
+from backend.conversation.archive import BLOCK_MESSAGES, INDEX_ENTRY, MessageArchive
+from backend.conversation.partitions import PartitionMessage
+
+CONVERSATION = "c1"
+BASE_MILLIS = 1_700_000_000_000
+
+
+def messages(first, last):
+    return [
+        PartitionMessage(f"m{seq}", f"message {seq}", seq % 3, CONVERSATION, seq, BASE_MILLIS + seq, BASE_MILLIS + seq)
+        for seq in range(first, last + 1)
+    ]
+
+
+def seqs(archived):
+    return [message.seq for message in archived]
+
+
+def reopen(directory):
+    """A fresh instance, as after a restart: nothing cached, everything read from disk"""
+    return MessageArchive(directory)
+
+
+def test_round_trip(tmp_path):
+    archive = MessageArchive(tmp_path)
+    assert archive.append(CONVERSATION, messages(1, 200)) == 200
+    # Rows already archived by an interrupted run are skipped
+    assert archive.append(CONVERSATION, messages(150, 300)) == 300
+    archive.close()
+
+    for instance in (archive, reopen(tmp_path)):
+        assert instance.last_seq(CONVERSATION) == 300
+        assert seqs(instance.read_since(CONVERSATION, 0)) == list(range(1, 301))
+        # Cursors in the middle of a block, on a block boundary and at the end
+        assert seqs(instance.read_since(CONVERSATION, 150, limit=10)) == list(range(151, 161))
+        assert seqs(instance.read_since(CONVERSATION, BLOCK_MESSAGES)) == list(range(BLOCK_MESSAGES + 1, 301))
+        assert instance.read_since(CONVERSATION, 300) == []
+        first = instance.read_since(CONVERSATION, 41, limit=1)[0]
+        assert (first.id, first.content, first.senderId) == ("m42", "message 42", 0)
+        assert int(first.createdAt.timestamp() * 1000) == BASE_MILLIS + 42
+        assert instance.newest_seq_before(CONVERSATION, BASE_MILLIS + 180) == 179
+        assert instance.newest_seq_before(CONVERSATION, BASE_MILLIS) == 0
+        instance.close()
+    assert reopen(tmp_path).conversation_ids() == [CONVERSATION]
+
+
+def test_torn_tail_is_ignored_then_truncated(tmp_path):
+    archive = MessageArchive(tmp_path)
+    archive.append(CONVERSATION, messages(1, 10))
+    archive.close()
+    segment, index = tmp_path / f"{CONVERSATION}.seg", tmp_path / f"{CONVERSATION}.idx"
+    segment_size = segment.stat().st_size
+    # A crash mid-append: block bytes without their entry, and half an entry
+    with open(segment, "ab") as out:
+        out.write(b"torn block")
+    with open(index, "ab") as out:
+        out.write(INDEX_ENTRY.pack(11, 20, segment_size, 999)[:INDEX_ENTRY.size // 2])
+
+    archive = reopen(tmp_path)
+    assert archive.last_seq(CONVERSATION) == 10
+    assert seqs(archive.read_since(CONVERSATION, 0)) == list(range(1, 11))
+    assert archive.append(CONVERSATION, messages(11, 15)) == 15
+    archive.close()
+
+    assert seqs(reopen(tmp_path).read_since(CONVERSATION, 0)) == list(range(1, 16))
+    assert index.stat().st_size == 2 * INDEX_ENTRY.size
+    assert b"torn block" not in segment.read_bytes()
+
+
+def test_entry_past_the_segment_end_is_dropped(tmp_path):
+    archive = MessageArchive(tmp_path)
+    archive.append(CONVERSATION, messages(1, 10))
+    archive.close()
+    segment = tmp_path / f"{CONVERSATION}.seg"
+    with open(tmp_path / f"{CONVERSATION}.idx", "ab") as out:
+        out.write(INDEX_ENTRY.pack(11, 20, segment.stat().st_size, 100))
+
+    assert reopen(tmp_path).last_seq(CONVERSATION) == 10
+
+
+def test_purge_through_a_straddling_block(tmp_path):
+    archive = MessageArchive(tmp_path)
+    archive.append(CONVERSATION, messages(1, 300))
+    assert archive.purge_through(CONVERSATION, 0) == 0
+    # 200 falls inside the second block; its later rows survive, re-encoded
+    assert archive.purge_through(CONVERSATION, 200) == 200
+    assert archive.purge_through(CONVERSATION, 150) == 0
+    archive.close()
+
+    for instance in (archive, reopen(tmp_path)):
+        assert seqs(instance.read_since(CONVERSATION, 0)) == list(range(201, 301))
+        assert seqs(instance.read_since(CONVERSATION, 250, limit=3)) == [251, 252, 253]
+        assert instance.last_seq(CONVERSATION) == 300
+        instance.close()
+    assert not list(tmp_path.glob("*.new"))
+
+    archive = reopen(tmp_path)
+    assert archive.purge_through(CONVERSATION, 300) == 100
+    assert archive.last_seq(CONVERSATION) == 0
+    assert archive.conversation_ids() == []
+    assert not list(tmp_path.iterdir())
+
+
+def crash_at_replace(monkeypatch, call):
+    """Make the `call`-th os.replace of the archive module fail, as if the process died there"""
+    calls = []
+    real_replace = os.replace
+
+    def replace(source, target):
+        calls.append(source)
+        if len(calls) == call:
+            raise KeyboardInterrupt("crash")
+        real_replace(source, target)
+    monkeypatch.setattr(archive_module.os, "replace", replace)
+
+
+@pytest.mark.parametrize("call, survivors", [
+    (1, range(1, 301)),    # Before any rename: the purge is rolled back
+    (2, range(201, 301)),  # Between the renames: the purge is completed
+])
+def test_recovery_from_an_interrupted_purge(tmp_path, monkeypatch, call, survivors):
+    archive = MessageArchive(tmp_path)
+    archive.append(CONVERSATION, messages(1, 300))
+    crash_at_replace(monkeypatch, call)
+    with pytest.raises(KeyboardInterrupt):
+        archive.purge_through(CONVERSATION, 200)
+    archive.close()
+    monkeypatch.undo()
+
+    archive = reopen(tmp_path)
+    assert seqs(archive.read_since(CONVERSATION, 0)) == list(survivors)
+    assert not list(tmp_path.glob("*.new"))
+    # And the archive keeps working afterwards
+    assert archive.append(CONVERSATION, messages(301, 310)) == 310
+    assert seqs(reopen(tmp_path).read_since(CONVERSATION, 295)) == list(range(296, 311))
+
+
+def test_recovery_from_a_purge_interrupted_before_its_index(tmp_path):
+    archive = MessageArchive(tmp_path)
+    archive.append(CONVERSATION, messages(1, 20))
+    archive.close()
+    # The new segment was being written when the process died
+    (tmp_path / f"{CONVERSATION}.seg.new").write_bytes(b"partial")
+
+    archive = reopen(tmp_path)
+    assert seqs(archive.read_since(CONVERSATION, 0)) == list(range(1, 21))
+    assert not list(tmp_path.glob("*.new"))
+
+
+def test_recovery_from_a_purge_interrupted_between_deletes(tmp_path):
+    archive = MessageArchive(tmp_path)
+    archive.append(CONVERSATION, messages(1, 20))
+    archive.close()
+    # Purging everything deletes the index first; the segment alone means nothing is archived
+    (tmp_path / f"{CONVERSATION}.idx").unlink()
+
+    archive = reopen(tmp_path)
+    assert archive.last_seq(CONVERSATION) == 0
+    assert archive.read_since(CONVERSATION, 0) == []
+    assert archive.append(CONVERSATION, messages(30, 31)) == 31
+    assert seqs(reopen(tmp_path).read_since(CONVERSATION, 0)) == [30, 31]
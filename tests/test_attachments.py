@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from backend.conversation import attachments
+from backend.conversation.attachments import (
+    AttachmentStore, UploadCorrupt, UploadNotFound, UploadOffsetMismatch, UploadTooLarge
+)
+from backend.conversation.chat import ChatService
+from backend.storage.memory_store import MemoryStorage
+
+CONTENT = os.urandom(10_000)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """An attachment store over fresh storage, with users 1 and 2 in conversations c1 and c2"""
+    storage = MemoryStorage()
+    monkeypatch.setattr(attachments, "storage", storage)
+
+    async def setup():
+        for index in (1, 2):
+            await storage.create_user(f"u{index}@example.com", None, None)
+        service = ChatService(storage)
+        for conversation_id in ("c1", "c2"):
+            await service.ensure_conversation(conversation_id, [1, 2])
+    asyncio.run(setup())
+
+    store = AttachmentStore(str(tmp_path))
+    store.max_size, store.chunk_size = 50_000, 4_000
+    return store
+
+
+async def body(data, piece=1_000, disconnect_after=None):
+    """A request body arriving in pieces; `disconnect_after` bytes in, the client goes away"""
+    for start in range(0, len(data), piece):
+        if disconnect_after is not None and start >= disconnect_after:
+            raise ConnectionResetError("client disconnected")
+        yield data[start:start + piece]
+
+
+async def upload(store, data, conversation_id="c1", sha256=None):
+    started = await store.create_upload(conversation_id, 1, "photo.png", "image/png", len(data), sha256)
+    result = started
+    for offset in range(0, len(data), store.chunk_size):
+        result = await store.append(started.id, 1, offset, body(data[offset:offset + store.chunk_size]))
+    return result
+
+
+def test_an_interrupted_upload_resumes_after_a_restart(store, tmp_path):
+    async def main():
+        started = await store.create_upload("c1", 1, "photo.png", "image/png", len(CONTENT), hashlib.sha256(CONTENT).hexdigest())
+        with pytest.raises(ConnectionResetError):
+            await store.append(started.id, 1, 0, body(CONTENT[:4_000], disconnect_after=2_500))
+
+        # What arrived before the disconnect is kept, also across a restart
+        restarted = AttachmentStore(str(tmp_path))
+        restarted.chunk_size = store.chunk_size
+        resumed = await restarted.get_upload(started.id, 1)
+        assert resumed.offset == 3_000
+        with pytest.raises(UploadOffsetMismatch) as mismatch:
+            await restarted.append(started.id, 1, 0, body(CONTENT[:1_000]))
+        assert mismatch.value.offset == 3_000
+        with pytest.raises(UploadNotFound):
+            await restarted.get_upload(started.id, 2)
+
+        offset = resumed.offset
+        while offset < len(CONTENT):
+            result = await restarted.append(started.id, 1, offset, body(CONTENT[offset:offset + restarted.chunk_size]))
+            offset = getattr(result, "offset", len(CONTENT))
+        assert result.size == len(CONTENT) and result.conversationId == "c1"
+        assert restarted.blob_path(result.sha256).read_bytes() == CONTENT
+        # A finished upload is gone
+        with pytest.raises(UploadNotFound):
+            await restarted.get_upload(started.id, 1)
+        assert list(restarted.uploads_dir.iterdir()) == []
+    asyncio.run(main())
+
+
+def test_identical_content_is_stored_once(store):
+    async def main():
+        first = await upload(store, CONTENT)
+        second = await upload(store, CONTENT, conversation_id="c2")
+        assert first.id != second.id and first.sha256 == second.sha256
+        assert [path for path in store.blobs_dir.rglob("*") if path.is_file()] == [store.blob_path(first.sha256)]
+    asyncio.run(main())
+
+
+def test_oversized_and_corrupt_uploads_are_rejected(store):
+    async def main():
+        with pytest.raises(UploadTooLarge):
+            await store.create_upload("c1", 1, "big.bin", "application/octet-stream", store.max_size + 1)
+
+        started = await store.create_upload("c1", 1, "small.bin", "application/octet-stream", 5_000)
+        # Longer than a chunk may be
+        with pytest.raises(UploadTooLarge):
+            await store.append(started.id, 1, 0, body(os.urandom(4_500)))
+        # The bytes that fitted were kept; now past the declared size
+        offset = (await store.get_upload(started.id, 1)).offset
+        assert offset == 4_000
+        with pytest.raises(UploadTooLarge):
+            await store.append(started.id, 1, offset, body(os.urandom(5_000 - offset + 1)))
+
+        with pytest.raises(UploadCorrupt):
+            await upload(store, CONTENT, sha256="0" * 64)
+        assert not store.blobs_dir.exists()
+    asyncio.run(main())
+
+
+def test_unsafe_upload_ids_are_not_found(store):
+    async def main():
+        for upload_id in ("", "../etc/passwd", "a/b", "x.json"):
+            with pytest.raises(UploadNotFound):
+                await store.get_upload(upload_id, 1)
+    asyncio.run(main())
+
+
+def test_purge_keeps_content_another_attachment_still_uses(store):
+    async def main():
+        shared, other = await upload(store, CONTENT), await upload(store, b"other" * 100)
+        await upload(store, CONTENT, conversation_id="c2")
+        later = datetime.now(timezone.utc) + timedelta(seconds=1)
+
+        assert await store.purge_older_than(later, "c1") == 2
+        # c2 still refers to the shared content
+        assert store.blob_path(shared.sha256).exists()
+        assert not store.blob_path(other.sha256).exists()
+
+        assert await store.purge_older_than(later, exclude=["c2"]) == 0
+        assert await store.purge_older_than(later - timedelta(days=1), "c2") == 0
+        assert await store.purge_older_than(later, exclude=["c1"]) == 1
+        assert not store.blob_path(shared.sha256).exists()
+    asyncio.run(main())
+
+
+def test_abandoned_uploads_are_swept(store):
+    async def main():
+        stale = await store.create_upload("c1", 1, "a.bin", "application/octet-stream", 100)
+        fresh = await store.create_upload("c1", 1, "b.bin", "application/octet-stream", 100)
+        long_ago = time.time() - store.upload_ttl - 10
+        for suffix in (".json", ".part"):
+            os.utime(store.uploads_dir / f"{stale.id}{suffix}", (long_ago, long_ago))
+
+        assert store.sweep() == 1
+        with pytest.raises(UploadNotFound):
+            await store.get_upload(stale.id, 1)
+        assert (await store.get_upload(fresh.id, 1)).offset == 0
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import sqlite3
+import threading
+import pytest
+from backend.config.settings import settings
+from backend.utils.backup import BackupInProgress, DatabaseBackup, verify_backup
+
+
+def create_database(path, rows, wal=False):
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE Message (id INTEGER PRIMARY KEY, content TEXT)")
+    conn.executemany("INSERT INTO Message (content) VALUES (?)", [(f"message {i}" * 20,) for i in range(rows)])
+    conn.close()
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    """A main database and two message partitions, as the backup finds them through the settings"""
+    main = tmp_path / "main.db"
+    create_database(main, 500, wal=True)
+    partitions = tmp_path / "partitions"
+    partitions.mkdir()
+    for index in range(2):
+        create_database(partitions / f"messages-{index:03d}-of-002.db", 100 * (index + 1))
+    monkeypatch.setattr(settings, "database_url", f"file:{main}?connection_limit=1")
+    monkeypatch.setattr(settings, "message_partitions", 2)
+    monkeypatch.setattr(settings, "message_partition_dir", str(partitions))
+    monkeypatch.setattr(settings, "backup_dir", str(tmp_path / "backups"))
+    return main
+
+
+def take_backup(keep=7):
+    backup = DatabaseBackup()
+    backup.keep, backup.step_pages, backup.pause = keep, 4, 0
+    return backup, asyncio.run(backup.backup())
+
+
+def test_backup_restores_cleanly(databases):
+    backup, result = take_backup()
+    directory = backup.directory / result.name
+    manifest = json.loads((directory / "manifest.json").read_text())
+    assert [entry["name"] for entry in manifest["files"]] == ["main.db", "messages-000-of-002.db", "messages-001-of-002.db"]
+    assert [entry["rows"] for entry in manifest["files"]] == [{"Message": 500}, {"Message": 100}, {"Message": 200}]
+    assert sorted(path.name for path in directory.iterdir()) == [
+        "main.db.gz", "manifest.json", "messages-000-of-002.db.gz", "messages-001-of-002.db.gz"
+    ]
+    assert result.compressed_bytes < result.raw_bytes
+    assert verify_backup(directory) == []
+    assert [entry["name"] for entry in backup.list_backups()] == [result.name]
+
+
+def test_writes_during_the_copy_are_not_blocked(databases):
+    backup = DatabaseBackup()
+    backup.step_pages, backup.pause = 1, 0.005
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        conn = sqlite3.connect(str(databases), isolation_level=None)
+        while not stop.is_set():
+            conn.execute("INSERT INTO Message (content) VALUES ('late')")
+            written.append(1)
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        result = asyncio.run(backup.backup())
+    finally:
+        stop.set()
+        thread.join()
+    assert written
+    # WAL mode: the copy reads one snapshot, so concurrent writes never restart it
+    assert result.restarts == 0
+    assert verify_backup(backup.directory / result.name) == []
+
+
+def test_verification_reports_damaged_backups(databases):
+    backup, result = take_backup()
+    directory = backup.directory / result.name
+    manifest_path = directory / "manifest.json"
+    manifest = json.loads(manifest_path.read_text())
+
+    # Flipped bytes in a compressed file
+    damaged = directory / "messages-000-of-002.db.gz"
+    data = bytearray(damaged.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    damaged.write_bytes(bytes(data))
+    # A manifest whose row counts do not match the snapshot
+    manifest["files"][2]["rows"] = {"Message": 1}
+    manifest_path.write_text(json.dumps(manifest))
+
+    problems = verify_backup(directory)
+    assert problems == [
+        "messages-000-of-002.db.gz: checksum mismatch",
+        "messages-001-of-002.db: row counts {'Message': 200} differ from the manifest {'Message': 1}",
+    ]
+
+
+def test_verification_reports_a_snapshot_that_is_not_a_database(databases):
+    backup, result = take_backup()
+    directory = backup.directory / result.name
+    manifest_path = directory / "manifest.json"
+    manifest = json.loads(manifest_path.read_text())
+    # Checksum matches, content does not restore
+    garbage = directory / "main.db.gz"
+    garbage.write_bytes(gzip.compress(b"not a database" * 1000))
+    manifest["files"][0]["sha256"] = hashlib.sha256(garbage.read_bytes()).hexdigest()
+    manifest_path.write_text(json.dumps(manifest))
+
+    problems = verify_backup(directory)
+    assert len(problems) == 1 and problems[0].startswith("main.db: ")
+
+
+def test_old_backups_are_pruned_and_partial_ones_ignored(databases):
+    backups = DatabaseBackup().directory
+    for name in ("backup-20250101-000000", "backup-20250102-000000"):
+        (backups / name).mkdir(parents=True)
+    # Leftover of an interrupted backup
+    (backups / "backup-20250103-000000.partial").mkdir()
+
+    backup, result = take_backup(keep=2)
+    assert sorted(path.name for path in backups.iterdir()) == [
+        "backup-20250102-000000", "backup-20250103-000000.partial", result.name
+    ]
+    # Only finished backups with a manifest are listed
+    assert [entry["name"] for entry in backup.list_backups()] == [result.name]
+
+
+def test_one_backup_at_a_time(databases):
+    async def main():
+        backup = DatabaseBackup()
+        async with backup._lock:
+            with pytest.raises(BackupInProgress):
+                await backup.backup()
+            with pytest.raises(BackupInProgress):
+                backup.trigger()
+    asyncio.run(main())
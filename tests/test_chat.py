@@ -0,0 +1,74 @@
+import asyncio
+from backend.conversation.chat import ChatService
+from backend.storage.memory_store import MemoryStorage
+
+
+async def make_service():
+    storage = MemoryStorage()
+    users = [await storage.create_user(f"u{i}@example.com", None, None) for i in range(2)]
+    service = ChatService(storage)
+    conversation = await service.create_conversation([user.id for user in users])
+    return service, conversation, users
+
+
+def test_slow_listener_does_not_delay_the_writer():
+    async def main():
+        service, conversation, users = await make_service()
+        release = asyncio.Event()
+        inline, delivered = [], []
+
+        async def bookkeeping(message, member_ids):
+            inline.append(message.seq)
+
+        async def slow_socket(message, member_ids):
+            await release.wait()
+            delivered.append(message.seq)
+
+        service.add_listener(bookkeeping, inline=True)
+        service.add_listener(slow_socket)
+        for content in ("one", "two", "three"):
+            await asyncio.wait_for(service.add_message(conversation.id, users[0].id, content), 1)
+
+        # Inline listeners ran before add_message returned; the slow one is still waiting
+        assert inline == [1, 2, 3]
+        assert delivered == []
+        release.set()
+        await service.wait_for_listeners(1)
+        assert delivered == [1, 2, 3]
+        await service.stop()
+    asyncio.run(main())
+
+
+def test_listener_failure_does_not_stop_delivery():
+    async def main():
+        service, conversation, users = await make_service()
+        delivered = []
+
+        async def broken(message, member_ids):
+            raise RuntimeError("socket gone")
+
+        async def working(message, member_ids):
+            delivered.append((message.seq, member_ids))
+
+        service.add_listener(broken)
+        service.add_listener(working)
+        await service.add_messages(users[1].id, [(conversation.id, "a"), (conversation.id, "b")])
+        await service.wait_for_listeners(1)
+        members = frozenset(user.id for user in users)
+        assert delivered == [(1, members), (2, members)]
+        await service.stop()
+    asyncio.run(main())
+
+
+def test_stop_cancels_undelivered_notifications():
+    async def main():
+        service, conversation, users = await make_service()
+
+        async def stuck(message, member_ids):
+            await asyncio.Event().wait()
+
+        service.add_listener(stuck)
+        await service.add_message(conversation.id, users[0].id, "hello")
+        await asyncio.wait_for(service.stop(), 1)
+        assert not service._dispatching
+    asyncio.run(main())
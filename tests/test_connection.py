@@ -0,0 +1,62 @@
+import asyncio
+import json
+from backend.connection import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.frames = []
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise ConnectionResetError("peer gone")
+        self.frames.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        self.closed_with = code
+
+
+def test_idle_sockets_are_pinged_then_reaped():
+    async def main():
+        manager = ConnectionManager()
+        quiet, chatty = FakeSocket(), FakeSocket()
+        quiet_connection = await manager.connect(quiet, user_id=1, conversation_id="c1")
+        chatty_connection = await manager.connect(chatty, user_id=2, conversation_id="c1")
+        chatty_connection.last_seen = quiet_connection.last_seen
+        now = quiet_connection.last_seen + manager.heartbeat_interval
+
+        await manager._check_heartbeats([quiet_connection, chatty_connection], now)
+        assert quiet.frames == chatty.frames == [{"type": "ping"}]
+
+        # Only one of them answers before the timeout
+        chatty_connection.last_seen = now + 1
+        await manager._check_heartbeats([quiet_connection, chatty_connection], now + manager.heartbeat_timeout)
+        assert quiet.closed_with == 1001
+        assert chatty.closed_with is None
+        assert manager.stats() == {"connections": 1, "conversations": 1, "users": 1}
+        assert not manager.is_online(1) and manager.is_online(2)
+        await manager.stop()
+    asyncio.run(main())
+
+
+def test_failed_sends_evict_the_socket():
+    async def main():
+        manager = ConnectionManager()
+        broken, healthy = FakeSocket(fail=True), FakeSocket()
+        await manager.connect(broken, user_id=1, conversation_id="c1")
+        await manager.connect(healthy, user_id=2, conversation_id="c1")
+
+        await manager.broadcast("c1", '{"type": "message"}')
+        assert healthy.frames == [{"type": "message"}]
+        assert broken.closed_with == 1001
+        assert [c.websocket for c in manager.active_connections["c1"]] == [healthy]
+        # Evicting twice (reaper and receive loop) is harmless
+        manager.disconnect(broken)
+        assert manager.stats()["connections"] == 1
+        await manager.stop()
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+import asyncio
+import smtplib
+import pytest
+from backend.connection import ConnectionManager
+from backend.conversation import digests, receipts
+from backend.conversation.chat import ChatService
+from backend.conversation.digests import PREVIEWS_PER_CONVERSATION, DigestMailer
+from backend.conversation.receipts import ReadReceipts
+from backend.storage.memory_store import MemoryStorage
+
+
+class FakeSocket:
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+
+class FakePool:
+    """Records what would have been mailed; `fail` makes the whole send raise"""
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+
+    def send(self, messages):
+        if self.fail:
+            raise smtplib.SMTPServerDisconnected("connection lost")
+        self.sent.extend(messages)
+        return [True] * len(messages)
+
+    def close(self):
+        pass
+
+
+def text_of(email):
+    return email.get_payload()[0].get_payload(decode=True).decode()
+
+
+@pytest.fixture
+def world(monkeypatch):
+    """Users 1-3 (Ann, Bob, Cy) sharing conversation c1, wired to a digest mailer with a fake SMTP pool"""
+    storage = MemoryStorage()
+    service = ChatService(storage)
+    manager, pool, read_receipts = ConnectionManager(), FakePool(), ReadReceipts()
+    monkeypatch.setattr(digests, "storage", storage)
+    monkeypatch.setattr(receipts, "storage", storage)
+    monkeypatch.setattr(receipts, "chat_service", service)
+    monkeypatch.setattr(digests, "manager", manager)
+    monkeypatch.setattr(digests, "read_receipts", read_receipts)
+    monkeypatch.setattr(digests, "mail_pool", pool)
+
+    async def setup():
+        for name in ("Ann", "Bob", "Cy"):
+            await storage.create_user(f"{name.lower()}@example.com", name, None)
+        await service.ensure_conversation("c1", [1, 2, 3], name="Team")
+    asyncio.run(setup())
+
+    mailer = DigestMailer()
+    mailer.enabled, mailer.window, mailer.batch_size = True, 0.05, 1
+
+    async def say(sender_id, content, conversation_id="c1"):
+        message = await service.add_message(conversation_id, sender_id, content)
+        await mailer.record(message, await service.get_member_ids(conversation_id))
+        return message
+
+    return mailer, say, manager, pool, read_receipts
+
+
+def test_one_digest_per_absent_member(world):
+    mailer, say, manager, pool, _ = world
+
+    async def main():
+        # Cy has the app open
+        await manager.connect(FakeSocket(), user_id=3, multiplexed=True)
+        for index in range(5):
+            await say(1, f"update {index}")
+        assert mailer.pending_users() == 1
+        # Not due before the window has passed
+        assert await mailer.send_due() == 0
+
+        await asyncio.sleep(0.06)
+        assert await mailer.send_due() == 1
+        [email] = pool.sent
+        assert email["To"] == "bob@example.com"
+        assert email["Subject"].startswith("5 new messages")
+        body = text_of(email)
+        assert "Team (5 new)" in body
+        # Only the latest previews are kept
+        assert "update 1" not in body
+        assert all(f"Ann: update {index}" in body for index in range(5 - PREVIEWS_PER_CONVERSATION, 5))
+        assert mailer.pending_users() == 0 and mailer.sent == 1
+        await manager.stop()
+    asyncio.run(main())
+
+
+def test_coming_back_or_reading_cancels_the_digest(world):
+    mailer, say, manager, pool, read_receipts = world
+
+    async def main():
+        message = await say(1, "hello")
+        assert mailer.pending_users() == 2
+        # Cy comes online: the unread counts take over
+        await manager.connect(FakeSocket(), user_id=3, conversation_id="c1")
+        mailer.user_changed(3, True)
+        # Bob read the conversation on another device
+        await read_receipts.mark_read(2, "c1", message.seq)
+
+        await asyncio.sleep(0.06)
+        assert await mailer.send_due() == 0
+        assert pool.sent == [] and mailer.pending_users() == 0
+        await read_receipts.stop()
+        await manager.stop()
+    asyncio.run(main())
+
+
+def test_a_failed_batch_is_retried_with_what_was_missed_since(world):
+    mailer, say, manager, pool, _ = world
+
+    async def main():
+        await say(1, "first")
+        await asyncio.sleep(0.06)
+        pool.fail = True
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            await mailer.send_due()
+        assert mailer.pending_users() == 2
+
+        pool.fail = False
+        await say(1, "second")
+        assert await mailer.send_due() == 2
+        assert sorted(email["To"] for email in pool.sent) == ["bob@example.com", "cy@example.com"]
+        for email in pool.sent:
+            assert "Team (2 new)" in text_of(email)
+            assert "Ann: first" in text_of(email) and "Ann: second" in text_of(email)
+        await manager.stop()
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import asyncio
+import json
+from backend import drain
+from backend.connection import ConnectionManager
+from backend.drain import GracefulDrain
+
+
+class FakeSocket:
+    def __init__(self, send_delay: float = 0, hang_on_close: bool = False):
+        self.send_delay = send_delay
+        self.hang_on_close = hang_on_close
+        self.frames = []
+        self.close_code = None
+        self.close_reason = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        # Only the first send is slow
+        delay, self.send_delay = self.send_delay, 0
+        await asyncio.sleep(delay)
+        self.frames.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        if self.hang_on_close:
+            await asyncio.sleep(3600)
+        self.close_code, self.close_reason = code, reason
+
+
+def manager_with(sockets, jitter=2.0):
+    async def connect():
+        manager = ConnectionManager()
+        manager.reconnect_jitter = jitter
+        for user_id, socket in enumerate(sockets, start=1):
+            await manager.connect(socket, user_id=user_id, conversation_id="c1")
+        return manager
+    return connect()
+
+
+def test_every_socket_gets_a_jittered_reconnect_hint():
+    async def main():
+        sockets = [FakeSocket() for _ in range(20)]
+        manager = await manager_with(sockets)
+        await manager.drain(5)
+
+        hints = set()
+        for socket in sockets:
+            assert socket.close_code == 1012
+            after_ms = socket.frames[-1]["after_ms"]
+            assert socket.frames[-1] == {"type": "reconnect", "after_ms": after_ms}
+            assert json.loads(socket.close_reason) == {"reconnect_after_ms": after_ms}
+            assert 0 <= after_ms <= 2000
+            hints.add(after_ms)
+        assert len(hints) > 1
+        assert manager.stats() == {"connections": 0, "conversations": 0, "users": 0}
+
+        # Latecomers are turned away with a hint of their own
+        latecomer = FakeSocket()
+        await manager.refuse(latecomer)
+        assert latecomer.close_code == 1012
+        await manager.stop()
+    asyncio.run(main())
+
+
+def test_fan_outs_in_flight_finish_before_sockets_close():
+    async def main():
+        slow = FakeSocket(send_delay=0.1)
+        manager = await manager_with([slow])
+        fan_out = asyncio.ensure_future(manager.broadcast("c1", '{"type": "message"}'))
+        await asyncio.sleep(0)
+        await manager.drain(5)
+        await fan_out
+        assert [frame["type"] for frame in slow.frames] == ["message", "reconnect"]
+        await manager.stop()
+    asyncio.run(main())
+
+
+def test_sockets_that_never_close_do_not_hold_up_the_drain():
+    async def main():
+        stuck, healthy = FakeSocket(hang_on_close=True), FakeSocket()
+        manager = await manager_with([stuck, healthy])
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await manager.drain(0.2)
+        assert loop.time() - started < 1
+        assert healthy.close_code == 1012
+        assert manager.stats()["connections"] == 0
+        await manager.stop()
+    asyncio.run(main())
+
+
+def test_the_drain_runs_once(monkeypatch):
+    async def main():
+        socket = FakeSocket()
+        manager = await manager_with([socket])
+        monkeypatch.setattr(drain, "manager", manager)
+        calls = []
+        original = manager.drain
+
+        async def counted(timeout):
+            calls.append(timeout)
+            await original(timeout)
+        monkeypatch.setattr(manager, "drain", counted)
+
+        graceful = GracefulDrain()
+        graceful.timeout = 2
+        # SIGTERM and the lifespan shutdown both ask for it
+        await asyncio.gather(graceful.drain(), graceful.drain())
+        await graceful.drain()
+        assert len(calls) == 1 and 0 < calls[0] <= 2
+        assert manager.draining
+        assert socket.close_code == 1012
+        await manager.stop()
+    asyncio.run(main())
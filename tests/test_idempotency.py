@@ -0,0 +1,49 @@
+import asyncio
+from backend.conversation.idempotency import IdempotencyStore
+
+
+def test_in_flight_key_survives_eviction():
+    async def scenario():
+        store = IdempotencyStore(max_entries=2, ttl=60)
+        executions = []
+        release = asyncio.Event()
+
+        async def slow(indexes):
+            executions.append("slow")
+            await release.wait()
+            return ["first"]
+
+        async def fast(indexes):
+            executions.append("fast")
+            return ["other"]
+
+        first = asyncio.create_task(store.run(1, [("a", "x")], slow))
+        await asyncio.sleep(0)
+        # Fill the cache well past its size while "a" is still running
+        for key in ("b", "c", "d"):
+            await store.run(1, [(key, "x")], fast)
+        retry = asyncio.create_task(store.run(1, [("a", "x")], slow))
+        await asyncio.sleep(0)
+        release.set()
+        assert await first == [("first", False)]
+        assert await retry == [("first", True)]
+        assert executions.count("slow") == 1
+        assert len(store) <= 3
+
+    asyncio.run(scenario())
+
+
+def test_finished_entries_are_evicted_oldest_first():
+    async def scenario():
+        store = IdempotencyStore(max_entries=2, ttl=60)
+
+        async def execute(indexes):
+            return ["ok"]
+
+        for key in ("a", "b", "c"):
+            await store.run(1, [(key, "x")], execute)
+        assert len(store) == 2
+        assert await store.run(1, [("c", "x")], execute) == [("ok", True)]
+        assert await store.run(1, [("a", "x")], execute) == [("ok", False)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import asyncio
+import gc
+import pytest
+from backend.utils.loader import BatchLoader
+
+
+class Source:
+    """Batch function recording the key lists it was called with"""
+
+    def __init__(self, fail: bool = False, delay: float = 0):
+        self.calls = []
+        self.fail = fail
+        self.delay = delay
+
+    async def __call__(self, keys):
+        self.calls.append(list(keys))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("database down")
+        return {key: f"record {key}" for key in keys if key != "missing"}
+
+
+def test_lookups_in_one_tick_share_one_batch():
+    async def main():
+        source = Source()
+        loader = BatchLoader(source)
+        results = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("missing"))
+        assert results == ["record a", "record b", "record a", None]
+        assert source.calls == [["a", "b", "missing"]]
+        assert await loader.load_many(["c", "b", "c"]) == ["record c", "record b", "record c"]
+        assert source.calls[-1] == ["c", "b"]
+
+        # Nothing is cached once the batch is done
+        assert await loader.load("a") == "record a"
+        assert source.calls[-1] == ["a"]
+    asyncio.run(main())
+
+
+def test_in_flight_keys_are_shared_across_ticks():
+    async def main():
+        source = Source(delay=0.05)
+        loader = BatchLoader(source)
+        first = asyncio.ensure_future(loader.load("a"))
+        await asyncio.sleep(0.01)
+        # "a" is already being fetched; only "b" needs a new batch
+        assert await asyncio.gather(loader.load("a"), loader.load("b")) == ["record a", "record b"]
+        assert await first == "record a"
+        assert source.calls == [["a"], ["b"]]
+    asyncio.run(main())
+
+
+def test_batches_are_split_at_the_size_limit():
+    async def main():
+        source = Source()
+        loader = BatchLoader(source, max_batch_size=3)
+        assert await loader.load_many(range(7)) == [f"record {key}" for key in range(7)]
+        assert source.calls == [[0, 1, 2], [3, 4, 5], [6]]
+    asyncio.run(main())
+
+
+def test_a_failed_batch_fails_every_waiter_and_is_not_remembered():
+    async def main():
+        source = Source(fail=True)
+        loader = BatchLoader(source)
+        results = await asyncio.gather(loader.load("a"), loader.load("a"), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        source.fail = False
+        assert await loader.load("a") == "record a"
+    asyncio.run(main())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        loader = BatchLoader(Source(delay=0.05))
+        impatient = asyncio.ensure_future(loader.load("a"))
+        patient = asyncio.ensure_future(loader.load("a"))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        assert await patient == "record a"
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+    asyncio.run(main())
+
+
+def test_running_batches_survive_garbage_collection():
+    async def main():
+        loader = BatchLoader(Source(delay=0.02))
+        pending = asyncio.ensure_future(loader.load_many(range(5)))
+        await asyncio.sleep(0)
+        # The loop only holds weak references to tasks; the loader keeps them alive
+        gc.collect()
+        assert await asyncio.wait_for(pending, 1) == [f"record {key}" for key in range(5)]
+    asyncio.run(main())
+
+
+def test_each_event_loop_gets_its_own_state():
+    loader = BatchLoader(Source())
+    # A loader created at import time works from successive loops
+    assert asyncio.run(loader.load("a")) == "record a"
+    assert asyncio.run(loader.load("b")) == "record b"
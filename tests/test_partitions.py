@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+import pytest
+from backend.conversation.partitions import MessagePartitions, partition_index
+
+COUNT = 4
+
+
+def conversations_on_two_partitions():
+    first = "conversation-0"
+    second = next(
+        f"conversation-{i}" for i in range(1, 100)
+        if partition_index(f"conversation-{i}", COUNT) != partition_index(first, COUNT)
+    )
+    return first, second
+
+
+def run(tmp_path, scenario):
+    async def main():
+        partitions = MessagePartitions(COUNT, tmp_path)
+        try:
+            await scenario(partitions)
+        finally:
+            partitions.close()
+    asyncio.run(main())
+
+
+def test_cross_partition_batch(tmp_path):
+    first, second = conversations_on_two_partitions()
+
+    async def scenario(partitions):
+        await partitions.create_message(first, 1, "before")
+        created = await partitions.create_messages([(first, 1, "a"), (second, 1, "b"), (first, 1, "c")])
+        assert [(m.conversationId, m.seq, m.content) for m in created] == [(first, 2, "a"), (second, 1, "b"), (first, 3, "c")]
+
+        # Concurrent multi-partition batches do not wait on each other forever
+        batches = await asyncio.wait_for(asyncio.gather(*(
+            partitions.create_messages([(first, 2, f"x{i}"), (second, 2, f"y{i}")]) for i in range(5)
+        )), 10)
+        assert sorted(batch[0].seq for batch in batches) == [4, 5, 6, 7, 8]
+        assert await partitions.last_seqs([first, second]) == {first: 8, second: 6}
+    run(tmp_path, scenario)
+
+
+def test_failed_insert_stores_nothing(tmp_path):
+    first, second = conversations_on_two_partitions()
+
+    async def scenario(partitions):
+        await partitions.create_message(first, 1, "before")
+        await partitions.partition(second).run(lambda conn: conn.execute(
+            'CREATE TRIGGER "reject" BEFORE INSERT ON "Message" WHEN NEW."content" = \'boom\' '
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+        ))
+        with pytest.raises(sqlite3.IntegrityError):
+            await partitions.create_messages([(first, 1, "a"), (second, 1, "boom")])
+
+        assert [m.content for m in await partitions.messages_since(first)] == ["before"]
+        assert await partitions.messages_since(second) == []
+        # No seq was skipped
+        assert (await partitions.create_message(first, 1, "after")).seq == 2
+    run(tmp_path, scenario)
+
+
+def test_failed_commit_takes_committed_partitions_back(tmp_path):
+    first, second = conversations_on_two_partitions()
+
+    def fail_at_commit(conn):
+        # A deferred foreign key is only checked by COMMIT
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(
+            'CREATE TABLE "Parent" ("id" INTEGER PRIMARY KEY);'
+            'CREATE TABLE "Child" ("parent" INTEGER REFERENCES "Parent"("id") DEFERRABLE INITIALLY DEFERRED);'
+            'CREATE TRIGGER "dangle" AFTER INSERT ON "Message" WHEN NEW."content" = \'late\' '
+            'BEGIN INSERT INTO "Child" VALUES (1); END;'
+        )
+
+    async def scenario(partitions):
+        await partitions.create_message(first, 1, "before")
+        await partitions.partition(second).run(fail_at_commit)
+        with pytest.raises(sqlite3.IntegrityError):
+            await partitions.create_messages([(first, 1, "a"), (first, 1, "b"), (second, 1, "late")])
+
+        assert [m.content for m in await partitions.messages_since(first)] == ["before"]
+        assert await partitions.last_seqs([first, second]) == {first: 1}
+        assert (await partitions.create_message(first, 1, "after")).seq == 2
+    run(tmp_path, scenario)
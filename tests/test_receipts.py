@@ -0,0 +1,66 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from backend.connection import Connection, manager
+from backend.conversation.receipts import ReadReceipts
+
+
+class FakeSocket:
+    """Records text frames; a blocked socket never completes a send"""
+
+    def __init__(self, blocked: bool = False):
+        self.blocked = blocked
+        self.frames = []
+
+    async def send_text(self, text):
+        if self.blocked:
+            await asyncio.Event().wait()
+        self.frames.append(json.loads(text))
+
+
+def message(conversation_id, seq, sender_id):
+    return SimpleNamespace(
+        conversationId=conversation_id, seq=seq, senderId=sender_id, createdAt=datetime.now(timezone.utc)
+    )
+
+
+def test_sender_reads_their_own_message_inline():
+    async def main():
+        receipts = ReadReceipts()
+        await receipts.message_stored(message("r1", 3, 10), frozenset({10, 11}))
+        assert await receipts.unread_count(10, "r1") == 0
+        assert await receipts.unread_count(11, "r1") == 3
+        assert await receipts.mark_read(11, "r1", 2) == 1
+        # Pointers never move back, and never past the last message
+        assert await receipts.mark_read(11, "r1", 1) == 1
+        assert await receipts.mark_read(11, "r1", 99) == 0
+    asyncio.run(main())
+
+
+def test_unread_counts_are_pushed_concurrently():
+    async def main():
+        receipts = ReadReceipts()
+        now = asyncio.get_running_loop().time()
+        stuck, healthy = FakeSocket(blocked=True), FakeSocket()
+        connections = {
+            20: Connection(stuck, 20, multiplexed=True, binary=False, now=now),
+            21: Connection(healthy, 21, multiplexed=True, binary=False, now=now),
+        }
+        for user_id, connection in connections.items():
+            manager.connections[connection.websocket] = connection
+            manager.user_connections[user_id] = {connection}
+        try:
+            new = message("r2", 1, 22)
+            await receipts.message_stored(new, frozenset({20, 21, 22}))
+            publishing = asyncio.create_task(receipts.publish(new, frozenset({20, 21, 22})))
+            await asyncio.sleep(0.05)
+            # The stuck socket does not hold up the other member's frame
+            assert healthy.frames == [{"type": "unread", "conversation_id": "r2", "count": 1}]
+            assert not publishing.done()
+            publishing.cancel()
+        finally:
+            for user_id, connection in connections.items():
+                manager.connections.pop(connection.websocket, None)
+                manager.user_connections.pop(user_id, None)
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from backend.config.settings import settings
+from backend.conversation import retention
+from backend.conversation.chat import ChatService
+from backend.conversation.retention import MIN_PURGE_BATCH, RetentionPurger
+from backend.storage.memory_store import MemoryStorage
+
+NOW = datetime.now(timezone.utc)
+
+
+@pytest.fixture(params=[0, 4], ids=["database", "partitions"])
+def service(request, tmp_path, monkeypatch):
+    """A chat service over fresh storage, with messages in the database or in partition files"""
+    monkeypatch.setattr(settings, "message_partitions", request.param)
+    monkeypatch.setattr(settings, "message_partition_dir", str(tmp_path / "partitions"))
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path / "archive"))
+    storage = MemoryStorage()
+    asyncio.run(storage.create_user("u1@example.com", None, None))
+    service = ChatService(storage)
+    monkeypatch.setattr(retention, "chat_service", service)
+    return service
+
+
+def purger(days, max_batch=1000):
+    purger = RetentionPurger()
+    purger.days, purger.max_batch, purger.batch_size, purger.pause = days, max_batch, max_batch, 0
+    return purger
+
+
+async def seed(service, conversation_id, ages_in_days):
+    """One message per age, oldest first; returns the seqs"""
+    await service.ensure_conversation(conversation_id, [1])
+    rows = []
+    for seq, age in enumerate(ages_in_days, start=1):
+        millis = int((NOW - timedelta(days=age)).timestamp() * 1000)
+        rows.append((f"{conversation_id}-{seq}", f"#{seq}", 1, conversation_id, seq, millis, millis))
+    await service.import_messages(rows)
+    return list(range(1, len(rows) + 1))
+
+
+async def remaining(service, conversation_id):
+    return [message.seq for message in await service.get_messages_since(conversation_id)]
+
+
+def test_expired_messages_are_purged_in_batches(service):
+    async def main():
+        await seed(service, "c1", [40] * 120 + [10] * 5)
+        job = purger(days=30, max_batch=MIN_PURGE_BATCH)
+        assert await job.purge() == 120
+        assert await remaining(service, "c1") == list(range(121, 126))
+        # Nothing left to delete
+        assert await job.purge() == 0
+    asyncio.run(main())
+
+
+def test_archived_history_is_purged_too(service):
+    async def main():
+        await seed(service, "c1", [50, 45, 40, 35, 10, 5])
+        # The three oldest move to cold storage; one expired message stays hot
+        assert await service.archive_messages("c1", 3) == 3
+        assert await purger(days=30).purge() == 4
+        assert await remaining(service, "c1") == [5, 6]
+        assert await service.archived_conversation_ids() == []
+    asyncio.run(main())
+
+
+def test_conversation_overrides(service):
+    async def main():
+        ages = [400, 100, 40, 10]
+        for conversation_id in ("default", "forever", "longer", "shorter"):
+            await seed(service, conversation_id, ages)
+        await service.set_retention("forever", 0)
+        await service.set_retention("longer", 365)
+        await service.set_retention("shorter", 7)
+
+        assert await purger(days=30).purge() == 3 + 0 + 1 + 4
+        assert await remaining(service, "default") == [4]
+        assert await remaining(service, "forever") == [1, 2, 3, 4]
+        assert await remaining(service, "longer") == [2, 3, 4]
+        assert await remaining(service, "shorter") == []
+
+        # With the global setting off, overrides still apply
+        await seed(service, "shorter-again", ages)
+        await service.set_retention("shorter-again", 50)
+        assert await purger(days=0).purge() == 2
+        assert await remaining(service, "shorter-again") == [3, 4]
+    asyncio.run(main())
+
+
+def test_batch_size_follows_the_time_slice():
+    job = purger(days=30, max_batch=1000)
+    job.slice = 0.1
+    job._adapt(0.5)
+    job._adapt(0.5)
+    assert job.batch_size == 250
+    for _ in range(10):
+        job._adapt(0.5)
+    assert job.batch_size == MIN_PURGE_BATCH
+    # Between a quarter of the slice and the slice: unchanged
+    job._adapt(0.05)
+    assert job.batch_size == MIN_PURGE_BATCH
+    job._adapt(0.01)
+    assert job.batch_size == 2 * MIN_PURGE_BATCH
+    for _ in range(10):
+        job._adapt(0.01)
+    assert job.batch_size == 1000
@@ -0,0 +1,45 @@
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from backend.conversation.serializers import (
+    encode_conversation, encode_export_header, encode_export_messages, encode_history, encode_inbox
+)
+
+NOW = datetime(2025, 10, 19, 12, 0, tzinfo=timezone.utc)
+AWKWARD_ID = 'x"y\\z\n'
+
+
+def make_user(user_id):
+    return SimpleNamespace(id=user_id, email=f"u{user_id}@example.com", name=None, createdAt=NOW, updatedAt=NOW)
+
+
+def make_message(seq, sender):
+    return SimpleNamespace(
+        id=f"{AWKWARD_ID}{seq}", conversationId=AWKWARD_ID, seq=seq, senderId=sender.id, sender=sender,
+        content='say "hi"', createdAt=NOW, updatedAt=NOW
+    )
+
+
+def make_conversation():
+    users = [make_user(1), make_user(2)]
+    return SimpleNamespace(
+        id=AWKWARD_ID, name=None, lastSeq=2, users=users,
+        messages=[make_message(1, users[0]), make_message(2, users[1])]
+    )
+
+
+def test_ids_are_escaped():
+    conversation = make_conversation()
+    history = json.loads(encode_history(conversation.messages, 1))
+    assert [message["id"] for message in history] == [f"{AWKWARD_ID}1", f"{AWKWARD_ID}2"]
+    assert history[0]["sender"] == "me"
+    assert json.loads(encode_conversation(conversation))["id"] == AWKWARD_ID
+    assert json.loads(encode_inbox([conversation], {AWKWARD_ID: 3}))[0]["unread_count"] == 3
+
+
+def test_export_lines_are_valid_json():
+    conversation = make_conversation()
+    header = json.loads(encode_export_header(conversation, [2, 1]))
+    assert header == {"type": "conversation", "id": AWKWARD_ID, "name": None, "user_ids": [1, 2]}
+    lines = encode_export_messages(conversation.messages).decode().splitlines()
+    assert [json.loads(line)["conversation_id"] for line in lines] == [AWKWARD_ID, AWKWARD_ID]
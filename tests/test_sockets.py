@@ -0,0 +1,35 @@
+import json
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from backend.connection import manager
+
+
+def create_conversation(client, token, user_ids):
+    response = client.post("/api/chat/conversations", json=user_ids, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_conversation_socket_requires_a_member_token(client, signup):
+    alice, alice_token = signup("alice")
+    bob, bob_token = signup("bob")
+    mallory, mallory_token = signup("mallory")
+    conversation_id = create_conversation(client, alice_token, [bob])
+
+    # Neither a bare user ID nor a non-member's token gets in, or shows anyone online
+    for query in (f"user_id={alice}", f"token={mallory_token}", "token=garbage"):
+        with pytest.raises(WebSocketDisconnect) as rejected:
+            with client.websocket_connect(f"/ws/{conversation_id}?{query}"):
+                pass
+        assert rejected.value.code == 1008
+    assert not manager.is_online(alice)
+    assert not manager.is_online(mallory)
+
+    with client.websocket_connect(f"/ws/{conversation_id}?token={bob_token}") as bob_socket:
+        with client.websocket_connect(f"/ws/{conversation_id}?token={alice_token}") as alice_socket:
+            assert manager.is_online(alice)
+            alice_socket.send_text("hello")
+            frame = json.loads(bob_socket.receive_text())
+            assert frame["type"] == "message"
+            assert frame["message"]["sender_id"] == alice
+            assert frame["message"]["content"] == "hello"
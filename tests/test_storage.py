@@ -0,0 +1,181 @@
+"""
+Behaviour shared by every storage engine
+
+Runs against MemoryStorage always, and against PrismaStorage when
+TEST_DATABASE_URL points at a scratch, migrated SQLite database (with the
+client generated):
+
+    TEST_DATABASE_URL=file:/tmp/test.db python -m pytest tests/test_storage.py
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from backend.storage import DuplicateKeyError, create_storage
+
+ENGINES = [
+    "memory",
+    pytest.param("prisma", marks=pytest.mark.skipif(
+        "TEST_DATABASE_URL" not in os.environ, reason="TEST_DATABASE_URL is not set"
+    )),
+]
+
+
+@pytest.fixture(params=ENGINES)
+def run(request, monkeypatch):
+    """Run a scenario coroutine against a connected storage of the engine"""
+    if request.param == "prisma":
+        monkeypatch.setenv("DATABASE_URL", os.environ["TEST_DATABASE_URL"])
+
+    def runner(scenario):
+        async def main():
+            storage = create_storage(request.param)
+            await storage.connect()
+            try:
+                await scenario(storage)
+            finally:
+                await storage.disconnect()
+        asyncio.run(main())
+    return runner
+
+
+def unique(prefix: str) -> str:
+    # The Prisma database is shared by every test; keep keys from colliding
+    return f"{prefix}{uuid.uuid4().hex[:12]}"
+
+
+async def make_users(storage, count):
+    return [await storage.create_user(f"{unique('u')}@example.com", None, None) for _ in range(count)]
+
+
+def test_users(run):
+    async def scenario(storage):
+        email = f"{unique('u')}@example.com"
+        user = await storage.create_user(email, "Ann", "hash")
+        assert (await storage.find_user(user.id)).email == email
+        assert (await storage.find_user_by_email(email)).id == user.id
+        assert await storage.find_user(-1) is None
+        with pytest.raises(DuplicateKeyError):
+            await storage.create_user(email, None, None)
+
+        other = (await make_users(storage, 1))[0]
+        found = await storage.find_users([other.id, user.id, other.id, -1])
+        assert [found_user.id for found_user in found] == sorted([user.id, other.id])
+
+        await storage.set_password(user.id, "new-hash")
+        assert (await storage.find_user(user.id)).password == "new-hash"
+        assert await storage.set_password(-1, "ignored") is None
+    run(scenario)
+
+
+def test_conversations(run):
+    async def scenario(storage):
+        first, second = await make_users(storage, 2)
+        member_hash = unique("hash")
+        conversation = await storage.create_conversation([first.id, second.id], member_hash, name="Pair")
+        with pytest.raises(DuplicateKeyError):
+            await storage.create_conversation([first.id], member_hash)
+        assert (await storage.find_conversation_by_hash(member_hash)).id == conversation.id
+        assert (await storage.find_conversation(conversation.id)).lastSeq == 0
+        members = await storage.load_members([conversation.id, "missing"])
+        assert members == {conversation.id: frozenset({first.id, second.id})}
+
+        await storage.create_message(conversation.id, first.id, "one")
+        await storage.create_message(conversation.id, second.id, "two")
+
+        [loaded] = await storage.load_conversations([conversation.id, "missing"])
+        assert [message.seq for message in loaded.messages] == [1, 2]
+        assert [message.sender.id for message in loaded.messages] == [first.id, second.id]
+        assert sorted(user.id for user in loaded.users) == [first.id, second.id]
+
+        [inbox] = await storage.user_conversations(second.id)
+        assert [message.seq for message in inbox.messages] == [2, 1]
+        assert all(message.sender is None for message in inbox.messages)
+        [bare] = await storage.user_conversations(second.id, with_messages=False)
+        assert not bare.messages
+
+        await storage.set_retention(conversation.id, 7)
+        assert (await storage.retention_overrides())[conversation.id] == 7
+    run(scenario)
+
+
+def test_conversation_id_paging(run):
+    async def scenario(storage):
+        [user] = await make_users(storage, 1)
+        created = sorted([
+            (await storage.create_conversation([user.id], None, conversation_id=unique("c"))).id for _ in range(5)
+        ])
+        seen, after = [], None
+        while True:
+            page = await storage.conversation_ids(after, limit=2)
+            if not page:
+                break
+            assert page == sorted(page) and (after is None or page[0] > after)
+            seen += page
+            after = page[-1]
+        assert [conversation_id for conversation_id in seen if conversation_id in created] == created
+    run(scenario)
+
+
+def test_messages(run):
+    async def scenario(storage):
+        [user] = await make_users(storage, 1)
+        conversation = await storage.create_conversation([user.id], None)
+        other = await storage.create_conversation([user.id], None)
+        stored = await storage.create_messages(user.id, [
+            (conversation.id, "a"), (other.id, "x"), (conversation.id, "b"), (conversation.id, "c"),
+        ])
+        assert [(message.conversationId, message.seq) for message in stored] == [
+            (conversation.id, 1), (other.id, 1), (conversation.id, 2), (conversation.id, 3),
+        ]
+        with pytest.raises(ValueError):
+            await storage.create_message("missing", user.id, "nope")
+        assert await storage.last_seq(conversation.id) == 3
+
+        assert [message.content for message in await storage.messages_since(conversation.id, 1)] == ["b", "c"]
+        assert [message.seq for message in await storage.messages_since(conversation.id, 0, limit=2)] == [1, 2]
+
+        future = datetime.now(timezone.utc) + timedelta(minutes=1)
+        assert await storage.newest_seq_before(conversation.id, future) == 3
+        assert await storage.purge_through(conversation.id, 2, limit=1) == 1
+        assert await storage.purge_through(conversation.id, 2, limit=10) == 1
+        assert [message.seq for message in await storage.messages_since(conversation.id)] == [3]
+        assert await storage.delete_through(conversation.id, 3) == 1
+        # Purging never lowers the seq counter
+        assert await storage.last_seq(conversation.id) == 3
+    run(scenario)
+
+
+def test_read_pointers(run):
+    async def scenario(storage):
+        first, second = await make_users(storage, 2)
+        conversation = await storage.create_conversation([first.id, second.id], None)
+        other = await storage.create_conversation([first.id], None)
+        await storage.save_read_pointers([(first.id, conversation.id, 5), (first.id, other.id, 2)])
+        await storage.save_read_pointers([(first.id, conversation.id, 3), (second.id, conversation.id, 1)])
+        assert await storage.read_pointers(first.id) == {conversation.id: 5, other.id: 2}
+        assert await storage.read_pointers_for([first.id, second.id], [conversation.id]) == {
+            (first.id, conversation.id): 5, (second.id, conversation.id): 1,
+        }
+    run(scenario)
+
+
+def test_attachments(run):
+    async def scenario(storage):
+        [user] = await make_users(storage, 1)
+        conversation = await storage.create_conversation([user.id], None)
+        sha256 = uuid.uuid4().hex * 2
+        attachment = await storage.create_attachment(sha256, 3, "text/plain", "a.txt", user.id, conversation.id)
+        assert (await storage.find_attachment(attachment.id)).sha256 == sha256
+        assert await storage.attachment_content_in_use(sha256)
+
+        future = datetime.now(timezone.utc) + timedelta(minutes=1)
+        old = await storage.attachments_older_than(future, 10, conversation_id=conversation.id)
+        assert [found.id for found in old] == [attachment.id]
+        others = await storage.attachments_older_than(future, 10, exclude=[conversation.id])
+        assert all(found.conversationId != conversation.id for found in others)
+        assert await storage.delete_attachments([attachment.id]) == 1
+        assert await storage.find_attachment(attachment.id) is None
+        assert not await storage.attachment_content_in_use(sha256)
+    run(scenario)
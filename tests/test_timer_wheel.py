@@ -0,0 +1,58 @@
+import pytest
+from backend.utils.timer_wheel import TimerWheel
+
+
+def expiry_ticks(wheel, ticks):
+    """key -> tick (1-based) on which advance() returned it"""
+    expired = {}
+    for tick in range(1, ticks + 1):
+        for key in wheel.advance():
+            assert key not in expired
+            expired[key] = tick
+    return expired
+
+
+def test_deadlines_round_up_to_whole_ticks():
+    wheel = TimerWheel(tick=0.5, slots=8)
+    wheel.schedule("a", 0.5)
+    wheel.schedule("b", 0.6)
+    wheel.schedule("c", 0)
+    assert len(wheel) == 3 and "a" in wheel
+    assert expiry_ticks(wheel, 4) == {"a": 1, "b": 2, "c": 1}
+    assert len(wheel) == 0 and "a" not in wheel
+
+
+@pytest.mark.parametrize("ticks", [7, 8, 9, 16, 17, 30])
+def test_deadlines_past_one_revolution(ticks):
+    wheel = TimerWheel(tick=1.0, slots=8)
+    # Start mid-revolution so the slot index wraps around
+    expiry_ticks(wheel, 5)
+    wheel.schedule("key", ticks)
+    assert expiry_ticks(wheel, 40) == {"key": ticks}
+
+
+def test_keys_sharing_a_slot_expire_on_their_own_round():
+    wheel = TimerWheel(tick=1.0, slots=4)
+    for ticks in (2, 6, 10):
+        wheel.schedule(ticks, ticks)
+    assert expiry_ticks(wheel, 12) == {2: 2, 6: 6, 10: 10}
+
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule("gone", 2)
+    wheel.schedule("moved", 2)
+    assert wheel.cancel("gone")
+    assert not wheel.cancel("gone")
+    assert not wheel.cancel("never")
+    # Rescheduling replaces the old deadline instead of adding a second one
+    wheel.schedule("moved", 9)
+    assert len(wheel) == 1
+    assert expiry_ticks(wheel, 12) == {"moved": 9}
+
+
+def test_invalid_wheels_are_rejected():
+    with pytest.raises(ValueError):
+        TimerWheel(tick=0)
+    with pytest.raises(ValueError):
+        TimerWheel(tick=1.0, slots=0)
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import pytest
+from backend.config.settings import settings
+from backend.conversation import transfer
+from backend.conversation.chat import ChatService
+from backend.conversation.transfer import NDJSONImporter
+from backend.storage import DuplicateKeyError
+from backend.storage.memory_store import MemoryStorage
+
+
+@pytest.mark.parametrize("record", [
+    {"type": "conversation", "id": "../../x", "user_ids": [1]},
+    {"type": "message", "conversation_id": "a/b", "sender_id": 1, "content": "hi"},
+    {"type": "message", "id": 'm"1', "conversation_id": "c1", "sender_id": 1, "content": "hi"},
+])
+def test_unsafe_ids_are_rejected(tmp_path, record):
+    path = tmp_path / "dump.ndjson"
+    path.write_text(json.dumps(record) + "\n")
+    with pytest.raises(ValueError, match="dump.ndjson:1"):
+        asyncio.run(NDJSONImporter(str(path)).run())
+
+
+def write_dump(path, seqs):
+    lines = [{"type": "conversation", "id": "imported", "user_ids": [1, 2]}] + [
+        {"type": "message", "id": f"m{seq}", "conversation_id": "imported", "seq": seq, "sender_id": 1, "content": f"#{seq}"}
+        for seq in seqs
+    ]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    return [len(json.dumps(line)) + 1 for line in lines]
+
+
+@pytest.fixture(params=[0, 4], ids=["database", "partitions"])
+def service(request, tmp_path, monkeypatch):
+    """A chat service over fresh storage, with messages in the database or in partition files"""
+    monkeypatch.setattr(settings, "message_partitions", request.param)
+    monkeypatch.setattr(settings, "message_partition_dir", str(tmp_path / "partitions"))
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path / "archive"))
+    storage = MemoryStorage()
+    for index in (1, 2):
+        asyncio.run(storage.create_user(f"u{index}@example.com", None, None))
+    service = ChatService(storage)
+    monkeypatch.setattr(transfer, "chat_service", service)
+    return service
+
+
+def test_resume_skips_only_the_replayed_batch(tmp_path, service):
+    async def main():
+        path = tmp_path / "dump.ndjson"
+        # A run that stored messages 1-3 and crashed before checkpointing past message 1
+        write_dump(path, [1, 2, 3])
+        assert await NDJSONImporter(str(path), resume=False).run() == 3
+        sizes = write_dump(path, [1, 2, 3, 4, 5, 6])
+        checkpoint = tmp_path / "dump.ndjson.checkpoint"
+        checkpoint.write_text(json.dumps({"offset": sum(sizes[:2]), "lines": 2}))
+
+        assert await NDJSONImporter(str(path), batch_size=2).run() == 3
+        assert not checkpoint.exists()
+        messages = await service.get_messages_since("imported")
+        assert [(m.seq, m.content) for m in messages] == [(seq, f"#{seq}") for seq in range(1, 7)]
+
+        # Importing the same dump again is refused the same way in every layout
+        with pytest.raises(DuplicateKeyError):
+            await NDJSONImporter(str(path), batch_size=10).run()
+        assert len(await service.get_messages_since("imported")) == 6
+        await service.stop()
+    asyncio.run(main())
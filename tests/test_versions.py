@@ -0,0 +1,23 @@
+from backend.conversation.versions import VersionStamps, _Versions
+
+
+def test_bumps_change_etags():
+    stamps = VersionStamps()
+    before = stamps.conversation_etag("c1", 1)
+    stamps.bump_conversation("c1")
+    assert stamps.conversation_etag("c1", 1) != before
+    inbox = stamps.inbox_etag(1)
+    stamps.bump_inboxes([1, 2])
+    assert stamps.inbox_etag(1) != inbox
+
+
+def test_eviction_never_brings_back_a_stale_version():
+    versions = _Versions(max_entries=2)
+    # key -> versions it reported before its last change; none may come back
+    stale = {}
+    for key in ("a", "b", "a", "c", "d", "a", "b", "e", "c"):
+        stale.setdefault(key, set()).add(versions.get(key))
+        versions.bump(key)
+        assert len(versions._versions) <= 2
+        for seen_key, old in stale.items():
+            assert versions.get(seen_key) not in old
@@ -0,0 +1,45 @@
+import zlib
+import pytest
+from backend.utils.wire import (
+    HEADER_DEFLATE, HEADER_PLAIN, MAX_FRAME, WireError, decode_binary, encode_binary, packb
+)
+
+
+def test_round_trip_plain_and_compressed():
+    small = {"type": "send", "conversation_id": "c1", "content": "hi"}
+    large = {"type": "send", "conversation_id": "c1", "content": "hello " * 1000}
+    assert encode_binary(small)[0] == HEADER_PLAIN
+    assert encode_binary(large)[0] == HEADER_DEFLATE
+    assert decode_binary(encode_binary(small)) == small
+    assert decode_binary(encode_binary(large)) == large
+
+
+@pytest.mark.parametrize("frame", [
+    b"",
+    b"\x07" + packb({}),
+    b"\x00\xc1",
+    b"\x00\x92\x01",
+    b"\x00" + packb({}) + b"\x00",
+    b"\x01not deflate",
+])
+def test_malformed_frames_are_rejected(frame):
+    with pytest.raises(WireError):
+        decode_binary(frame)
+
+
+def test_deeply_nested_frame_is_rejected():
+    with pytest.raises(WireError):
+        decode_binary(b"\x00" + b"\x91" * 100_000 + b"\xc0")
+
+
+def test_decompression_bomb_is_rejected():
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    bomb = compressor.compress(packb(b"\x00" * (200 * 1024 * 1024))) + compressor.flush()
+    assert len(bomb) < MAX_FRAME
+    with pytest.raises(WireError):
+        decode_binary(bytes((HEADER_DEFLATE,)) + bomb)
+
+
+def test_oversized_plain_frame_is_rejected():
+    with pytest.raises(WireError):
+        decode_binary(bytes((HEADER_PLAIN,)) + packb("x" * (MAX_FRAME + 1)))
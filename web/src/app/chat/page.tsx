@@ -5,7 +5,7 @@ import ProtectedRoute from "@/components/auth/ProtectedRoute";
 import { useAuth } from "@/contexts/AuthContext";
 
 interface Message {
-    id: number;
+    id: number | string;
     text: string;
     sender: string;
 }
@@ -42,13 +42,25 @@ function ChatPageContent() {
 
         fetchMessages();
 
-        ws.current = new WebSocket(`ws://127.0.0.1:8000/ws/${conversation_id}?user_id=${user?.id}`);
+        const token = localStorage.getItem('auth_tokens')
+        const auth_token = token && JSON.parse(token).access_token
+        if (!auth_token) {
+            return;
+        }
+        ws.current = new WebSocket(`ws://127.0.0.1:8000/ws/${conversation_id}?token=${encodeURIComponent(auth_token)}`);
 
         ws.current.onmessage = (event) => {
-            setMessages((prev) => [
-                ...prev,
-                { id: Date.now(), text: event.data, sender: "they" },
-            ]);
+            const frame = JSON.parse(event.data);
+            if (frame.type === "ping") {
+                ws.current?.send(JSON.stringify({ type: "pong" }));
+                return;
+            }
+            if (frame.type === "message") {
+                setMessages((prev) => [
+                    ...prev,
+                    { id: frame.message.id, text: frame.message.content, sender: "they" },
+                ]);
+            }
         };
 
         ws.current.onclose = () => { console.log("Disconnected") }